@@ -0,0 +1,224 @@
+# enrichment_store.py
+"""Columnar store of enrichment (enrichGO) and GSEA (gseGO) results.
+
+Result CSVs are ingested into Parquet files partitioned hive-style as
+``dataset=<d>/combo=<c>/ont=<o>/part-0.parquet`` under ``ENRICHMENT_STORE_DIR``
+(default ``data/enrichment_store``). Every file is sorted by ``p.adjust``, so
+dataset/combo/ontology filters prune whole partitions, and top-k queries stop
+reading each file after its first ``top_k`` matching rows (files are written in
+row groups of ``ROW_GROUP_ROWS``). All results share one schema; ``kind`` is
+``ORA`` or ``GSEA``. The enrichplot and gsego routes ingest their results
+automatically; ``/api/enrichment_store/ingest`` re-ingests existing folders.
+"""
+import os
+import re
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from app import staging
+
+STORE_DIR = Path(os.environ.get("ENRICHMENT_STORE_DIR", "data/enrichment_store"))
+ONTOLOGIES = ("BP", "CC", "MF")
+GSEA_COMBO = "gsea"
+NAME_RE = re.compile(r"^[A-Za-z0-9_.\-]+$")
+ROW_GROUP_ROWS = 1024
+
+SCHEMA = pa.schema([
+    ("kind", pa.string()),
+    ("ID", pa.string()),
+    ("Description", pa.string()),
+    ("GeneRatio", pa.string()),
+    ("BgRatio", pa.string()),
+    ("setSize", pa.float64()),
+    ("Count", pa.float64()),
+    ("enrichmentScore", pa.float64()),
+    ("NES", pa.float64()),
+    ("pvalue", pa.float64()),
+    ("p.adjust", pa.float64()),
+    ("qvalue", pa.float64()),
+    ("geneID", pa.string()),
+])
+PARTITIONING = ds.partitioning(
+    pa.schema([("dataset", pa.string()), ("combo", pa.string()), ("ont", pa.string())]),
+    flavor="hive",
+)
+
+
+def valid_name(name):
+    return bool(NAME_RE.match(str(name))) and name not in (".", "..")
+
+
+def dataset_name(analysis_dir):
+    """Default dataset for a result folder: its parent (project) folder name, made path-safe."""
+    name = re.sub(r"[^A-Za-z0-9_.\-]", "_", Path(analysis_dir).resolve().parent.name)
+    return name if valid_name(name) else "default"
+
+
+def partition_dir(dataset, combo, ont, root=STORE_DIR):
+    return Path(root) / f"dataset={dataset}" / f"combo={combo}" / f"ont={ont}"
+
+
+def _normalize(df, kind):
+    """Map an enrichGO / gseGO result table onto :data:`SCHEMA`."""
+    df = df.rename(columns={"qvalues": "qvalue", "core_enrichment": "geneID"})
+    out = pd.DataFrame(index=df.index)
+    for field in SCHEMA:
+        if field.name == "kind":
+            out["kind"] = kind
+        elif field.name in df:
+            col = df[field.name]
+            out[field.name] = col.astype(str).where(col.notna(), None) if pa.types.is_string(field.type) \
+                else pd.to_numeric(col, errors="coerce")
+        else:
+            out[field.name] = None if pa.types.is_string(field.type) else np.nan
+    return out.sort_values("p.adjust", kind="stable", na_position="last").reset_index(drop=True)
+
+
+def _write_partition(df, kind, d):
+    """Write ``df`` (sorted by p.adjust) as ``d/part-0.parquet``; returns the row count."""
+    table = pa.Table.from_pandas(_normalize(df, kind), schema=SCHEMA, preserve_index=False)
+    d.mkdir(parents=True)
+    pq.write_table(table, d / "part-0.parquet", row_group_size=ROW_GROUP_ROWS)
+    return table.num_rows
+
+
+def ingest(dataset, enrich_root=None, gsea_dir=None, root=STORE_DIR):
+    """Ingest ``<enrich_root>/<combo>/GO_<ont>_result.csv`` and ``<gsea_dir>/gse_<ont>.csv``.
+
+    The dataset is rebuilt in a temp directory and swapped in, so combos and
+    ontologies missing from the folders disappear from the store. Ingesting only
+    ``enrich_root`` replaces the ORA combos and keeps the ``gsea`` combo; only
+    ``gsea_dir`` the other way round. Returns ``{"<combo>/<ont>": rows}`` for
+    every partition written.
+    """
+    target = Path(root) / f"dataset={dataset}"
+    written = {}
+    with staging.locked(target), staging.build_dir(target) as tmp:
+        # 이번에 다시 만들지 않는 쪽(ORA / GSEA)의 partition 은 하드링크로 그대로 유지
+        for d in sorted(target.glob("combo=*")) if target.exists() else []:
+            replaced = gsea_dir if d.name == f"combo={GSEA_COMBO}" else enrich_root
+            if not replaced:
+                shutil.copytree(d, tmp / d.name, copy_function=os.link)
+        if enrich_root:
+            for csv in sorted(Path(enrich_root).glob("*/GO_*_result.csv")):
+                combo = csv.parent.name
+                ont = csv.name[len("GO_"):-len("_result.csv")]
+                if ont in ONTOLOGIES and valid_name(combo) and combo != GSEA_COMBO:
+                    written[f"{combo}/{ont}"] = _write_partition(
+                        pd.read_csv(csv), "ORA", tmp / f"combo={combo}" / f"ont={ont}")
+        if gsea_dir:
+            for ont in ONTOLOGIES:
+                csv = Path(gsea_dir) / f"gse_{ont}.csv"
+                if csv.exists():
+                    written[f"{GSEA_COMBO}/{ont}"] = _write_partition(
+                        pd.read_csv(csv), "GSEA", tmp / f"combo={GSEA_COMBO}" / f"ont={ont}")
+    return written
+
+
+def _dataset(root=STORE_DIR):
+    # "." 으로 시작하는 쓰기 중 임시 디렉토리 / lock 파일은 제외
+    return ds.dataset(str(root), format="parquet", partitioning=PARTITIONING, ignore_prefixes=[".", "_"])
+
+
+def _filter(dataset=None, combos=None, onts=None, kind=None, max_padj=None, ids=None, description=None):
+    conds = []
+    if dataset is not None:
+        conds.append(ds.field("dataset") == dataset)
+    if combos:
+        conds.append(ds.field("combo").isin(list(combos)))
+    if onts:
+        conds.append(ds.field("ont").isin(list(onts)))
+    if kind:
+        conds.append(ds.field("kind") == kind)
+    if max_padj is not None:
+        conds.append(ds.field("p.adjust") <= max_padj)
+    if ids:
+        conds.append(ds.field("ID").isin(list(ids)))
+    if description:
+        conds.append(pc.match_substring(ds.field("Description"), description, ignore_case=True))
+    expr = None
+    for c in conds:
+        expr = c if expr is None else expr & c
+    return expr
+
+
+def _head(dset, part_expr, row_expr, columns, top_k):
+    """First ``top_k`` rows matching ``row_expr`` of every partition (files are p.adjust-sorted)."""
+    keys = ["dataset", "combo", "ont"]
+    file_cols = [c for c in (columns or SCHEMA.names) if c not in keys]
+    frames = []
+    for frag in dset.get_fragments(filter=part_expr):
+        need, batches = top_k, []
+        # 파일이 p.adjust 순으로 정렬되어 있으므로 앞에서부터 top_k 행을 채우면 나머지 row group 은 읽지 않음
+        for batch in frag.to_batches(schema=dset.schema, columns=file_cols, filter=row_expr):
+            if need <= 0:
+                break
+            batch = batch.slice(0, need)
+            batches.append(batch)
+            need -= batch.num_rows
+        if not batches:
+            continue
+        df = pa.Table.from_batches(batches).to_pandas()
+        for k, v in ds.get_partition_keys(frag.partition_expression).items():
+            df[k] = v
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=keys + file_cols)
+    return pd.concat(frames, ignore_index=True)
+
+
+def query(dataset=None, combos=None, onts=None, kind=None, max_padj=None, ids=None,
+          description=None, top_k=None, columns=None, root=STORE_DIR):
+    """Filtered rows as a DataFrame, best ``top_k`` by p.adjust per (dataset, combo, ont)."""
+    if not Path(root).exists():
+        return pd.DataFrame(columns=columns or [])
+    keys = ["dataset", "combo", "ont"]
+    cols = None if not columns else list(dict.fromkeys(keys + ["p.adjust"] + list(columns)))
+    dset = _dataset(root)
+    if top_k is not None:
+        df = _head(dset, _filter(dataset, combos, onts),
+                   _filter(kind=kind, max_padj=max_padj, ids=ids, description=description), cols, top_k)
+    else:
+        df = dset.to_table(
+            columns=cols,
+            filter=_filter(dataset, combos, onts, kind, max_padj, ids, description),
+        ).to_pandas()
+    df = df.sort_values(keys + ["p.adjust"], kind="stable", na_position="last")
+    if columns:
+        df = df[list(dict.fromkeys(keys + list(columns)))]
+    return df.reset_index(drop=True)
+
+
+def term_matrix(dataset, ont, combos=None, top_k=20, max_padj=0.05, value="padj", kind="ORA",
+                root=STORE_DIR):
+    """Term x combo matrix for the union of each combo's ``top_k`` significant terms.
+
+    ``value`` is ``padj`` (-log10 p.adjust) or ``nes``; cells are NaN where the
+    term is absent from a combo's results. Only results of ``kind`` (``ORA`` by
+    default, so the ``gsea`` pseudo-combo is left out) are compared; ``None``
+    mixes both.
+    """
+    top = query(dataset=dataset, combos=combos, onts=[ont], kind=kind, max_padj=max_padj, top_k=top_k,
+                columns=["ID", "Description"], root=root)
+    terms = list(dict.fromkeys(top["ID"]))
+    if not terms:
+        return pd.DataFrame(columns=list(combos or [])), pd.Series(dtype=object)
+    all_rows = query(dataset=dataset, combos=combos, onts=[ont], kind=kind, ids=terms,
+                     columns=["ID", "Description", "NES", "p.adjust"], root=root)
+    if value == "nes":
+        all_rows["value"] = all_rows["NES"]
+    else:
+        with np.errstate(divide="ignore"):
+            all_rows["value"] = -np.log10(all_rows["p.adjust"])
+    mat = all_rows.pivot_table(index="ID", columns="combo", values="value", aggfunc="first")
+    combo_order = list(combos) if combos else sorted(all_rows["combo"].unique())
+    mat = mat.reindex(index=terms, columns=combo_order)
+    desc = all_rows.drop_duplicates("ID").set_index("ID")["Description"].reindex(terms)
+    return mat, desc
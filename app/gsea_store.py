@@ -0,0 +1,226 @@
+# gsea_store.py
+"""Precomputed GSEA running scores for drawing gseaplots without R.
+
+``rcode/gsea_store.R`` exports ``geneList.csv``, ``terms.csv`` and ``hits.csv``
+into ``<out_dir>/gsea_store/<ont>/`` when gseGO finishes. :func:`build_store`
+turns them into arrays next to the CSVs:
+
+- ``ranked.npy``      float32 ranked metric (length N, gseGO order)
+- ``running.npy``     float32 running enrichment score, terms x N
+- ``hits.npy``        int32 0-based hit positions of every term, concatenated
+- ``hit_offsets.npy`` int64 term i's hits are ``hits[off[i]:off[i + 1]]``
+
+The running score is DOSE's ``gseaScores``: hits step up by
+``|r|^exponent / NR``, misses step down by ``1 / (N - Nh)``. Arrays are
+memory-mapped, so a plot touches only the rows of the terms it draws.
+"""
+import json
+import os
+import shutil
+from html import escape
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+STORE_DIRNAME = "gsea_store"
+SOURCES = ("geneList.csv", "terms.csv", "hits.csv")
+PALETTE = ["#e41a1c", "#377eb8", "#4daf4a", "#984ea3", "#ff7f00",
+           "#a65628", "#f781bf", "#999999", "#66c2a5", "#fc8d62"]
+
+
+def store_dir(root, ont):
+    return Path(root) / STORE_DIRNAME / ont
+
+
+def _source_stat(d):
+    return {name: os.stat(d / name).st_mtime_ns for name in SOURCES}
+
+
+def running_es(ranked, positions, exponent=1.0):
+    """Running enrichment score of one gene set, as DOSE::gseaScores."""
+    n = len(ranked)
+    hit = np.zeros(n, dtype=bool)
+    hit[positions] = True
+    nh = int(hit.sum())
+    phit = np.where(hit, np.abs(ranked) ** exponent, 0.0)
+    nr = phit.sum()
+    phit = np.cumsum(phit / nr) if nr > 0 else np.zeros(n)
+    pmiss = np.cumsum(np.where(hit, 0.0, 1.0 / (n - nh))) if n > nh else np.zeros(n)
+    return phit - pmiss
+
+
+def build_store(d):
+    d = Path(d)
+    ranked = pd.read_csv(d / "geneList.csv")["score"].to_numpy(dtype=np.float64)
+    terms = pd.read_csv(d / "terms.csv")
+    hits = pd.read_csv(d / "hits.csv")
+    by_id = {tid: np.sort(g.to_numpy(dtype=np.int64) - 1) for tid, g in hits.groupby("ID")["position"]}
+    exponents = terms["exponent"] if "exponent" in terms else pd.Series(1.0, index=terms.index)
+
+    running = np.lib.format.open_memmap(
+        d / "running.npy", mode="w+", dtype=np.float32, shape=(len(terms), len(ranked))
+    )
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    all_hits = []
+    for i, (tid, exp) in enumerate(zip(terms["ID"], exponents)):
+        pos = by_id.get(tid, np.empty(0, dtype=np.int64))
+        running[i] = running_es(ranked, pos, float(exp))
+        all_hits.append(pos)
+        offsets[i + 1] = offsets[i] + len(pos)
+    running.flush()
+    del running
+
+    np.save(d / "ranked.npy", ranked.astype(np.float32))
+    np.save(d / "hits.npy", np.concatenate(all_hits).astype(np.int32) if all_hits else np.empty(0, np.int32))
+    np.save(d / "hit_offsets.npy", offsets)
+    with open(d / "meta.json", "w", encoding="utf-8") as f:
+        json.dump({"source": _source_stat(d), "terms": len(terms), "genes": len(ranked)}, f)
+
+
+def build_all(root):
+    """Build the arrays for every exported ontology under ``root``.
+
+    A directory without all three CSVs is a leftover (the R side removes
+    ``<ont>`` before exporting and exports nothing for a NULL result) and is deleted.
+    """
+    for d in sorted((Path(root) / STORE_DIRNAME).glob("*")):
+        if not d.is_dir():
+            continue
+        if all((d / name).exists() for name in SOURCES):
+            build_store(d)
+        else:
+            shutil.rmtree(d, ignore_errors=True)
+
+
+class GseaStore:
+    def __init__(self, d):
+        d = Path(d)
+        self.terms = pd.read_csv(d / "terms.csv")
+        self.ranked = np.load(d / "ranked.npy", mmap_mode="r")
+        self.running = np.load(d / "running.npy", mmap_mode="r")
+        self.hits = np.load(d / "hits.npy", mmap_mode="r")
+        self.offsets = np.load(d / "hit_offsets.npy")
+
+    def __len__(self):
+        return len(self.terms)
+
+    def curve(self, i):
+        return np.asarray(self.running[i], dtype=np.float64)
+
+    def hit_positions(self, i):
+        return np.asarray(self.hits[self.offsets[i]:self.offsets[i + 1]])
+
+    def top_by_padj(self, n):
+        padj = pd.to_numeric(self.terms["p.adjust"], errors="coerce")
+        return padj.dropna().sort_values(kind="stable").index[:n].tolist()
+
+
+def load_store(root, ont, build=True):
+    """:class:`GseaStore` for ``root``/gsea_store/``ont``; None when GSEA exported nothing."""
+    d = store_dir(root, ont)
+    if not all((d / name).exists() for name in SOURCES):
+        return None
+    try:
+        with open(d / "meta.json", encoding="utf-8") as f:
+            fresh = json.load(f)["source"] == _source_stat(d)
+    except (OSError, ValueError, KeyError):
+        fresh = False
+    if not fresh:
+        if not build:
+            return None
+        build_store(d)
+    return GseaStore(d)
+
+
+def _envelope(y, width):
+    """(x, y) pairs keeping the min and max of each pixel column so peaks survive."""
+    n = len(y)
+    if n <= 2 * width:
+        return np.arange(n), y
+    edges = np.linspace(0, n, width + 1).astype(np.int64)
+    xs, ys = [], []
+    for a, b in zip(edges[:-1], edges[1:]):
+        seg = y[a:b]
+        lo, hi = a + int(seg.argmin()), a + int(seg.argmax())
+        for k in sorted((lo, hi)):
+            xs.append(k)
+            ys.append(y[k])
+    return np.array(xs), np.array(ys)
+
+
+def render_svg(store, rows, path, title="", width=8.0, height=6.0):
+    """gseaplot2-style SVG (running score, hit ticks, ranked metric) for terms ``rows``."""
+    w, h = int(width * 72), int(height * 72)
+    left, right, top = 60, 20, 30
+    legend_h = 14 * len(rows) + 6
+    plot_w = w - left - right
+    es_h = (h - top - legend_h) * 0.6
+    tick_h = min(14.0, (h - top - legend_h) * 0.2 / max(len(rows), 1))
+    ticks_top = top + es_h + 6
+    rank_top = ticks_top + tick_h * len(rows) + 6
+    rank_h = h - legend_h - rank_top - 10
+    n = len(store.ranked)
+
+    def px(i):
+        return left + plot_w * np.asarray(i) / max(n - 1, 1)
+
+    curves = [store.curve(i) for i in rows]
+    lo = min([0.0] + [float(c.min()) for c in curves])
+    hi = max([0.0] + [float(c.max()) for c in curves])
+    span = (hi - lo) or 1.0
+
+    def py(v):
+        return top + es_h * (hi - np.asarray(v)) / span
+
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{w}" height="{h}" viewBox="0 0 {w} {h}">',
+           '<rect width="100%" height="100%" fill="white"/>']
+    if title:
+        out.append(f'<text x="{w / 2}" y="18" text-anchor="middle" font-size="13" '
+                   f'font-family="sans-serif">{escape(title)}</text>')
+
+    # running enrichment score
+    out.append(f'<line x1="{left}" y1="{py(0):.1f}" x2="{left + plot_w}" y2="{py(0):.1f}" stroke="#999" '
+               f'stroke-dasharray="3,3"/>')
+    for k, c in enumerate(curves):
+        xs, ys = _envelope(c, plot_w)
+        pts = " ".join(f"{x:.1f},{y:.1f}" for x, y in zip(px(xs), py(ys)))
+        out.append(f'<polyline points="{pts}" fill="none" stroke="{PALETTE[k % len(PALETTE)]}" '
+                   f'stroke-width="1.5"/>')
+    out.append(f'<text x="14" y="{top + es_h / 2:.1f}" font-size="10" font-family="sans-serif" '
+               f'transform="rotate(-90 14 {top + es_h / 2:.1f})" text-anchor="middle">Running Enrichment Score</text>')
+    for v in (lo, 0.0, hi):
+        out.append(f'<text x="{left - 4}" y="{py(v) + 3:.1f}" font-size="9" font-family="sans-serif" '
+                   f'text-anchor="end">{v:.2f}</text>')
+
+    # hit ticks, one row per term
+    for k, i in enumerate(rows):
+        y0 = ticks_top + k * tick_h
+        xs = np.unique(np.round(px(store.hit_positions(i)), 1))
+        d = "".join(f"M{x:.1f} {y0:.1f}v{tick_h:.1f}" for x in xs)
+        out.append(f'<path d="{d}" stroke="{PALETTE[k % len(PALETTE)]}" stroke-width="0.6"/>')
+
+    # ranked list metric
+    r = np.asarray(store.ranked, dtype=np.float64)
+    rmax = float(np.abs(r).max()) if n else 1.0
+    rmax = rmax or 1.0
+    zero_y = rank_top + rank_h / 2
+    xs, ys = _envelope(r, plot_w)
+    pts = " ".join(f"{x:.1f},{zero_y - rank_h / 2 * y / rmax:.1f}" for x, y in zip(px(xs), ys))
+    out.append(f'<polygon points="{px(0):.1f},{zero_y:.1f} {pts} {px(n - 1):.1f},{zero_y:.1f}" '
+               f'fill="#bbbbbb" stroke="#888" stroke-width="0.5"/>')
+    out.append(f'<text x="{left - 4}" y="{zero_y + 3:.1f}" font-size="9" font-family="sans-serif" '
+               f'text-anchor="end">Ranked list metric</text>')
+
+    # legend: term, NES, p.adjust
+    for k, i in enumerate(rows):
+        t = store.terms.iloc[i]
+        y = h - legend_h + 12 + 14 * k
+        label = f"{t.get('Description', t['ID'])}  NES={t.get('NES', float('nan')):.2f}  " \
+                f"p.adjust={t.get('p.adjust', float('nan')):.2g}"
+        out.append(f'<rect x="{left}" y="{y - 8}" width="10" height="10" fill="{PALETTE[k % len(PALETTE)]}"/>')
+        out.append(f'<text x="{left + 16}" y="{y}" font-size="10" font-family="sans-serif">{escape(label)}</text>')
+
+    out.append("</svg>")
+    Path(path).write_text("\n".join(out), encoding="utf-8")
+    return path
@@ -0,0 +1,240 @@
+# heatmap_tiles.py
+"""Whole-transcriptome heatmap as a multi-resolution tile pyramid.
+
+The row-scaled matrix (z-score, as pheatmap ``scale="row"``) and the sample
+distances come from the shared :mod:`app.sample_matrix` cache. Rows are ordered
+with an approximate clustering that scales to tens of thousands of genes (k-means
+into ~sqrt(n) groups, average linkage over the centroids, exact linkage inside
+each group, splitting oversized groups again), and columns with complete linkage as in run_heatmap.R.
+
+Each level below full resolution averages pairs of rows (and of columns while the
+matrix is wider than a tile), so level 0 fits in a single tile and ``max_level`` is full resolution. Each level is a
+float32 ``.npy`` file that tiles are cut from via memory mapping; PNG tiles are
+rendered on first request and cached on disk.
+"""
+import json
+import math
+import os
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.cluster.hierarchy import leaves_list, linkage
+from scipy.spatial.distance import squareform
+
+from app import sample_matrix, staging
+
+TILE_SIZE = 256
+EXACT_LINKAGE_MAX = 4000
+Z_CLIP = 3.0
+
+# run_heatmap.R 과 같은 색 (#6699e0 - white - #e06666)
+_LOW = np.array([0x66, 0x99, 0xE0], dtype=float)
+_MID = np.array([0xFF, 0xFF, 0xFF], dtype=float)
+_HIGH = np.array([0xE0, 0x66, 0x66], dtype=float)
+
+
+def tiles_dir(csv_path):
+    csv_path = Path(csv_path)
+    return csv_path.with_name(csv_path.stem + ".tiles")
+
+
+def _source_stat(csv_path):
+    st = os.stat(csv_path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _kmeans(x, k, iterations=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = x[rng.choice(len(x), size=k, replace=False)].copy()
+    x_sq = (x ** 2).sum(axis=1)[:, None]
+    for _ in range(iterations):
+        d = x_sq - 2 * x @ centers.T + (centers ** 2).sum(axis=1)[None, :]
+        labels = d.argmin(axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, x)
+        nonempty = counts > 0
+        centers[nonempty] = sums[nonempty] / counts[nonempty, None]
+    return labels, centers
+
+
+def _linkage_order(x, method):
+    if len(x) < 3:
+        return np.arange(len(x))
+    return leaves_list(linkage(x, method=method, metric="euclidean"))
+
+
+def _projection_order(x):
+    # 더 나눌 수 없는 큰 묶음 (중복 행 등): 첫 주성분 점수 순서
+    xc = x - x.mean(axis=0)
+    _, _, vt = np.linalg.svd(xc, full_matrices=False)
+    return np.argsort(xc @ vt[0], kind="stable")
+
+
+def _cluster_order(x):
+    n = len(x)
+    if n <= EXACT_LINKAGE_MAX:
+        return _linkage_order(x, "average")
+    k = int(math.ceil(math.sqrt(n)))
+    labels, centers = _kmeans(x, k)
+    if np.bincount(labels, minlength=k).max() == n:
+        return _projection_order(x)
+    order = []
+    for c in _linkage_order(centers, "average"):
+        members = np.flatnonzero(labels == c)
+        if len(members):
+            # 묶음이 EXACT_LINKAGE_MAX 보다 크면 같은 방식으로 다시 나눔
+            order.append(members[_cluster_order(x[members])])
+    return np.concatenate(order)
+
+
+def approximate_row_order(z):
+    """Dendrogram-like row order in ~O(n * sqrt(n)) instead of O(n^2) memory.
+
+    Rows without variation (constant or all-NaN, i.e. all-zero after scaling)
+    carry no clustering signal; they are left out of the clustering and placed
+    as one block after the clustered rows.
+    """
+    z = np.asarray(z, dtype=np.float64)
+    flat = ~np.any(z != 0, axis=1)
+    rows = np.flatnonzero(~flat)
+    return np.concatenate([rows[_cluster_order(z[rows])], np.flatnonzero(flat)]).astype(np.int64)
+
+
+def _downsample(mat, halve_cols):
+    """Average pairs of rows (and of columns if ``halve_cols``); odd edges keep one."""
+    r, c = mat.shape
+    fr, fc = 2, (2 if halve_cols else 1)
+    rp, cp = -(-r // fr) * fr, -(-c // fc) * fc
+    padded = np.full((rp, cp), np.nan, dtype=np.float32)
+    padded[:r, :c] = mat
+    blocks = padded.reshape(rp // fr, fr, cp // fc, fc)
+    with np.errstate(invalid="ignore"):
+        return np.nanmean(blocks, axis=(1, 3)).astype(np.float32)
+
+
+def _fresh_meta(csv_path, tile_size=None):
+    try:
+        with open(tiles_dir(csv_path) / "meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["source"] == _source_stat(csv_path) and tile_size in (None, meta["tile_size"]):
+            return meta
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def build_pyramid(csv_path, tile_size=TILE_SIZE):
+    """Build the pyramid (levels, labels, meta) in a temp directory and swap it in; returns meta.
+
+    Builds of one CSV are serialized; a request that waited for another build
+    with the same ``tile_size`` reuses it. Cached PNG tiles go with the old directory.
+    """
+    csv_path = Path(csv_path)
+    out = tiles_dir(csv_path)
+    with staging.locked(out):
+        meta = _fresh_meta(csv_path, tile_size)
+        if meta is not None:
+            return meta
+        with staging.build_dir(out) as tmp:
+            meta = _write_pyramid(csv_path, tmp, tile_size)
+    return meta
+
+
+def _write_pyramid(csv_path, out, tile_size):
+    cache = sample_matrix.load_cache(csv_path)
+    if cache is None:
+        raise ValueError(f"No sample columns found in {csv_path}")
+    genes, samples = cache.genes, cache.samples
+    z = np.nan_to_num(np.asarray(cache.z, dtype=np.float32), nan=0.0)
+    row_order = approximate_row_order(z)
+    col_order = leaves_list(linkage(squareform(cache.dist, checks=False), method="complete"))
+    z = np.ascontiguousarray(z[row_order][:, col_order])
+
+    max_level = max(0, int(math.ceil(math.log2(max(z.shape[0], z.shape[1], 1) / tile_size))))
+    level, shapes = z, {}
+    for lv in range(max_level, -1, -1):
+        np.save(out / f"level_{lv}.npy", level)
+        shapes[lv] = level.shape
+        if lv > 0:
+            # 샘플 수가 적으므로 열은 한 타일보다 넓을 때만 줄임
+            level = _downsample(level, halve_cols=level.shape[1] > tile_size)
+
+    pd.Series(genes[row_order]).to_csv(out / "genes.csv", index=False, header=["gene"])
+    meta = {
+        "source": _source_stat(csv_path),
+        "rows": int(z.shape[0]),
+        "cols": int(z.shape[1]),
+        "samples": [samples[i] for i in col_order],
+        "tile_size": tile_size,
+        "max_level": max_level,
+        "levels": [
+            {"level": lv, "rows": int(shapes[lv][0]), "cols": int(shapes[lv][1])}
+            for lv in range(max_level + 1)
+        ],
+    }
+    with open(out / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def load_meta(csv_path, build=True, tile_size=None):
+    """Pyramid metadata, (re)building it when missing, stale or of another ``tile_size``."""
+    meta = _fresh_meta(csv_path, tile_size)
+    if meta is not None or not build:
+        return meta
+    return build_pyramid(csv_path, tile_size or TILE_SIZE)
+
+
+def tile_values(csv_path, meta, level, x, y):
+    """float32 block for tile (x, y) of ``level``; None when out of range."""
+    if not 0 <= level <= meta["max_level"]:
+        return None
+    arr = np.load(tiles_dir(csv_path) / f"level_{level}.npy", mmap_mode="r")
+    t = meta["tile_size"]
+    r0, c0 = y * t, x * t
+    if x < 0 or y < 0 or r0 >= arr.shape[0] or c0 >= arr.shape[1]:
+        return None
+    return np.array(arr[r0:r0 + t, c0:c0 + t])
+
+
+def _colorize(values):
+    v = np.clip(np.nan_to_num(values, nan=0.0) / Z_CLIP, -1.0, 1.0)[..., None]
+    rgb = np.where(v < 0, _MID + (_LOW - _MID) * -v, _MID + (_HIGH - _MID) * v)
+    return rgb.round().astype(np.uint8)
+
+
+def _png(rgb):
+    h, w, _ = rgb.shape
+    raw = b"".join(b"\x00" + rgb[i].tobytes() for i in range(h))
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 6))
+            + chunk(b"IEND", b""))
+
+
+def tile_png(csv_path, meta, level, x, y):
+    """Path of the cached PNG for a tile, rendering it on first use."""
+    path = tiles_dir(csv_path) / "png" / str(level) / f"{x}_{y}.png"
+    if path.exists():
+        return path
+    values = tile_values(csv_path, meta, level, x, y)
+    if values is None:
+        return None
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = staging.temp_path(path)
+    tmp.write_bytes(_png(_colorize(values)))
+    os.replace(tmp, path)
+    return path
+
+
+def row_labels(csv_path, start, end):
+    genes = pd.read_csv(tiles_dir(csv_path) / "genes.csv")["gene"]
+    return genes.iloc[start:end].astype(str).tolist()
@@ -0,0 +1,195 @@
+# http_cache.py
+"""HTTP delivery helpers for analysis artifacts.
+
+- ETag derived from the *input* content and request parameters, so a matching
+  ``If-None-Match`` can be answered with 304 before any R process is started.
+- ``<artifact>.etag`` sidecar records which inputs produced the file on disk.
+- SVGs are served precompressed (``.svg.br`` / ``.svg.gz``, cached next to the source)
+  according to ``Accept-Encoding``.
+- Single byte ranges (``Range`` / ``If-Range``) for resuming large ZIP downloads.
+- An artifact whose sidecar no longer matches the ETag (a later run with other
+  parameters rewrote the same output location) is refused with 409 instead of
+  being served under the wrong ETag.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from app import staging
+
+try:
+    import brotli
+except ImportError:  # brotli 는 선택 사항 (없으면 gzip 만 사용)
+    brotli = None
+
+CACHE_CONTROL = "private, no-cache"
+CHUNK_SIZE = 1024 * 1024
+
+_digest_cache = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path):
+    """sha256 of a file's content, memoized on (path, size, mtime)."""
+    st = os.stat(path)
+    key = (str(Path(path).resolve()), st.st_size, st.st_mtime_ns)
+    with _digest_lock:
+        if key in _digest_cache:
+            return _digest_cache[key]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(block)
+    digest = h.hexdigest()
+    with _digest_lock:
+        _digest_cache[key] = digest
+    return digest
+
+
+def input_etag(files, params):
+    """Strong ETag for an artifact built from ``files`` with ``params``."""
+    h = hashlib.sha256()
+    for f in sorted(str(p) for p in files):
+        h.update(f.encode("utf-8"))
+        h.update(file_digest(f).encode("ascii"))
+    h.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return f'"{h.hexdigest()[:32]}"'
+
+
+def etag_matches(request: Request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = [t.strip() for t in header.split(",")]
+    return etag in tags or f"W/{etag}" in tags
+
+
+def _sidecar(artifact):
+    artifact = Path(artifact)
+    return artifact.with_name(artifact.name + ".etag")
+
+
+def stored_etag(artifact):
+    """ETag recorded for ``artifact`` if the file still exists, else None."""
+    sidecar = _sidecar(artifact)
+    if not Path(artifact).exists() or not sidecar.exists():
+        return None
+    return sidecar.read_text(encoding="utf-8").strip()
+
+
+def store_etag(artifact, etag):
+    _sidecar(artifact).write_text(etag, encoding="utf-8")
+
+
+def not_modified(etag):
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def _accepts(request: Request, coding):
+    for part in request.headers.get("accept-encoding", "").split(","):
+        token, _, q = part.strip().partition(";")
+        if token.strip().lower() == coding:
+            return q.strip() not in ("q=0", "q=0.0")
+    return False
+
+
+def _precompressed(path: Path, coding):
+    suffix = ".br" if coding == "br" else ".gz"
+    target = path.with_name(path.name + suffix)
+    if target.exists() and target.stat().st_mtime_ns >= path.stat().st_mtime_ns:
+        return target
+    data = path.read_bytes()
+    packed = brotli.compress(data) if coding == "br" else gzip.compress(data, mtime=0)
+    tmp = staging.temp_path(target)
+    tmp.write_bytes(packed)
+    os.replace(tmp, target)
+    return target
+
+
+def _parse_range(header, size):
+    """Parse a single ``bytes=`` range; return (start, end) inclusive or None."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            length = int(last)
+            if length <= 0:
+                return None
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _iter_file(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(CHUNK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def artifact_response(request: Request, path, media_type, filename, etag):
+    """Serve ``path`` with ETag/Cache-Control, SVG compression and Range support."""
+    path = Path(path)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    if stored_etag(path) != etag:
+        # 같은 출력 위치에 다른 입력/파라미터의 실행이 결과를 덮어씀
+        raise HTTPException(status_code=409, detail="Artifact was replaced by another run; retry the request")
+
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+    if media_type == "image/svg+xml":
+        headers["Vary"] = "Accept-Encoding"
+        for coding, enabled in (("br", brotli is not None), ("gzip", True)):
+            if enabled and _accepts(request, coding):
+                headers["Content-Encoding"] = coding
+                return FileResponse(
+                    _precompressed(path, coding),
+                    media_type=media_type,
+                    filename=filename,
+                    headers=headers
+                )
+        return FileResponse(path, media_type=media_type, filename=filename, headers=headers)
+
+    headers["Accept-Ranges"] = "bytes"
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        size = path.stat().st_size
+        rng = _parse_range(range_header, size)
+        if rng is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        start, end = rng
+        length = end - start + 1
+        headers.update({
+            "Content-Range": f"bytes {start}-{end}/{size}",
+            "Content-Length": str(length),
+            "Content-Disposition": f'attachment; filename="{filename}"',
+        })
+        return StreamingResponse(
+            _iter_file(path, start, length),
+            status_code=206,
+            media_type=media_type,
+            headers=headers
+        )
+
+    return FileResponse(path, media_type=media_type, filename=filename, headers=headers)
@@ -0,0 +1,286 @@
+# job_queue.py
+"""Durable SQLite (WAL) work queue shared by the API and the worker processes.
+
+Every analysis route enqueues a job whose ``route`` names a task registered in
+:mod:`app.tasks` and whose spec holds the route's validated parameters; the
+worker runs the same task function (R plus ZIP packing, ETag sidecars, ...).
+A spec ``{"script": "run_xxx.R", "args": [...]}`` runs a bare Rscript.
+Workers claim jobs with a lease, extend it with heartbeats while R runs, and a
+job whose lease expires (worker crashed or was restarted) is handed to the next
+worker until ``max_attempts`` is reached. Deterministic failures (R errors,
+invalid input) are recorded with ``retry=False`` and not retried.
+
+``lock_key`` (the job's output directory / file) keeps two jobs that write the
+same place from running at once: ``claim`` skips a queued job while another job
+holding the same key is running.
+
+``lane`` / ``slots`` (set at enqueue by ``app.scheduler``) let ``claim`` prefer
+interactive jobs and cap the R slots held by running jobs across all workers.
+"""
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+JOB_QUEUE_DB = os.environ.get("JOB_QUEUE_DB", "data/jobs.db")
+DEFAULT_LEASE = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           TEXT PRIMARY KEY,
+    route        TEXT NOT NULL,
+    spec         TEXT NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'queued',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    worker       TEXT,
+    lease_until  REAL,
+    result       TEXT,
+    error        TEXT,
+    created_at   REAL NOT NULL,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+# 기존 DB 에 나중에 추가된 열
+_COLUMNS = {
+    "error_status": "INTEGER",
+    "dedupe_key": "TEXT",
+    "lock_key": "TEXT",
+    "lane": "TEXT",
+    "slots": "INTEGER NOT NULL DEFAULT 1",
+    "input_bytes": "INTEGER",
+}
+
+
+def connect(db_path=None):
+    db_path = db_path or JOB_QUEUE_DB
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    conn.executescript(_SCHEMA)
+    _migrate(conn)
+    return conn
+
+
+def _migrate(conn):
+    have = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+    for name, decl in _COLUMNS.items():
+        if name not in have:
+            try:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {decl}")
+            except sqlite3.OperationalError:
+                pass  # 다른 프로세스가 먼저 추가함
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_dedupe_key ON jobs (dedupe_key, status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_lock_key ON jobs (lock_key, status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_lane ON jobs (status, lane, created_at)")
+
+
+def _row(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["spec"] = json.loads(job["spec"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def enqueue(route, spec, max_attempts=3, db_path=None, lock_key=None, lane=None, slots=1, input_bytes=None):
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    conn = connect(db_path)
+    try:
+        conn.execute(
+            "INSERT INTO jobs (id, route, spec, max_attempts, lock_key, lane, slots, input_bytes, "
+            "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, route, json.dumps(spec), max_attempts, lock_key, lane, max(1, slots), input_bytes, now, now),
+        )
+    finally:
+        conn.close()
+    return job_id
+
+
+def enqueue_once(route, spec, key, max_attempts=3, db_path=None, lock_key=None, lane=None, slots=1,
+                 input_bytes=None):
+    """Enqueue unless a queued/running job with the same ``key`` exists.
+
+    Returns ``(job_id, joined)``; ``joined`` is True when the existing job was returned
+    (cross-process single flight keyed by the route's input ETag).
+    """
+    now = time.time()
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running') "
+            "ORDER BY created_at LIMIT 1",
+            (key,),
+        ).fetchone()
+        if row is not None:
+            conn.execute("COMMIT")
+            return row["id"], True
+        job_id = uuid.uuid4().hex
+        conn.execute(
+            "INSERT INTO jobs (id, route, spec, max_attempts, dedupe_key, lock_key, lane, slots, input_bytes, "
+            "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, route, json.dumps(spec), max_attempts, key, lock_key, lane, max(1, slots), input_bytes,
+             now, now),
+        )
+        conn.execute("COMMIT")
+        return job_id, False
+    finally:
+        conn.close()
+
+
+def get(job_id, db_path=None):
+    conn = connect(db_path)
+    try:
+        return _row(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+    finally:
+        conn.close()
+
+
+def attach_progress(job_id, execution_id, db_path=None):
+    """Give a job without a progress channel ``execution_id``; returns the job's execution id."""
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT spec FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        spec = json.loads(row["spec"])
+        current = (spec.get("progress") or {}).get("execution_id")
+        if current is None:
+            spec["progress"] = {"execution_id": execution_id}
+            conn.execute("UPDATE jobs SET spec = ? WHERE id = ?", (json.dumps(spec), job_id))
+            current = execution_id
+        conn.execute("COMMIT")
+        return current
+    finally:
+        conn.close()
+
+
+def wait(job_id, poll=0.2, timeout=None, db_path=None):
+    """Block until the job is done or failed; returns the job (None if unknown or on timeout)."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        job = get(job_id, db_path)
+        if job is None or job["status"] in ("done", "failed"):
+            return job
+        if deadline is not None and time.monotonic() >= deadline:
+            return None
+        time.sleep(poll)
+
+
+def claim(worker_id, lease=DEFAULT_LEASE, db_path=None, total_slots=None, batch_slots=None,
+          interactive_lane="interactive"):
+    """Lease the next runnable job to ``worker_id``; return it or None.
+
+    Jobs in ``interactive_lane`` go first (then oldest first). With ``total_slots``
+    the slots held by running jobs never exceed it, and jobs outside the
+    interactive lane together hold at most ``batch_slots``.
+    """
+    conn = connect(db_path)
+    try:
+        while True:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            busy = busy_batch = 0
+            for r in conn.execute(
+                "SELECT lane, COALESCE(SUM(slots), 0) AS n FROM jobs "
+                "WHERE status = 'running' AND lease_until >= ? GROUP BY lane", (now,)
+            ):
+                busy += r["n"]
+                if r["lane"] != interactive_lane:
+                    busy_batch += r["n"]
+            if total_slots is not None and busy >= total_slots:
+                conn.execute("COMMIT")
+                return None
+
+            # 같은 출력 위치(lock_key)를 쓰는 작업이 실행 중이면 건너뜀
+            rows = conn.execute(
+                "SELECT * FROM jobs AS j WHERE (j.status = 'queued' "
+                "OR (j.status = 'running' AND j.lease_until < ?)) "
+                "AND (j.lock_key IS NULL OR NOT EXISTS ("
+                "  SELECT 1 FROM jobs AS r WHERE r.lock_key = j.lock_key AND r.id != j.id "
+                "  AND r.status = 'running' AND r.lease_until >= ?)) "
+                "ORDER BY (j.lane = ?) DESC, j.created_at",
+                (now, now, interactive_lane),
+            ).fetchall()
+            row = None
+            for cand in rows:
+                slots = cand["slots"] or 1
+                if total_slots is not None and busy + slots > total_slots:
+                    continue
+                if (batch_slots is not None and cand["lane"] != interactive_lane
+                        and busy_batch + slots > batch_slots):
+                    continue
+                row = cand
+                break
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            # 리스가 만료된 작업이 이미 재시도 한도를 넘었으면 실패 처리 후 다음 작업 확인
+            if row["attempts"] >= row["max_attempts"]:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                    (row["error"] or "lease expired (worker lost)", now, row["id"]),
+                )
+                conn.execute("COMMIT")
+                continue
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, "
+                "lease_until = ?, updated_at = ? WHERE id = ?",
+                (worker_id, now + lease, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+            return _row(conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+    finally:
+        conn.close()
+
+
+def heartbeat(job_id, worker_id, lease=DEFAULT_LEASE, db_path=None):
+    """Extend the lease; False means the job was taken over and the worker should stop."""
+    now = time.time()
+    conn = connect(db_path)
+    try:
+        cur = conn.execute(
+            "UPDATE jobs SET lease_until = ?, updated_at = ? "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (now + lease, now, job_id, worker_id),
+        )
+        return cur.rowcount == 1
+    finally:
+        conn.close()
+
+
+def complete(job_id, worker_id, result, db_path=None):
+    conn = connect(db_path)
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_until = NULL, "
+            "updated_at = ? WHERE id = ? AND worker = ?",
+            (json.dumps(result), time.time(), job_id, worker_id),
+        )
+    finally:
+        conn.close()
+
+
+def fail(job_id, worker_id, error, db_path=None, retry=True, status_code=None):
+    """Record a failed attempt; requeue unless ``retry`` is False or the job is out of attempts."""
+    conn = connect(db_path)
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = CASE WHEN ? AND attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+            "error = ?, error_status = ?, worker = NULL, lease_until = NULL, updated_at = ? "
+            "WHERE id = ? AND worker = ?",
+            (1 if retry else 0, error, status_code, time.time(), job_id, worker_id),
+        )
+    finally:
+        conn.close()
@@ -0,0 +1,156 @@
+# profiling.py
+"""Opt-in request profiling (admins only).
+
+A :class:`Profile` wraps a task. Its R child is started through the task
+context (so cancel / lease loss still kill it) under ``rcode/run_profiled.R``
+(``Rprof`` with time and memory sampling), and a thread samples the task
+thread's own Python work (paused while it only waits for R). Both are written
+as collapsed stacks (``frame;frame;frame count``), the input format of
+flamegraph.pl / speedscope / inferno:
+
+- ``profile.folded``      time samples, ``R;...`` and ``python;...`` stacks
+- ``profile_mem.folded``  R memory growth in bytes per stack
+"""
+import hmac
+import os
+import re
+import sys
+import tempfile
+import threading
+from collections import Counter
+from pathlib import Path
+
+from fastapi import HTTPException, Request
+
+RCODE_DIR = Path(__file__).resolve().parent.parent / "rcode"
+SAMPLE_INTERVAL = 0.01
+
+_MEM_LINE = re.compile(r"^:(\d+):(\d+):(\d+):(\d+):(.*)$")
+_FRAME = re.compile(r'"([^"]*)"')
+
+
+def require_admin(request: Request):
+    """Raise 403 unless the request carries the ``ADMIN_TOKEN`` in ``X-Admin-Token``."""
+    expected = os.environ.get("ADMIN_TOKEN")
+    given = request.headers.get("x-admin-token", "")
+    if not expected or not hmac.compare_digest(given, expected):
+        raise HTTPException(status_code=403, detail="Profiling is restricted to admins.")
+
+
+def parse_flag(value):
+    """Boolean request flag: accepts JSON booleans, 0/1 and "true"/"false"-style strings."""
+    if value is None:
+        return False
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ("1", "true", "yes", "on"):
+        return True
+    if isinstance(value, str) and value.strip().lower() in ("0", "false", "no", "off", ""):
+        return False
+    raise HTTPException(status_code=400, detail=f"Invalid boolean value: {value!r}")
+
+
+def _collapse_rprof(rprof_path):
+    time_stacks, mem_stacks = Counter(), Counter()
+    prev_mem = None
+    with open(rprof_path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            m = _MEM_LINE.match(line)
+            if not m:
+                continue
+            small, large, nodes = int(m.group(1)), int(m.group(2)), int(m.group(3))
+            frames = _FRAME.findall(m.group(5))
+            stack = ";".join(["R"] + frames[::-1])
+            time_stacks[stack] += 1
+            # vector heap 은 8 byte 단위, cons cell 은 56 byte 로 환산
+            mem = (small + large) * 8 + nodes * 56
+            if prev_mem is not None and mem > prev_mem:
+                mem_stacks[stack] += mem - prev_mem
+            prev_mem = mem
+    return time_stacks, mem_stacks
+
+
+class _PythonSampler(threading.Thread):
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.paused = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if self.paused.is_set():
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(["python"] + names[::-1])] += 1
+
+
+def _write_folded(path, stacks):
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f"{stack} {count}\n")
+
+
+class Profile:
+    """Profile of one task; a no-op unless ``enabled``.
+
+    Use as a context manager around the task's work and start R with
+    :meth:`run`. ``paths`` (time / memory folded files) is filled on exit.
+    """
+
+    def __init__(self, out_dir, enabled=True, interval=SAMPLE_INTERVAL):
+        self.out_dir = Path(out_dir)
+        self.enabled = enabled
+        self.interval = interval
+        self.time_stacks, self.mem_stacks = Counter(), Counter()
+        self.paths = {}
+        self._sampler = None
+
+    def __enter__(self):
+        if self.enabled:
+            self._sampler = _PythonSampler(threading.get_ident(), self.interval)
+            self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._sampler is None:
+            return False
+        self._sampler.stopped.set()
+        self._sampler.join()
+        self.time_stacks.update(self._sampler.stacks)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.paths = {"time": self.out_dir / "profile.folded", "memory": self.out_dir / "profile_mem.folded"}
+        _write_folded(self.paths["time"], self.time_stacks)
+        _write_folded(self.paths["memory"], self.mem_stacks)
+        return False
+
+    def run(self, ctx, cmd, *args, **kwargs):
+        """``ctx.run(cmd)``; when enabled ``Rscript script.R ...`` runs under Rprof."""
+        if not self.enabled:
+            return ctx.run(cmd, *args, **kwargs)
+        with tempfile.NamedTemporaryFile(suffix=".Rprof", delete=False) as tmp:
+            rprof_path = Path(tmp.name)
+        wrapped = [cmd[0], str(RCODE_DIR / "run_profiled.R"), str(rprof_path), str(self.interval)] + list(cmd[1:])
+        # R 을 기다리는 동안은 Python 샘플을 모으지 않음
+        self._sampler.paused.set()
+        try:
+            result = ctx.run(wrapped, *args, **kwargs)
+        finally:
+            self._sampler.paused.clear()
+            if rprof_path.exists():
+                time_stacks, mem_stacks = _collapse_rprof(rprof_path)
+                self.time_stacks.update(time_stacks)
+                self.mem_stacks.update(mem_stacks)
+                rprof_path.unlink()
+        return result
@@ -0,0 +1,284 @@
+# progress.py
+"""Per-execution progress channels fed from the R scripts' ``message()`` output.
+
+R scripts report milestones on stderr as::
+
+    [progress] stage=figure combo=FC1_p0.05 ont=BP file=/abs/path/GO_BP.svg
+
+``run_rscript`` streams the child's stderr line by line, turns those lines into
+events on the execution's channel and keeps the full output for error reporting.
+R runs in the worker processes, so channels and events live in the job queue's
+SQLite database, where the SSE endpoint in ``routes/fastapi_progress.py`` (API
+process) replays and follows them.
+
+The route opens the channel when it enqueues the job (``queued`` event), so a
+client can subscribe before R starts. ``finish`` closes a channel the R run
+never reached (failed before R, joined job). ``replay_done`` answers ETag /
+cached-artifact hits with the files already on disk. A request that joins
+another request's job gets its execution id aliased to that job's channel
+(``alias``), so both subscribers see the same R run.
+"""
+import json
+import subprocess
+import threading
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+from app import job_queue
+
+MARKER = "[progress]"
+CHANNEL_TTL = 3600
+
+# 캐시 응답 시 file 이벤트로 다시 알려 줄 결과 파일
+ARTIFACT_SUFFIXES = {".svg", ".png", ".pdf", ".csv", ".zip"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS progress_channels (
+    execution_id TEXT PRIMARY KEY,
+    output_root  TEXT,
+    closed       INTEGER NOT NULL DEFAULT 0,
+    created_at   REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS progress_aliases (
+    alias        TEXT PRIMARY KEY,
+    execution_id TEXT NOT NULL,
+    created_at   REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS progress_events (
+    execution_id TEXT NOT NULL,
+    id           INTEGER NOT NULL,
+    event        TEXT NOT NULL,
+    data         TEXT NOT NULL,
+    PRIMARY KEY (execution_id, id)
+);
+"""
+
+
+def _connect():
+    conn = job_queue.connect()
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _resolve(conn, execution_id):
+    row = conn.execute("SELECT execution_id FROM progress_aliases WHERE alias = ?", (execution_id,)).fetchone()
+    return execution_id if row is None else row["execution_id"]
+
+
+class Channel:
+    def __init__(self, execution_id, output_root=None):
+        self.execution_id = execution_id
+        self.output_root = Path(output_root).resolve() if output_root else None
+
+    def publish(self, event_type, **data):
+        conn = _connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO progress_events (execution_id, id, event, data) "
+                "SELECT ?, COALESCE(MAX(id), -1) + 1, ?, ? FROM progress_events WHERE execution_id = ?",
+                (self.execution_id, event_type, json.dumps(data), self.execution_id),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def since(self, last_id):
+        conn = _connect()
+        try:
+            # 구독 중에 다른 실행으로 alias 되었으면 그 채널을 따라감
+            self.execution_id = _resolve(conn, self.execution_id)
+            rows = conn.execute(
+                "SELECT id, event, data FROM progress_events WHERE execution_id = ? AND id > ? ORDER BY id",
+                (self.execution_id, last_id),
+            ).fetchall()
+            closed = conn.execute(
+                "SELECT closed FROM progress_channels WHERE execution_id = ?", (self.execution_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        events = [{"id": r["id"], "event": r["event"], "data": json.loads(r["data"])} for r in rows]
+        return events, bool(closed is None or closed["closed"])
+
+    def close(self, status, **data):
+        self.publish(status, **data)
+        conn = _connect()
+        try:
+            conn.execute("UPDATE progress_channels SET closed = 1 WHERE execution_id = ?", (self.execution_id,))
+        finally:
+            conn.close()
+
+    def close_if_open(self, status, **data):
+        """Publish the final ``status`` event unless the channel is already closed."""
+        conn = _connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            cur = conn.execute(
+                "UPDATE progress_channels SET closed = 1 WHERE execution_id = ? AND closed = 0",
+                (self.execution_id,),
+            )
+            if cur.rowcount:
+                conn.execute(
+                    "INSERT INTO progress_events (execution_id, id, event, data) "
+                    "SELECT ?, COALESCE(MAX(id), -1) + 1, ?, ? FROM progress_events WHERE execution_id = ?",
+                    (self.execution_id, status, json.dumps(data), self.execution_id),
+                )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return bool(cur.rowcount)
+
+
+def open_channel(execution_id, output_root=None):
+    now = time.time()
+    root = str(Path(output_root).resolve()) if output_root else None
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        expired = [r["execution_id"] for r in conn.execute(
+            "SELECT execution_id FROM progress_channels WHERE created_at < ?", (now - CHANNEL_TTL,))]
+        for key in expired:
+            conn.execute("DELETE FROM progress_events WHERE execution_id = ?", (key,))
+            conn.execute("DELETE FROM progress_channels WHERE execution_id = ?", (key,))
+        conn.execute("DELETE FROM progress_aliases WHERE created_at < ? OR alias = ?",
+                     (now - CHANNEL_TTL, execution_id))
+        row = conn.execute("SELECT * FROM progress_channels WHERE execution_id = ?", (execution_id,)).fetchone()
+        if row is None or row["closed"]:
+            # 끝난 채널과 같은 id 로 다시 실행하면 새 채널로 시작
+            conn.execute("DELETE FROM progress_events WHERE execution_id = ?", (execution_id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO progress_channels (execution_id, output_root, closed, created_at) "
+                "VALUES (?, ?, 0, ?)",
+                (execution_id, root, now),
+            )
+        elif root and row["output_root"] is None:
+            conn.execute("UPDATE progress_channels SET output_root = ? WHERE execution_id = ?", (root, execution_id))
+        else:
+            root = row["output_root"]
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return Channel(execution_id, root)
+
+
+def get_channel(execution_id):
+    conn = _connect()
+    try:
+        execution_id = _resolve(conn, execution_id)
+        row = conn.execute("SELECT * FROM progress_channels WHERE execution_id = ?", (execution_id,)).fetchone()
+    finally:
+        conn.close()
+    return None if row is None else Channel(execution_id, row["output_root"])
+
+
+def alias(execution_id, target):
+    """Make ``execution_id`` follow ``target``'s channel (request joined ``target``'s job)."""
+    if execution_id == target:
+        return
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM progress_events WHERE execution_id = ?", (execution_id,))
+        conn.execute("DELETE FROM progress_channels WHERE execution_id = ?", (execution_id,))
+        conn.execute(
+            "INSERT OR REPLACE INTO progress_aliases (alias, execution_id, created_at) VALUES (?, ?, ?)",
+            (execution_id, _resolve(conn, target), time.time()),
+        )
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def finish(execution_id, status="done", **data):
+    """Close ``execution_id``'s channel if nothing closed it yet."""
+    ch = get_channel(execution_id)
+    if ch is not None:
+        ch.close_if_open(status, **data)
+
+
+def replay_done(execution_id, output_root):
+    """Channel for a request answered from cache: ``file`` events for what is on disk, then ``done``."""
+    if not execution_id:
+        return
+    ch = open_channel(execution_id, output_root)
+    root = Path(output_root)
+    if root.is_dir():
+        for f in sorted(root.rglob("*")):
+            if f.is_file() and f.suffix.lower() in ARTIFACT_SUFFIXES:
+                ch.publish("file", **_file_event(execution_id, ch, {"stage": "cached", "file": str(f)}))
+    ch.close("done", cached=True)
+
+
+def parse_line(line):
+    """Parse a ``[progress]`` line into a dict, or None for ordinary output."""
+    line = line.strip()
+    if not line.startswith(MARKER):
+        return None
+    body = line[len(MARKER):].strip()
+    fields = {}
+    if body.startswith("file="):
+        head, file_part = "", body[len("file="):]
+    else:
+        head, sep, file_part = body.partition(" file=")
+        if not sep:
+            file_part = None
+    if file_part is not None:
+        fields["file"] = file_part.strip()
+    for token in head.split():
+        key, eq, value = token.partition("=")
+        if eq:
+            fields[key] = value
+    return fields
+
+
+def _file_event(execution_id, ch, fields):
+    path = Path(fields["file"]).resolve()
+    if ch.output_root is not None:
+        try:
+            rel = path.relative_to(ch.output_root).as_posix()
+            fields["path"] = rel
+            fields["url"] = f"/api/progress/{execution_id}/files?path={quote(rel)}"
+        except ValueError:
+            pass
+    return fields
+
+
+def run_rscript(cmd, execution_id, output_root=None, on_start=None):
+    """``subprocess.run`` replacement that publishes progress for ``execution_id``.
+
+    ``on_start(proc)`` receives the child process (the worker uses it to kill R
+    when the job's lease is lost).
+    """
+    ch = open_channel(execution_id, output_root)
+    ch.publish("started", cmd=cmd[1] if len(cmd) > 1 else cmd[0])
+
+    proc = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        text=True, encoding="utf-8", bufsize=1
+    )
+    if on_start is not None:
+        on_start(proc)
+    stdout_chunks = []
+    reader = threading.Thread(target=lambda: stdout_chunks.append(proc.stdout.read()), daemon=True)
+    reader.start()
+
+    stderr_lines = []
+    for line in proc.stderr:
+        stderr_lines.append(line)
+        fields = parse_line(line)
+        if fields is None:
+            continue
+        if "file" in fields:
+            ch.publish("file", **_file_event(execution_id, ch, fields))
+        else:
+            ch.publish("stage", **fields)
+
+    returncode = proc.wait()
+    reader.join()
+    stderr = "".join(stderr_lines)
+    if returncode == 0:
+        ch.close("done")
+    else:
+        ch.close("error", detail=stderr[-2000:])
+    return subprocess.CompletedProcess(cmd, returncode, "".join(stdout_chunks), stderr)
@@ -0,0 +1,201 @@
+# row_index.py
+"""Persisted row indexes for uploaded datasets and enrichment tables.
+
+For ``<name>.csv`` an index directory ``<name>.index/`` holds:
+
+- ``offsets.npy``  byte offset of every data row (plus end of file)
+- ``order_<key>.npy`` / ``sorted_<key>.npy``  permutation and sorted values for
+  ascending ``pvalue`` / ``p.adjust`` (``padj``) and descending ``|log2FC|``
+  (``abslfc``) / ``|foldchange|`` (``absfc``, what run_deg.R thresholds)
+- ``gene_keys.npy`` / ``gene_rows.npy``  sorted gene IDs -> row
+- ``colclasses.csv``  R column classes of the full table, written by
+  ``rcode/run_deg.R`` on first use so row subsets are parsed like the full file
+
+All arrays are memory-mapped on load, so top-N, threshold and gene queries read
+only the rows they return from the CSV. Building reads the CSV in ``CHUNK_ROWS``
+chunks holding only the key columns, so memory grows with the row count, not
+with the table width. Builds are serialized per CSV and written into a temp
+directory that replaces the index only when complete (``app/staging.py``).
+"""
+import io
+import json
+import mmap
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from app import staging
+
+BLOCK_SIZE = 64 * 1024 * 1024
+CHUNK_ROWS = 100_000
+CLASSES_FILE = "colclasses.csv"
+GENE_COLUMNS = ("Geneid", "Gene_Symbol", "SYMBOL", "gene", "ID")
+ASC_KEYS = {"pvalue": "pvalue", "padj": "p.adjust"}
+ABS_KEYS = {"abslfc": "log2FC", "absfc": "foldchange"}
+
+
+def index_dir(csv_path):
+    csv_path = Path(csv_path)
+    return csv_path.with_name(csv_path.stem + ".index")
+
+
+def _line_offsets(csv_path):
+    """Byte offsets of each line start after the header, plus the end of the data."""
+    size = os.path.getsize(csv_path)
+    starts = []
+    with open(csv_path, "rb") as f:
+        pos = 0
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            nl = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+            starts.append(nl + pos + 1)
+            pos += len(block)
+    starts = np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64)
+    starts = starts[starts < size]
+    return np.append(starts, size).astype(np.int64)
+
+
+def _source_stat(csv_path):
+    st = os.stat(csv_path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _is_fresh(csv_path):
+    try:
+        with open(index_dir(csv_path) / "meta.json", encoding="utf-8") as f:
+            return json.load(f)["source"] == _source_stat(csv_path)
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def _save_order(out, key, vals):
+    order = np.argsort(vals, kind="stable")
+    np.save(out / f"order_{key}.npy", order.astype(np.int64))
+    np.save(out / f"sorted_{key}.npy", vals[order])
+
+
+def build_index(csv_path):
+    """Build the index for ``csv_path``; returns the index dir or None if unsupported."""
+    csv_path = Path(csv_path)
+    out = index_dir(csv_path)
+    with staging.locked(out):
+        # lock 을 기다리는 동안 다른 요청이 같은 CSV 로 이미 만들었으면 그대로 사용
+        if _is_fresh(csv_path):
+            return out
+
+        offsets = _line_offsets(csv_path)
+        header = pd.read_csv(csv_path, nrows=0).columns
+        gene_col = next((c for c in GENE_COLUMNS if c in header), header[0])
+        value_cols = {col: key for key, col in (*ASC_KEYS.items(), *ABS_KEYS.items()) if col in header}
+        usecols = [gene_col] + [c for c in value_cols if c != gene_col]
+
+        # 필요한 열만 chunk 단위로 읽어 행 수와 값을 모음
+        n_rows, genes, values = 0, [], {col: [] for col in value_cols}
+        for chunk in pd.read_csv(csv_path, usecols=usecols, dtype={gene_col: str}, keep_default_na=False,
+                                 skip_blank_lines=False, chunksize=CHUNK_ROWS):
+            n_rows += len(chunk)
+            genes.append(chunk[gene_col].astype(str).to_numpy())
+            for col in value_cols:
+                values[col].append(pd.to_numeric(chunk[col], errors="coerce").to_numpy(dtype=float))
+        # 따옴표 안 줄바꿈 등으로 행 수가 맞지 않으면 인덱스를 만들지 않음
+        if len(offsets) - 1 != n_rows:
+            return None
+
+        with staging.build_dir(out) as tmp:
+            np.save(tmp / "offsets.npy", offsets)
+            keys = []
+            for col, key in value_cols.items():
+                vals = np.concatenate(values[col]) if values[col] else np.zeros(0)
+                # 내림차순 |값| 은 -|값| 의 오름차순으로 저장 (NaN 은 항상 끝)
+                _save_order(tmp, key, -np.abs(vals) if key in ABS_KEYS else vals)
+                keys.append(key)
+
+            genes = np.concatenate(genes).astype(str) if genes else np.zeros(0, dtype=str)
+            order = np.argsort(genes, kind="stable")
+            np.save(tmp / "gene_keys.npy", genes[order])
+            np.save(tmp / "gene_rows.npy", order.astype(np.int64))
+
+            with open(tmp / "meta.json", "w", encoding="utf-8") as f:
+                json.dump({"source": _source_stat(csv_path), "rows": n_rows,
+                           "keys": keys, "gene_column": gene_col}, f)
+    return out
+
+
+class RowIndex:
+    def __init__(self, csv_path):
+        self.csv_path = Path(csv_path)
+        self.dir = index_dir(csv_path)
+        with open(self.dir / "meta.json", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.offsets = np.load(self.dir / "offsets.npy", mmap_mode="r")
+
+    def _load(self, name):
+        return np.load(self.dir / f"{name}.npy", mmap_mode="r")
+
+    def has(self, key):
+        return key in self.meta["keys"]
+
+    def top_n(self, key, n):
+        """Row numbers of the ``n`` best rows for ``key`` (ties keep file order)."""
+        return np.asarray(self._load(f"order_{key}")[:n])
+
+    def rows_at_most(self, key, threshold, include_nan=False):
+        """Rows whose ``key`` value is <= threshold (for abslfc / absfc: |value| >= threshold)."""
+        sorted_vals = self._load(f"sorted_{key}")
+        if key in ABS_KEYS:
+            threshold = -threshold
+        k = int(np.searchsorted(sorted_vals, threshold, side="right"))
+        rows = self._load(f"order_{key}")[:k]
+        if include_nan:
+            nan_start = int(np.searchsorted(sorted_vals, np.nan, side="left"))
+            rows = np.concatenate([rows, self._load(f"order_{key}")[nan_start:]])
+        return np.asarray(rows)
+
+    def lookup(self, genes):
+        """Rows of every occurrence of ``genes`` in the gene column, in file order."""
+        keys = self._load("gene_keys")
+        rows = self._load("gene_rows")
+        genes = np.unique(np.asarray([str(g) for g in genes]))
+        lo = np.searchsorted(keys, genes, side="left")
+        hi = np.searchsorted(keys, genes, side="right")
+        found = [np.asarray(rows[a:b]) for a, b in zip(lo, hi) if b > a]
+        return np.sort(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+    def classes_path(self):
+        return self.dir / CLASSES_FILE
+
+    def _copy_rows(self, rows, dst):
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        with open(self.csv_path, "rb") as src:
+            with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                dst.write(mm[:int(self.offsets[0])])
+                for r in rows.tolist():
+                    line = mm[int(self.offsets[r]):int(self.offsets[r + 1])]
+                    dst.write(line if line.endswith(b"\n") else line + b"\n")
+
+    def write_rows(self, rows, out_path):
+        """Write header + ``rows`` (in original file order) to ``out_path``."""
+        with open(out_path, "wb") as dst:
+            self._copy_rows(rows, dst)
+        return out_path
+
+    def read_rows(self, rows, **kwargs):
+        """``pd.read_csv`` of ``rows`` only, indexed by row number (``.loc[rows]`` keeps rank order)."""
+        buf = io.BytesIO()
+        self._copy_rows(rows, buf)
+        buf.seek(0)
+        df = pd.read_csv(buf, **kwargs)
+        df.index = np.unique(np.asarray(rows, dtype=np.int64))
+        return df
+
+
+def load_index(csv_path, build=True):
+    """Return a fresh :class:`RowIndex` for ``csv_path``, (re)building it when stale."""
+    if not _is_fresh(csv_path):
+        if not build or build_index(csv_path) is None:
+            return None
+    return RowIndex(csv_path)
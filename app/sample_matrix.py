@@ -0,0 +1,248 @@
+# sample_matrix.py
+"""Shared sample-level matrix cache for PCA, heatmap and clustering.
+
+For ``<name>.csv`` the directory ``<name>.samples/`` holds the expression matrix
+and everything derived from it that the plotting scripts used to recompute on
+every call. Matrices are raw little-endian binaries so R can ``readBin`` them
+(see ``rcode/sample_matrix.R``) and numpy can memory-map them:
+
+- ``matrix.bin``  float32 genes x samples, column-major (one sample contiguous)
+- ``z.bin``       float32 genes x samples, per-gene z-score (pheatmap ``scale="row"``
+  / ``scale()`` in run_pca.R); NaN for genes with zero variance
+- ``mean.bin`` / ``var.bin``  float32 per-gene mean and variance (ddof=1)
+- ``cor.bin``     float64 samples x samples Pearson correlation of the raw matrix
+- ``dist.bin``    float64 samples x samples Euclidean distance of the z-scored matrix
+- ``pvalue_order.bin``  int32 0-based row order by ascending ``pvalue`` (NaN last)
+- ``genes.csv`` / ``samples.csv`` (sample, group) / ``meta.json``
+
+Sample columns are every column after the first matching ``(^Group)|([0-9]+$)``;
+groups strip the trailing replicate number as run_pca.R / run_heatmap.R do.
+Correlation and distance come from ``X.T @ X`` products accumulated chunk by chunk (BLAS).
+"""
+import json
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from app import staging
+
+SAMPLE_RE = re.compile(r"(^Group)|([0-9]+$)")
+GROUP_RE = re.compile(r"(_[0-9]+$)|([0-9]+$)")
+CHUNK_ROWS = 50_000
+
+
+def cache_dir(csv_path):
+    csv_path = Path(csv_path)
+    return csv_path.with_name(csv_path.stem + ".samples")
+
+
+def _source_stat(csv_path):
+    st = os.stat(csv_path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _is_fresh(csv_path):
+    try:
+        with open(cache_dir(csv_path) / "meta.json", encoding="utf-8") as f:
+            return json.load(f)["source"] == _source_stat(csv_path)
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def _write_matrix(path, mat, dtype):
+    # 열 우선(column-major) 순서로 저장 → R 의 matrix(readBin(...), nrow=) 와 같은 배치
+    np.ascontiguousarray(np.asarray(mat).T, dtype=dtype).tofile(path)
+
+
+def _gram_distance(g):
+    """Euclidean distances between columns from their Gram matrix ``X.T @ X``."""
+    sq = np.diag(g)
+    d2 = np.maximum(sq[:, None] + sq[None, :] - 2.0 * g, 0.0)
+    np.fill_diagonal(d2, 0.0)
+    return np.sqrt(d2)
+
+
+class _CoMoments:
+    """Running column means and centered cross products (Chan et al. pairwise update)."""
+
+    def __init__(self, k):
+        self.n = 0
+        self.mean = np.zeros(k)
+        self.m2 = np.zeros((k, k))
+
+    def add(self, x):
+        nb = len(x)
+        if nb == 0:
+            return
+        mb = x.mean(axis=0)
+        xc = x - mb
+        delta = mb - self.mean
+        n = self.n + nb
+        self.m2 += xc.T @ xc + np.outer(delta, delta) * (self.n * nb / n)
+        self.mean += delta * (nb / n)
+        self.n = n
+
+    def correlation(self):
+        if self.n == 0:
+            return np.full(self.m2.shape, np.nan)
+        sd = np.sqrt(np.diag(self.m2))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.m2 / np.outer(sd, sd)
+
+
+def _write_cache(csv_path, tmp, samples, gene_col, has_pvalue, usecols):
+    # 1차: 행 수 (column-major 파일 크기를 정하기 위해)
+    n = sum(len(c) for c in pd.read_csv(csv_path, usecols=[gene_col], chunksize=CHUNK_ROWS))
+
+    k = len(samples)
+    # (samples, genes) 행 우선 = (genes, samples) 열 우선
+    mat_out = np.memmap(tmp / "matrix.bin", dtype="<f4", mode="w+", shape=(k, n)) if n else None
+    z_out = np.memmap(tmp / "z.bin", dtype="<f4", mode="w+", shape=(k, n)) if n else None
+    cor_acc = _CoMoments(k)
+    z_gram = np.zeros((k, k))
+    n_complete = n_z_complete = 0
+    pvalues = []
+
+    # 2차: chunk 별로 행렬 / z-score / 통계를 계산해 기록
+    r0 = 0
+    with open(tmp / "mean.bin", "wb") as f_mean, open(tmp / "var.bin", "wb") as f_var, \
+            open(tmp / "genes.csv", "w", encoding="utf-8", newline="") as f_genes:
+        f_genes.write("gene\n")
+        for chunk in pd.read_csv(csv_path, usecols=usecols, dtype={gene_col: str}, chunksize=CHUNK_ROWS):
+            mat = chunk[samples].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = np.nanmean(mat, axis=1)
+                var = np.nanvar(mat, axis=1, ddof=1)
+                z = (mat - mean[:, None]) / np.sqrt(var)[:, None]
+            z[~np.isfinite(z)] = np.nan
+
+            r1 = r0 + len(mat)
+            mat_out[:, r0:r1] = mat.T
+            z_out[:, r0:r1] = z.T
+            mean.astype("<f4").tofile(f_mean)
+            var.astype("<f4").tofile(f_var)
+
+            complete = np.isfinite(mat).all(axis=1)
+            cor_acc.add(mat[complete])
+            n_complete += int(complete.sum())
+            zc = z[np.isfinite(z).all(axis=1)]
+            z_gram += zc.T @ zc
+            n_z_complete += len(zc)
+
+            if has_pvalue:
+                pvalues.append(pd.to_numeric(chunk["pvalue"], errors="coerce").to_numpy(dtype=float))
+            pd.DataFrame({"gene": chunk[gene_col].astype(str)}).to_csv(f_genes, index=False, header=False)
+            r0 = r1
+
+    for mm in (mat_out, z_out):
+        if mm is not None:
+            mm.flush()
+    del mat_out, z_out
+
+    _write_matrix(tmp / "cor.bin", cor_acc.correlation(), "<f8")
+    _write_matrix(tmp / "dist.bin", _gram_distance(z_gram), "<f8")
+
+    if has_pvalue:
+        pvals = np.concatenate(pvalues) if pvalues else np.zeros(0)
+        np.argsort(pvals, kind="stable").astype("<i4").tofile(tmp / "pvalue_order.bin")
+
+    groups = [GROUP_RE.sub("", s) for s in samples]
+    pd.DataFrame({"sample": samples, "group": groups}).to_csv(tmp / "samples.csv", index=False)
+    with open(tmp / "meta.json", "w", encoding="utf-8") as f:
+        json.dump({
+            "source": _source_stat(csv_path),
+            "genes": int(r0),
+            "samples": samples,
+            "groups": groups,
+            "complete_genes": n_complete,
+            "z_complete_genes": n_z_complete,
+            "pvalue_order": has_pvalue,
+        }, f)
+
+
+
+def build_cache(csv_path):
+    """Build the cache for ``csv_path``; returns its directory or None without sample columns.
+
+    The CSV is read in ``CHUNK_ROWS`` chunks: matrix / z rows go straight into
+    memory-mapped column-major files, correlation and distance are accumulated
+    from per-chunk cross products, so memory does not grow with the table.
+    Builds of one CSV are serialized and written into a private temp directory
+    that replaces the cache only when complete (see ``app/staging.py``).
+    """
+    csv_path = Path(csv_path)
+    header = pd.read_csv(csv_path, nrows=0).columns
+    samples = [str(c) for c in header[1:] if SAMPLE_RE.search(str(c))]
+    if len(samples) < 2:
+        return None
+    gene_col = header[0]
+    has_pvalue = "pvalue" in header
+    usecols = [gene_col] + [c for c in header[1:] if str(c) in samples or (c == "pvalue" and c != gene_col)]
+
+    out = cache_dir(csv_path)
+    with staging.locked(out):
+        # lock 을 기다리는 동안 다른 요청이 같은 CSV 로 이미 만들었으면 그대로 사용
+        if _is_fresh(csv_path):
+            return out
+        with staging.build_dir(out) as tmp:
+            _write_cache(csv_path, tmp, samples, gene_col, has_pvalue, usecols)
+    return out
+
+
+class SampleMatrix:
+    def __init__(self, csv_path):
+        self.dir = cache_dir(csv_path)
+        with open(self.dir / "meta.json", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.samples = self.meta["samples"]
+        self.groups = self.meta["groups"]
+        self.shape = (self.meta["genes"], len(self.samples))
+
+    def _matrix(self, name, dtype, shape):
+        if shape[0] == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self.dir / name, dtype=dtype, mode="r", shape=shape, order="F")
+
+    @property
+    def matrix(self):
+        return self._matrix("matrix.bin", "<f4", self.shape)
+
+    @property
+    def z(self):
+        return self._matrix("z.bin", "<f4", self.shape)
+
+    @property
+    def mean(self):
+        return np.fromfile(self.dir / "mean.bin", dtype="<f4")
+
+    @property
+    def var(self):
+        return np.fromfile(self.dir / "var.bin", dtype="<f4")
+
+    @property
+    def cor(self):
+        n = len(self.samples)
+        return np.fromfile(self.dir / "cor.bin", dtype="<f8").reshape(n, n)
+
+    @property
+    def dist(self):
+        n = len(self.samples)
+        return np.fromfile(self.dir / "dist.bin", dtype="<f8").reshape(n, n)
+
+    @property
+    def genes(self):
+        return pd.read_csv(self.dir / "genes.csv", dtype=str, keep_default_na=False)["gene"].to_numpy()
+
+    def has_pvalue_order(self):
+        return bool(self.meta.get("pvalue_order"))
+
+
+def load_cache(csv_path, build=True):
+    """Return a :class:`SampleMatrix` for ``csv_path``, (re)building it when stale."""
+    if not _is_fresh(csv_path):
+        if not build or build_cache(csv_path) is None:
+            return None
+    return SampleMatrix(csv_path)
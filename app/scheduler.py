@@ -0,0 +1,195 @@
+# scheduler.py
+"""Priority lanes for R execution, enforced by the job queue.
+
+Every R run happens in a ``worker.py`` process, so lanes live in the queue's
+SQLite database rather than in any one process. A job gets its lane when it is
+enqueued (``tasks.dispatch`` calls :func:`classify`): routes belong to an
+*interactive* lane (quick plots) or a *batch* lane (GSEA / enrichment).
+``job_queue.claim`` (through :func:`claim`) then
+
+- hands out queued interactive jobs before queued batch jobs,
+- keeps the R slots held by running jobs, across all workers, at most
+  ``R_SLOTS`` (default: CPU count),
+- keeps ``R_INTERACTIVE_RESERVED`` of them (default: a quarter, at least one)
+  for interactive jobs only, so batch work can never starve quick plots.
+
+An interactive request whose estimated cost exceeds ``INTERACTIVE_BUDGET_SEC``
+is demoted to the batch lane. The cost model is ``base + slope * MB`` fitted per
+route by least squares over the last ``HISTORY_SIZE`` finished runs recorded in
+the ``run_history`` table (both terms kept non-negative); until runs of
+different input sizes have been seen it is just the mean run time.
+
+A job that runs several R processes at once (the pipeline forks one child per
+independent branch) holds one slot per process (``slots`` column).
+"""
+import os
+import time
+from pathlib import Path
+
+from app import job_queue
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+ROUTE_LANES = {
+    "heatmap": INTERACTIVE,
+    "volcano": INTERACTIVE,
+    "pca": INTERACTIVE,
+    "deg": INTERACTIVE,
+    "cnetplot": INTERACTIVE,
+    "emapplot": INTERACTIVE,
+    "gseaplot_total": INTERACTIVE,
+    "gseaplot_term": INTERACTIVE,
+    "pathway_gene": INTERACTIVE,
+    "string": INTERACTIVE,
+    "heatmap_tiles": BATCH,
+    "enrichplot": BATCH,
+    "gsego": BATCH,
+    "ridgeplot": BATCH,
+    "pipeline": BATCH,
+}
+
+TOTAL_SLOTS = max(1, int(os.environ.get("R_SLOTS", os.cpu_count() or 2)))
+INTERACTIVE_RESERVED = int(os.environ.get("R_INTERACTIVE_RESERVED", max(1, TOTAL_SLOTS // 4)))
+INTERACTIVE_RESERVED = min(max(0, INTERACTIVE_RESERVED), TOTAL_SLOTS - 1) if TOTAL_SLOTS > 1 else 0
+INTERACTIVE_BUDGET_SEC = float(os.environ.get("INTERACTIVE_BUDGET_SEC", 30))
+HISTORY_SIZE = 50
+MIN_SPREAD_MB = 0.1   # 입력 크기 차이가 이보다 작으면 기울기를 추정하지 않음
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS run_history (
+    route       TEXT NOT NULL,
+    input_bytes INTEGER NOT NULL,
+    seconds     REAL NOT NULL,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS run_history_route ON run_history (route, finished_at);
+"""
+
+
+def _connect(db_path=None):
+    conn = job_queue.connect(db_path)
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def capacity(lane):
+    return TOTAL_SLOTS if lane == INTERACTIVE else TOTAL_SLOTS - INTERACTIVE_RESERVED
+
+
+def fit_cost(samples):
+    """Least-squares ``seconds = base + slope * mb`` with ``base, slope >= 0``."""
+    n = len(samples)
+    mean_mb = sum(mb for mb, _ in samples) / n
+    mean_s = sum(s for _, s in samples) / n
+    var = sum((mb - mean_mb) ** 2 for mb, _ in samples)
+    spread = max(mb for mb, _ in samples) - min(mb for mb, _ in samples)
+    if spread < MIN_SPREAD_MB or var <= 0:
+        return mean_s, 0.0
+    slope = sum((mb - mean_mb) * (s - mean_s) for mb, s in samples) / var
+    if slope <= 0:
+        return mean_s, 0.0
+    base = mean_s - slope * mean_mb
+    if base < 0:
+        # 원점을 지나는 직선으로 다시 맞춤
+        slope = sum(mb * s for mb, s in samples) / sum(mb * mb for mb, _ in samples)
+        base = 0.0
+    return base, slope
+
+
+def _samples(conn, route):
+    rows = conn.execute(
+        "SELECT input_bytes, seconds FROM run_history WHERE route = ? ORDER BY finished_at DESC LIMIT ?",
+        (route, HISTORY_SIZE),
+    ).fetchall()
+    return [(r["input_bytes"] / 1e6, r["seconds"]) for r in rows]
+
+
+def estimate(route, input_bytes, db_path=None):
+    """Expected seconds for ``route`` on ``input_bytes`` of input (None if no history)."""
+    conn = _connect(db_path)
+    try:
+        samples = _samples(conn, route)
+    finally:
+        conn.close()
+    if not samples:
+        return None
+    base, per_mb = fit_cost(samples)
+    return base + per_mb * input_bytes / 1e6
+
+
+def observe(route, input_bytes, seconds, db_path=None):
+    """Record a finished run (called by the worker) and drop history beyond ``HISTORY_SIZE``."""
+    conn = _connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT INTO run_history (route, input_bytes, seconds, finished_at) VALUES (?, ?, ?, ?)",
+            (route, max(int(input_bytes or 0), 0), seconds, time.time()),
+        )
+        conn.execute(
+            "DELETE FROM run_history WHERE route = ? AND rowid NOT IN ("
+            "  SELECT rowid FROM run_history WHERE route = ? ORDER BY finished_at DESC LIMIT ?)",
+            (route, route, HISTORY_SIZE),
+        )
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def classify(route, input_bytes, db_path=None):
+    lane = ROUTE_LANES.get(route, BATCH)
+    if lane == INTERACTIVE:
+        est = estimate(route, input_bytes, db_path)
+        if est is not None and est > INTERACTIVE_BUDGET_SEC:
+            return BATCH
+    return lane
+
+
+def claim(worker_id, lease=job_queue.DEFAULT_LEASE, db_path=None):
+    """``job_queue.claim`` with this machine's slot limits."""
+    return job_queue.claim(worker_id, lease, db_path, total_slots=TOTAL_SLOTS,
+                           batch_slots=capacity(BATCH), interactive_lane=INTERACTIVE)
+
+
+def stats(db_path=None):
+    now = time.time()
+    conn = _connect(db_path)
+    try:
+        running = {INTERACTIVE: 0, BATCH: 0}
+        for r in conn.execute(
+            "SELECT lane, COALESCE(SUM(slots), 0) AS n FROM jobs "
+            "WHERE status = 'running' AND lease_until >= ? GROUP BY lane", (now,)
+        ):
+            running[r["lane"] or BATCH] = running.get(r["lane"] or BATCH, 0) + r["n"]
+        waiting = {INTERACTIVE: 0, BATCH: 0}
+        for r in conn.execute("SELECT lane, COUNT(*) AS n FROM jobs WHERE status = 'queued' GROUP BY lane"):
+            waiting[r["lane"] or BATCH] = waiting.get(r["lane"] or BATCH, 0) + r["n"]
+        history = {}
+        for r in conn.execute("SELECT DISTINCT route FROM run_history"):
+            samples = _samples(conn, r["route"])
+            base, per_mb = fit_cost(samples)
+            history[r["route"]] = {"base_sec": base, "sec_per_mb": per_mb, "samples": len(samples)}
+    finally:
+        conn.close()
+    return {
+        "total_slots": TOTAL_SLOTS,
+        "interactive_reserved": INTERACTIVE_RESERVED,
+        "running": running,
+        "waiting": waiting,
+        "history": history,
+    }
+
+
+def input_size(*paths):
+    """Total bytes of the given files (directories are summed recursively)."""
+    total = 0
+    for p in paths:
+        if p is None:
+            continue
+        p = Path(p)
+        if p.is_file():
+            total += p.stat().st_size
+        elif p.is_dir():
+            total += sum(f.stat().st_size for f in p.rglob("*") if f.is_file())
+    return total
@@ -0,0 +1,65 @@
+# staging.py
+"""Build derived files next to their final location, then move them into place.
+
+Several requests (threads of one worker, or several workers) can find the same
+cache stale at the same time. Builders therefore
+
+- hold :func:`locked` — an ``fcntl`` lock on ``.<name>.lock`` beside the target —
+  so only one of them builds while the others wait and then reuse the result,
+- write into :func:`temp_path` — a uuid-named sibling, never shared — and
+- finish with :func:`swap` (directories) or ``os.replace`` (files).
+
+``os.replace`` of a file is atomic. A directory cannot be replaced while it has
+contents, so :func:`swap` renames the old one aside, renames the new one in and
+only then deletes the old one; a reader that lands between the two renames
+finds no cache, takes the lock and waits for the builder.
+"""
+import fcntl
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+
+def temp_path(target, suffix=".tmp"):
+    target = Path(target)
+    return target.with_name(f".{target.name}.{uuid.uuid4().hex}{suffix}")
+
+
+@contextmanager
+def locked(target):
+    """Exclusive lock for building ``target`` (blocks until it is free)."""
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with open(target.with_name(f".{target.name}.lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def swap(tmp, target):
+    """Move the finished directory ``tmp`` to ``target``, replacing what was there."""
+    target = Path(target)
+    old = None
+    if target.exists():
+        old = temp_path(target, ".old")
+        os.replace(target, old)
+    os.replace(tmp, target)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+@contextmanager
+def build_dir(target):
+    """Yield an empty temp directory; on success it becomes ``target``, on error it is removed."""
+    tmp = temp_path(target)
+    tmp.mkdir(parents=True)
+    try:
+        yield tmp
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    swap(tmp, target)
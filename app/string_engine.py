@@ -0,0 +1,281 @@
+# string_engine.py
+"""Local STRING protein network engine.
+
+Loads a downloaded ``<taxon>.protein.links*.txt(.gz)`` / ``<taxon>.protein.info*.txt(.gz)``
+pair into a CSR adjacency index (``indptr``/``indices``/``scores`` .npy files) that is
+memory-mapped on load, so a gene-list query touches only the rows it needs.
+
+``<data_dir>/<taxon>.index/meta.json`` records the path, size and mtime of both
+source files; the index is rebuilt when either changes (e.g. a newer STRING
+release is downloaded). Builds are serialized across processes with a lock
+file and written into a temp directory that is swapped in when complete.
+"""
+import glob
+import json
+import math
+import os
+import threading
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from app import staging
+
+STRING_DATA_DIR = os.environ.get("STRING_DATA_DIR", "string_data")
+LAYOUT_EXACT_MAX = 300
+MAX_NETWORK_NODES = 2000
+
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+def _find_source(data_dir, taxon_id, kind):
+    pattern = os.path.join(data_dir, f"{taxon_id}.protein.{kind}*.txt*")
+    cand = sorted(p for p in glob.glob(pattern) if "detailed" not in p and "full" not in p)
+    if not cand:
+        raise FileNotFoundError(f"STRING {kind} file not found: {pattern}")
+    return cand[-1]
+
+
+def _source_stat(links_path, info_path):
+    stat = {}
+    for kind, path in (("links", links_path), ("info", info_path)):
+        st = os.stat(path)
+        stat[kind] = {"path": str(Path(path).resolve()), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    return stat
+
+
+def _is_fresh(index_dir, source):
+    try:
+        with open(Path(index_dir) / "meta.json", encoding="utf-8") as f:
+            return json.load(f)["source"] == source
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def build_index(links_path, info_path, index_dir):
+    """Convert STRING links/info text files into a CSR index under ``index_dir``.
+
+    A build that waited for another one of the same source files reuses it.
+    """
+    index_dir = Path(index_dir)
+    source = _source_stat(links_path, info_path)
+    with staging.locked(index_dir):
+        if not _is_fresh(index_dir, source):
+            with staging.build_dir(index_dir) as tmp:
+                _write_index(links_path, info_path, tmp, source)
+    return index_dir
+
+
+def _write_index(links_path, info_path, index_dir, source):
+    info = pd.read_csv(info_path, sep="\t", usecols=[0, 1], dtype=str)
+    info.columns = ["string_id", "preferred_name"]
+    ids = pd.Index(info["string_id"])
+
+    links = pd.read_csv(
+        links_path, sep=" ", usecols=[0, 1, 2],
+        dtype={"protein1": str, "protein2": str, "combined_score": np.uint16},
+    )
+    src = ids.get_indexer(links["protein1"])
+    dst = ids.get_indexer(links["protein2"])
+    keep = (src >= 0) & (dst >= 0)
+    src, dst = src[keep], dst[keep]
+    score = links["combined_score"].to_numpy()[keep]
+
+    # 각 노드의 이웃은 score 내림차순으로 정렬
+    order = np.lexsort((-score.astype(np.int32), src))
+    src, dst, score = src[order], dst[order], score[order]
+
+    indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=len(ids)), out=indptr[1:])
+
+    np.save(index_dir / "indptr.npy", indptr)
+    np.save(index_dir / "indices.npy", dst.astype(np.int32))
+    np.save(index_dir / "scores.npy", score.astype(np.uint16))
+    info.to_csv(index_dir / "proteins.tsv", sep="\t", index=False)
+    with open(index_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump({"source": source, "n_proteins": len(ids), "n_links": int(len(dst))}, f)
+
+
+class StringIndex:
+    """Memory-mapped STRING adjacency for one taxon."""
+
+    def __init__(self, index_dir):
+        index_dir = Path(index_dir)
+        self.indptr = np.load(index_dir / "indptr.npy", mmap_mode="r")
+        self.indices = np.load(index_dir / "indices.npy", mmap_mode="r")
+        self.scores = np.load(index_dir / "scores.npy", mmap_mode="r")
+        proteins = pd.read_csv(index_dir / "proteins.tsv", sep="\t", dtype=str)
+        self.string_ids = proteins["string_id"].tolist()
+        self.names = proteins["preferred_name"].fillna("").tolist()
+        self.lookup = {}
+        for i, (sid, name) in enumerate(zip(self.string_ids, self.names)):
+            self.lookup.setdefault(name.upper(), i)
+            self.lookup.setdefault(sid.upper(), i)
+            self.lookup.setdefault(sid.split(".", 1)[-1].upper(), i)
+
+    def resolve(self, genes):
+        nodes = []
+        for g in genes:
+            i = self.lookup.get(str(g).strip().upper())
+            if i is not None and i not in nodes:
+                nodes.append(i)
+        return nodes
+
+    def _neighbors(self, node):
+        a, b = self.indptr[node], self.indptr[node + 1]
+        return self.indices[a:b], self.scores[a:b]
+
+    def query(self, genes, cutoff=0.4, limit=0):
+        """Return ``(nodes, query_mask, edges)`` like STRING's protein query.
+
+        ``cutoff`` is the confidence score (0-1), ``limit`` the maximum number of
+        additional interactors added around the query proteins.
+        """
+        threshold = int(round(cutoff * 1000))
+        query_nodes = self.resolve(genes)
+        qset = set(query_nodes)
+
+        extra = {}
+        if limit > 0:
+            for u in query_nodes:
+                nbr, sc = self._neighbors(u)
+                # 이웃은 score 내림차순이므로 threshold 이상인 앞부분만 확인
+                n_ok = int(np.searchsorted(-sc.astype(np.int32), -threshold, side="right"))
+                for v, s in zip(nbr[:n_ok].tolist(), sc[:n_ok].tolist()):
+                    if v not in qset and s > extra.get(v, -1):
+                        extra[v] = s
+        added = sorted(extra, key=lambda v: (-extra[v], v))[:limit]
+
+        nodes = np.array(query_nodes + added, dtype=np.int64)
+        pos = {int(v): k for k, v in enumerate(nodes)}
+        edges = []
+        for k, u in enumerate(nodes.tolist()):
+            nbr, sc = self._neighbors(u)
+            mask = (sc >= threshold) & np.isin(nbr, nodes)
+            for v, s in zip(nbr[mask].tolist(), sc[mask].tolist()):
+                j = pos[v]
+                if j > k:
+                    edges.append((k, j, s / 1000.0))
+        query_mask = np.zeros(len(nodes), dtype=bool)
+        query_mask[:len(query_nodes)] = True
+        return nodes, query_mask, edges
+
+
+def load_index(taxon_id, data_dir=None):
+    """Return the :class:`StringIndex` for ``taxon_id``, (re)building it when its source files changed."""
+    data_dir = data_dir or STRING_DATA_DIR
+    index_dir = Path(data_dir) / f"{taxon_id}.index"
+    links_path = _find_source(data_dir, taxon_id, "links")
+    info_path = _find_source(data_dir, taxon_id, "info")
+    source = _source_stat(links_path, info_path)
+    key = str(index_dir.resolve())
+    with _index_lock:
+        cached = _index_cache.get(key)
+        if cached is not None and cached[0] == source:
+            return cached[1]
+        if not _is_fresh(index_dir, source):
+            build_index(links_path, info_path, index_dir)
+        index = StringIndex(index_dir)
+        _index_cache[key] = (source, index)
+        return index
+
+
+def _repulsion_exact(pos, k):
+    delta = pos[:, None, :] - pos[None, :, :]
+    dist = np.maximum(np.linalg.norm(delta, axis=-1), 1e-6)
+    return np.einsum("ij,ijk->ik", k * k / dist ** 2, delta)
+
+
+def _repulsion_grid(pos, k):
+    # Fruchterman-Reingold grid 변형: 2k 반경 안의 노드 쌍만 서로 밀어냄 (n x n 배열 없이)
+    pairs = cKDTree(pos).query_pairs(2 * k, output_type="ndarray")
+    disp = np.zeros_like(pos)
+    if len(pairs):
+        i, j = pairs[:, 0], pairs[:, 1]
+        d = pos[i] - pos[j]
+        dist2 = np.maximum((d ** 2).sum(axis=1), 1e-12)
+        f = (k * k / dist2)[:, None] * d
+        np.add.at(disp, i, f)
+        np.add.at(disp, j, -f)
+    return disp
+
+
+def spring_layout(n, edges, iterations=200, seed=42):
+    """Fruchterman-Reingold layout in the unit square.
+
+    Up to ``LAYOUT_EXACT_MAX`` nodes every pair repels; above that only pairs
+    closer than ``2k`` do, found with a KD-tree, so memory stays O(n + edges).
+    """
+    rng = np.random.default_rng(seed)
+    pos = rng.random((n, 2))
+    if n <= 1:
+        return np.full((n, 2), 0.5)
+    k = 1.0 / math.sqrt(n)
+    repulsion = _repulsion_exact if n <= LAYOUT_EXACT_MAX else _repulsion_grid
+    src = np.array([e[0] for e in edges], dtype=np.int64)
+    dst = np.array([e[1] for e in edges], dtype=np.int64)
+    w = np.array([e[2] for e in edges], dtype=float)
+    t = 0.1
+    for _ in range(iterations):
+        disp = repulsion(pos, k)
+        if len(src):
+            d = pos[src] - pos[dst]
+            dl = np.maximum(np.linalg.norm(d, axis=1), 1e-6)
+            f = (w * dl / k)[:, None] * d
+            np.add.at(disp, src, -f)
+            np.add.at(disp, dst, f)
+        length = np.maximum(np.linalg.norm(disp, axis=1), 1e-6)
+        pos += disp / length[:, None] * np.minimum(length, t)[:, None]
+        t = max(t * 0.97, 0.005)
+    pos -= pos.min(axis=0)
+    span = pos.max(axis=0)
+    span[span == 0] = 1.0
+    return pos / span
+
+
+def render_svg(path, labels, query_mask, edges, pos, title="", size=800):
+    margin = 40
+    scale = size - 2 * margin
+    xy = margin + pos * scale
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+           f'viewBox="0 0 {size} {size}">',
+           f'<rect width="100%" height="100%" fill="white"/>']
+    if title:
+        out.append(f'<text x="{size / 2}" y="20" text-anchor="middle" font-size="14" '
+                   f'font-family="sans-serif">{escape(title)}</text>')
+    for i, j, s in edges:
+        out.append(f'<line x1="{xy[i, 0]:.1f}" y1="{xy[i, 1]:.1f}" x2="{xy[j, 0]:.1f}" '
+                   f'y2="{xy[j, 1]:.1f}" stroke="#888" stroke-opacity="{0.3 + 0.7 * s:.2f}" '
+                   f'stroke-width="{0.5 + 2.5 * s:.2f}"/>')
+    for i, label in enumerate(labels):
+        fill = "#e06666" if query_mask[i] else "#cccccc"
+        out.append(f'<circle cx="{xy[i, 0]:.1f}" cy="{xy[i, 1]:.1f}" r="8" fill="{fill}" '
+                   f'stroke="#555"/>')
+        out.append(f'<text x="{xy[i, 0]:.1f}" y="{xy[i, 1] - 11:.1f}" text-anchor="middle" '
+                   f'font-size="9" font-family="sans-serif">{escape(label)}</text>')
+    out.append("</svg>")
+    Path(path).write_text("\n".join(out), encoding="utf-8")
+
+
+def build_network(index, genes, cutoff, limit, svg_path, title=""):
+    """Query ``genes``, lay them out and write an SVG plus an edge table next to it."""
+    # 너무 큰 유전자 목록은 앞쪽 MAX_NETWORK_NODES 개만 그림 (결과에 truncated 표시)
+    truncated = len(genes) > MAX_NETWORK_NODES
+    genes = genes[:MAX_NETWORK_NODES]
+    limit = max(0, min(limit, MAX_NETWORK_NODES - len(genes)))
+    nodes, query_mask, edges = index.query(genes, cutoff=cutoff, limit=limit)
+    labels = [index.names[v] or index.string_ids[v] for v in nodes.tolist()]
+    pos = spring_layout(len(nodes), edges)
+    render_svg(svg_path, labels, query_mask, edges, pos, title=title)
+
+    edge_path = Path(svg_path).with_suffix(".tsv")
+    pd.DataFrame(
+        [(labels[i], labels[j], s) for i, j, s in edges],
+        columns=["node1", "node2", "combined_score"],
+    ).to_csv(edge_path, sep="\t", index=False)
+    return {"nodes": len(nodes), "edges": len(edges), "truncated": truncated,
+            "svg": str(svg_path), "edges_tsv": str(edge_path)}
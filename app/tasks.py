@@ -0,0 +1,176 @@
+# tasks.py
+"""Analysis tasks shared by the API routes and the queue workers.
+
+A route validates its request, answers ETag / cached-artifact hits itself and
+otherwise enqueues a job (:mod:`app.job_queue`) whose spec holds the validated
+parameters. ``worker.py`` claims the job and calls the task function registered
+here under the route's name, which does everything the route used to do in
+process: run R, pack ZIPs, write ``.etag`` sidecars, build derived stores. Task
+modules live next to their routes (``routes/fastapi_*.py``) and register with
+``@tasks.task("<route>")``.
+
+By default the route waits for the job and returns the artifact with an
+``X-Job-Id`` header; a request sent with ``Prefer: respond-async`` gets
+``202 {"job_id": ...}`` back immediately and polls ``/api/jobs/{job_id}``
+(artifact at ``/api/jobs/{job_id}/artifact``).
+"""
+import os
+import subprocess
+import threading
+from pathlib import Path
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+
+from app import job_queue, progress, scheduler
+
+RCODE_DIR = Path(__file__).resolve().parent.parent / "rcode"
+JOB_WAIT_TIMEOUT = float(os.environ.get("JOB_WAIT_TIMEOUT", 3600))
+
+TASKS = {}
+
+
+class TaskError(Exception):
+    """Deterministic task failure: reported to the client as-is and never retried."""
+
+    def __init__(self, detail, status_code=500):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def task(route):
+    def register(fn):
+        TASKS[route] = fn
+        return fn
+    return register
+
+
+class Context:
+    """Execution context handed to a task; lets the worker kill R when the lease is lost."""
+
+    def __init__(self, execution_id=None, slots=1):
+        self.execution_id = execution_id  # 요청에 execution_id 가 없을 때 쓰는 진행 상황 채널
+        self.slots = slots                # 이 작업이 잡은 R 슬롯 수 (동시에 띄울 수 있는 R 프로세스 수)
+        self.proc = None
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def _attach(self, proc):
+        with self._lock:
+            self.proc = proc
+            if self.cancelled.is_set():
+                proc.kill()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled.set()
+            if self.proc is not None and self.proc.poll() is None:
+                self.proc.kill()
+
+    def run(self, cmd, execution_id=None, output_root=None):
+        """Run ``cmd`` like ``subprocess.run(capture_output=True, text=True)``."""
+        if self.cancelled.is_set():
+            raise TaskError("job cancelled")
+        execution_id = execution_id or self.execution_id
+        if execution_id:
+            return progress.run_rscript(cmd, execution_id, output_root, on_start=self._attach)
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding="utf-8")
+        self._attach(proc)
+        stdout, stderr = proc.communicate()
+        return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+def run(route, spec, ctx=None):
+    """Execute a job spec in this process (the worker's entry point)."""
+    ctx = ctx or Context()
+    if "script" in spec:
+        return run_script(spec, ctx)
+    fn = TASKS.get(route)
+    if fn is None:
+        raise TaskError(f"Unknown task: {route}", 400)
+    return fn(spec, ctx)
+
+
+def run_script(spec, ctx):
+    """Bare Rscript job (``POST /api/jobs/``)."""
+    cmd = ["Rscript", str(RCODE_DIR / spec["script"])] + [str(a) for a in spec.get("args", [])]
+    result = ctx.run(cmd)
+    if result.returncode != 0:
+        raise TaskError(result.stderr[-10000:])
+    return {"stdout": result.stdout[-10000:]}
+
+
+def wants_async(request: Request):
+    return "respond-async" in request.headers.get("prefer", "").lower()
+
+
+def job_error(job):
+    if job is None:
+        return HTTPException(status_code=504, detail="Job did not finish in time")
+    return HTTPException(status_code=job.get("error_status") or 500, detail=job.get("error") or "Job failed")
+
+
+def dispatch(request: Request, route, spec, respond, key=None, max_attempts=3,
+             execution_id=None, output_root=None, lock=None, inputs=(), slots=1):
+    """Enqueue ``spec`` for ``route`` and return ``respond(result)`` once a worker finished it.
+
+    With ``key`` (the input ETag) a request identical to a queued/running job joins
+    that job instead of starting another R run. With ``execution_id`` the progress
+    channel is opened here so ``/api/progress/{execution_id}`` has something to follow
+    before R starts; the worker closes it if the task fails before reaching R. A joiner's
+    execution id is aliased to the joined job's channel (or becomes that channel when
+    the job has none). ``lock`` is the output file/directory the job writes.
+    ``inputs`` (files/directories) size the job for the scheduler's lane choice;
+    ``slots`` is how many R processes the job runs at once.
+    """
+    lock_key = str(Path(lock).resolve()) if lock else None
+    input_bytes = scheduler.input_size(*inputs)
+    lane = scheduler.classify(route, input_bytes)
+    queue_args = {"lock_key": lock_key, "lane": lane, "input_bytes": input_bytes,
+                  "slots": max(1, min(slots, scheduler.capacity(lane)))}
+    if execution_id:
+        progress.open_channel(execution_id, output_root)
+        spec = {**spec, "progress": {"execution_id": execution_id}}
+    aliased = False
+    if key is None:
+        job_id = job_queue.enqueue(route, spec, max_attempts=max_attempts, **queue_args)
+    else:
+        job_id, joined = job_queue.enqueue_once(route, spec, key, max_attempts=max_attempts, **queue_args)
+        if joined:
+            print(f"[jobs] joining in-flight job {job_id} ({route})")
+            if execution_id:
+                leader = job_queue.attach_progress(job_id, execution_id)
+                if leader is not None and leader != execution_id:
+                    progress.alias(execution_id, leader)
+                    aliased = True
+    headers = {"X-Job-Id": job_id}
+    if execution_id and not aliased:
+        progress.get_channel(execution_id).publish("queued", job_id=job_id, route=route)
+    if wants_async(request):
+        return JSONResponse(status_code=202, headers=headers, content={
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/api/jobs/{job_id}",
+            "artifact_url": f"/api/jobs/{job_id}/artifact",
+        })
+
+    job = job_queue.wait(job_id, timeout=JOB_WAIT_TIMEOUT)
+    if execution_id and job is not None:
+        # 다른 요청의 작업에 합류했으면 이 채널에는 R 진행 상황이 오지 않으므로 여기서 닫음
+        if job["status"] == "done":
+            progress.finish(execution_id, "done", job_id=job_id)
+        else:
+            progress.finish(execution_id, "error", detail=(job.get("error") or "")[-2000:])
+    if job is None or job["status"] != "done":
+        err = job_error(job)
+        err.headers = headers
+        raise err
+    response = respond(job["result"] or {})
+    response.headers["X-Job-Id"] = job_id
+    return response
+
+
+def artifact(path, media_type, filename, etag=None, **extra):
+    """Task result describing a file the client downloads."""
+    return {"artifact": str(path), "media_type": media_type, "filename": filename, "etag": etag, **extra}
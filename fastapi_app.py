@@ -1,3 +1,6 @@
+import os
+
+import anyio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routes import (
@@ -13,7 +16,13 @@ from routes import (
     fastapi_ridgeplot,
     fastapi_pathway_gene,
     fastapi_upload,
+    fastapi_string,
+    fastapi_pipeline,
+    fastapi_jobs,
+    fastapi_progress,
+    fastapi_enrichment_store,
 )
+from app import scheduler
 
 app = FastAPI(
     title="Omics Analysis API",
@@ -43,6 +52,21 @@ app.include_router(fastapi_gseaplot.router, prefix="/api", tags=["Gseaplot"])
 app.include_router(fastapi_ridgeplot.router, prefix="/api", tags=["Ridgeplot"])
 app.include_router(fastapi_pathway_gene.router, prefix="/api", tags=["Pathway Gene"])
 app.include_router(fastapi_upload.router, prefix="/api", tags=["Upload CSV"])
+app.include_router(fastapi_string.router, prefix="/api", tags=["STRING Network"])
+app.include_router(fastapi_pipeline.router, prefix="/api", tags=["Pipeline"])
+app.include_router(fastapi_jobs.router, prefix="/api", tags=["Jobs"])
+app.include_router(fastapi_progress.router, prefix="/api", tags=["Progress"])
+app.include_router(fastapi_enrichment_store.router, prefix="/api", tags=["Enrichment Store"])
+
+# R 슬롯을 기다리는 batch 요청이 스레드풀을 다 차지해 interactive 요청이 막히지 않도록 넉넉하게
+@app.on_event("startup")
+async def widen_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = int(os.environ.get("API_THREADS", 200))
+
+# R 실행 lane 상태 (슬롯 사용량, 대기 수, route 별 비용 추정)
+@app.get("/api/scheduler")
+def scheduler_status():
+    return scheduler.stats()
 
 @app.get("/")
 def root():
@@ -0,0 +1,325 @@
+"""Load-test the FastAPI layer with R replaced by loadtest/bin/Rscript.
+
+Starts uvicorn and the queue workers (worker.py) with the fake Rscript first on
+PATH, builds a synthetic dataset, then drives every router in fastapi_app.py at
+the requested concurrency levels and reports throughput, latency percentiles and
+the peak RSS of the server and of the workers.
+
+    python loadtest/run_loadtest.py --concurrency 1,8,32 --requests 200
+    python loadtest/run_loadtest.py --routes heatmap,deg --sleep 0.05 --svg-kb 500
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+FAKE_BIN = Path(__file__).resolve().parent / "bin"
+
+
+# ----------------- fixtures -----------------
+def make_dataset(path, genes, samples):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cols = [f"A_{i + 1}" for i in range(samples // 2)] + [f"B_{i + 1}" for i in range(samples - samples // 2)]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("Geneid,foldchange,pvalue," + ",".join(cols) + "\n")
+        for g in range(genes):
+            vals = ",".join(f"{random.lognormvariate(3, 1):.3f}" for _ in cols)
+            f.write(f"G{g},{random.lognormvariate(0, 1):.4f},{random.random():.6g},{vals}\n")
+
+
+def make_workspace(base, genes, samples):
+    """One isolated directory tree per client thread, so routes that rmtree don't collide."""
+    ws = Path(tempfile.mkdtemp(prefix="ws_", dir=base))
+    make_dataset(ws / "data" / "dataset.csv", genes, samples)
+    gsea = ws / "data" / "gsea_input.csv"
+    with open(gsea, "w", encoding="utf-8") as f:
+        f.write("gene,logFC\n")
+        for g in range(genes):
+            f.write(f"G{g},{random.gauss(0, 1):.4f}\n")
+    # cnet/emap 가 찾는 enrichment 결과와 combo 목록
+    combo = "FC1_p0.05"
+    (ws / "Deg").mkdir(exist_ok=True)
+    (ws / "Deg" / "combo_names.csv").write_text(f'"combo"\n"{combo}"\n')
+    (ws / "Deg" / combo).mkdir(exist_ok=True)
+    (ws / "Deg" / combo / "filtered_gene_list.csv").write_text(
+        "Geneid,foldchange,pvalue\n" + "".join(f"G{g},2.0,0.01\n" for g in range(50))
+    )
+    (ws / "Enrich" / combo).mkdir(parents=True, exist_ok=True)
+    for ont in ("BP", "CC", "MF"):
+        (ws / "Enrich" / combo / f"GO_{ont}_ego.rds").write_bytes(os.urandom(1024))
+    return ws
+
+
+def make_string_data(base):
+    d = Path(base) / "string_data"
+    d.mkdir(exist_ok=True)
+    with open(d / "9606.protein.info.v12.0.txt", "w") as f:
+        f.write("#string_protein_id\tpreferred_name\tprotein_size\tannotation\n")
+        for g in range(500):
+            f.write(f"9606.P{g}\tG{g}\t100\tfake\n")
+    with open(d / "9606.protein.links.v12.0.txt", "w") as f:
+        f.write("protein1 protein2 combined_score\n")
+        for g in range(500):
+            for h in random.sample(range(500), 10):
+                if h != g:
+                    s = random.randint(150, 999)
+                    f.write(f"9606.P{g} 9606.P{h} {s}\n9606.P{h} 9606.P{g} {s}\n")
+    return d
+
+
+# ----------------- scenarios -----------------
+def scenarios(ws, i, string_dir):
+    """(name, method, path, kwargs) for every router; ``i`` busts the ETag cache."""
+    csv = str(ws / "data" / "dataset.csv")
+    w = 8 + i * 1e-6
+    enrich = {"fc_threshold": 1, "pval_threshold": 0.05, "showCategory": 5,
+              "plot_width": w, "plot_height": 6}
+    return [
+        ("heatmap", "post", "/api/heatmap/",
+         {"data": {"csv_path": csv, "width": w, "height": 6, "top_n_genes": 50}}),
+        ("volcano", "post", "/api/volcano/",
+         {"json": {"csv_path": csv, "fc_cutoff": 1 + i * 1e-6, "pval_cutoff": 0.05}}),
+        ("volcano_enhanced", "post", "/api/volcano/enhanced",
+         {"json": {"csv_path": csv, "fc_cutoff": 1 + i * 1e-6, "pval_cutoff": 0.05}}),
+        ("pca", "post", "/api/pca/",
+         {"json": {"csv_path": csv, "width": w, "height": 6, "pointshape": 19,
+                   "pointsize": 2, "text_size": 3}}),
+        ("deg", "post", "/api/deg/",
+         {"data": {"csv_path": csv, "fc_input": "1,2", "pval_input": f"0.05,{0.01 + i * 1e-9:.12g}"}}),
+        ("enrichplot", "post", "/api/enrichplot/",
+         {"json": {"result_root": str(ws / "Deg"), "output_root": str(ws / "EnrichOut"),
+                   "org_db": "org.Hs.eg.db", "showCategory": 10, "pvalueCutoff": 0.05,
+                   "plot_width": w, "plot_height": 6}}),
+        ("cnetplot", "post", "/api/cnetplot/",
+         {"json": {"enrich_root": str(ws / "Enrich"), "output_root": str(ws / "Cnet"),
+                   "combo_root": str(ws / "Deg"), **enrich}}),
+        ("emapplot", "post", "/api/emapplot/",
+         {"json": {"result_root": str(ws / "Enrich"), "output_root": str(ws / "Emap"),
+                   "combo_root": str(ws / "Deg"), **enrich}}),
+        ("gsego", "post", "/api/gsego/",
+         {"json": {"file_path": str(ws / "data" / "gsea_input.csv"), "out_dir": str(ws / "Gsego"),
+                   "orgdb": "org.Hs.eg.db", "min_gs_size": 10, "max_gs_size": 500,
+                   "pvalue_cutoff": 0.05, "plot_width": w, "plot_height": 6}}),
+        ("gseaplot_total", "post", "/api/gseaplot/total",
+         {"json": {"input_dir": str(ws / "Ridge"), "output_dir": str(ws / "GseaTotal"), "topN": 5}}),
+        ("gseaplot_term", "post", "/api/gseaplot/term",
+         {"json": {"input_dir": str(ws / "Ridge"), "output_dir": str(ws / "GseaTerm")}}),
+        ("ridgeplot", "post", "/api/ridgeplot/",
+         {"json": {"input_file": csv, "output_dir": str(ws / "Ridge"), "width": w, "height": 6}}),
+        ("pathway_gene", "post", "/api/pathway_gene/",
+         {"json": {"edox_dir": str(ws / "Ridge"), "csv_path": csv, "output_dir": str(ws / "PathGene")}}),
+        ("upload", "post", "/api/upload-csv/",
+         {"files": {"file": ("upload.csv", b"Geneid,foldchange,pvalue\nG1,2,0.01\n")},
+          "data": {"target_dir": str(ws / "uploads")}}),
+        ("string", "post", "/api/run-string/",
+         {"data": {"input_root": str(ws / "Deg"), "combo_file": "combo_names.csv",
+                   "output_dir": str(ws / "String"), "taxon_id": 9606, "cutoff": 0.4,
+                   "limit": 5, "string_data_dir": str(string_dir)}}),
+        ("pipeline", "post", "/api/pipeline/",
+         {"json": {"csv_path": csv, "work_root": str(ws / "Pipeline"),
+                   "outputs": ["cnetplot", "emapplot"], "plot_width": w}}),
+        ("jobs", "post", "/api/jobs/",
+         {"json": {"route": "heatmap", "script": "run_heatmap.R",
+                   "args": [csv, "8", "6", "50", str(ws / "job_heatmap.svg")]}}),
+    ]
+
+
+# ----------------- server -----------------
+def start_server(port, env):
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fastapi_app:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+    for _ in range(100):
+        try:
+            requests.get(f"http://127.0.0.1:{port}/", timeout=0.5)
+            return proc
+        except requests.RequestException:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("uvicorn did not start")
+
+
+def start_workers(n, concurrency, env):
+    procs = [
+        subprocess.Popen([sys.executable, "worker.py", "--poll", "0.05", "--concurrency", str(concurrency)],
+                         cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+        for _ in range(n)
+    ]
+    return procs
+
+
+def rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class RssSampler(threading.Thread):
+    """Peak of the summed RSS of ``pids``."""
+
+    def __init__(self, pids, interval=0.1):
+        super().__init__(daemon=True)
+        self.pids, self.interval = list(pids), interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        # 짧은 요청도 잡히도록 기다리기 전에 먼저 측정
+        while True:
+            self.peak = max(self.peak, sum(rss_kb(pid) for pid in self.pids))
+            if self.stopped.wait(self.interval):
+                break
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+# ----------------- driver -----------------
+def run_level(base_url, route, concurrency, n_requests, workspaces, string_dir, bust_cache, server_pid,
+              worker_pids=()):
+    local = threading.local()
+    ws_iter = iter(workspaces)
+    ws_lock = threading.Lock()
+    latencies, errors = [], []
+    lat_lock = threading.Lock()
+
+    def one(i):
+        if not hasattr(local, "ws"):
+            with ws_lock:
+                local.ws = next(ws_iter)
+            local.session = requests.Session()
+        key = i if bust_cache else 0
+        _, method, path, kwargs = next(s for s in scenarios(local.ws, key, string_dir) if s[0] == route)
+        t0 = time.perf_counter()
+        try:
+            r = local.session.request(method, base_url + path, timeout=600, **kwargs)
+            _ = r.content
+            ok = r.status_code < 400
+        except requests.RequestException as e:
+            ok, r = False, e
+        dt = time.perf_counter() - t0
+        with lat_lock:
+            latencies.append(dt)
+            if not ok:
+                errors.append(getattr(r, "status_code", str(r)))
+
+    sampler = RssSampler([server_pid])
+    worker_sampler = RssSampler(worker_pids)
+    sampler.start()
+    worker_sampler.start()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(n_requests)))
+    wall = time.perf_counter() - t0
+    for smp in (sampler, worker_sampler):
+        smp.stopped.set()
+        smp.join()
+
+    return {
+        "route": route,
+        "concurrency": concurrency,
+        "requests": n_requests,
+        "errors": len(errors),
+        "throughput_rps": n_requests / wall,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else float("nan"),
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else float("nan"),
+        "peak_rss_mb": sampler.peak / 1024,
+        "worker_rss_mb": worker_sampler.peak / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FastAPI layer load test with a fake Rscript")
+    parser.add_argument("--routes", default="all", help="comma-separated scenario names or 'all'")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=100, help="requests per route and level")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=2, help="worker.py processes")
+    parser.add_argument("--worker-concurrency", type=int, default=None,
+                        help="jobs per worker process (default: highest concurrency level)")
+    parser.add_argument("--genes", type=int, default=20000)
+    parser.add_argument("--samples", type=int, default=6)
+    parser.add_argument("--sleep", type=float, default=0.2, help="fake R runtime (s)")
+    parser.add_argument("--svg-kb", type=float, default=200)
+    parser.add_argument("--csv-kb", type=float, default=50)
+    parser.add_argument("--rds-kb", type=float, default=500)
+    parser.add_argument("--cached", action="store_true", help="repeat identical requests (ETag cache hits)")
+    parser.add_argument("--json", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(",")]
+    base = Path(tempfile.mkdtemp(prefix="loadtest_"))
+    string_dir = make_string_data(base)
+    all_routes = [s[0] for s in scenarios(base, 0, string_dir)]
+    routes = all_routes if args.routes == "all" else args.routes.split(",")
+
+    env = dict(os.environ)
+    env.update({
+        "PATH": f"{FAKE_BIN}{os.pathsep}{env.get('PATH', '')}",
+        "FAKE_R_SLEEP": str(args.sleep),
+        "FAKE_R_SVG_KB": str(args.svg_kb),
+        "FAKE_R_CSV_KB": str(args.csv_kb),
+        "FAKE_R_RDS_KB": str(args.rds_kb),
+        "JOB_QUEUE_DB": str(base / "jobs.db"),
+        "PYTHONPATH": str(ROOT),
+    })
+
+    print(f"Preparing {max(levels)} workspaces in {base} ...")
+    workspaces = [make_workspace(base, args.genes, args.samples) for _ in range(max(levels))]
+
+    server = start_server(args.port, env)
+    workers = start_workers(args.workers, args.worker_concurrency or max(levels), env)
+    results = []
+    try:
+        print(f"{'route':<18}{'conc':>5}{'req':>6}{'err':>5}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+              f"{'rss MB':>9}{'wrk MB':>9}")
+        for route in routes:
+            for c in levels:
+                r = run_level(f"http://127.0.0.1:{args.port}", route, c, args.requests,
+                              workspaces, string_dir, not args.cached, server.pid, [w.pid for w in workers])
+                results.append(r)
+                print(f"{route:<18}{c:>5}{r['requests']:>6}{r['errors']:>5}{r['throughput_rps']:>9.1f}"
+                      f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['peak_rss_mb']:>9.1f}"
+                      f"{r['worker_rss_mb']:>9.1f}")
+    finally:
+        for proc in [server] + workers:
+            proc.send_signal(signal.SIGINT)
+        for proc in [server] + workers:
+            proc.wait(timeout=30)
+        shutil.rmtree(base, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,14 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
-import subprocess
-import os
+from typing import Optional
 import shutil
 from pathlib import Path
 import pandas as pd
 import math
 import zipfile
 
+from app import http_cache, progress, tasks
+
 router = APIRouter(prefix="/cnetplot", tags=["Cnetplot"])
 
 
@@ -21,10 +21,11 @@ class CnetRequest(BaseModel):
     showCategory: int
     plot_width: float
     plot_height: float
+    execution_id: Optional[str] = None   # 지정 시 /api/progress/{execution_id} 로 진행 상황 전송
 
 
 @router.post("/")
-def run_cnetplot(req: CnetRequest, background_tasks: BackgroundTasks):
+def run_cnetplot(req: CnetRequest, request: Request):
     """Generate Cnet plots for selected combos and return ZIP file."""
 
     combo_csv = Path(req.combo_root) / "combo_names.csv"
@@ -49,6 +50,36 @@ def run_cnetplot(req: CnetRequest, background_tasks: BackgroundTasks):
 
     # ✅ 결과 디렉토리 준비
     output_dir = Path(req.output_root)
+    zip_path = output_dir / "cnetplot.zip"
+
+    # 선택된 combo 의 ego RDS 내용 + 파라미터 기반 ETag
+    ego_files = [
+        f for c in selected_combos for f in (Path(req.enrich_root) / c).glob("GO_*_ego.rds")
+    ]
+    etag = http_cache.input_etag(ego_files, {
+        "route": "cnetplot", "combos": selected_combos, **req.dict(exclude={"execution_id"})
+    })
+    if http_cache.etag_matches(request, etag):
+        progress.replay_done(req.execution_id, output_dir)
+        return http_cache.not_modified(etag)
+    if http_cache.stored_etag(zip_path) == etag:
+        progress.replay_done(req.execution_id, output_dir)
+        return http_cache.artifact_response(request, zip_path, "application/zip", "cnetplot.zip", etag)
+
+    spec = {"request": req.dict(), "combos": selected_combos, "ego_files": [str(f) for f in ego_files], "etag": etag}
+    return tasks.dispatch(request, "cnetplot", spec, lambda result: http_cache.artifact_response(
+        request, zip_path, "application/zip", "cnetplot.zip", etag
+    ), execution_id=req.execution_id, output_root=output_dir, lock=output_dir, inputs=ego_files)
+
+
+@tasks.task("cnetplot")
+def cnetplot_task(spec, ctx):
+    """Worker side of ``POST /cnetplot/``: R run + ZIP + ETag sidecar."""
+    req = CnetRequest(**spec["request"])
+    selected_combos = spec["combos"]
+    output_dir = Path(req.output_root)
+    zip_path = output_dir / "cnetplot.zip"
+
     if output_dir.exists():
         shutil.rmtree(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
@@ -60,7 +91,7 @@ def run_cnetplot(req: CnetRequest, background_tasks: BackgroundTasks):
     # ✅ R 스크립트 경로
     r_script_path = Path(__file__).resolve().parent.parent / "rcode" / "run_cnetplot.R"
     if not r_script_path.exists():
-        raise HTTPException(status_code=500, detail=f"R script not found at {r_script_path}")
+        raise tasks.TaskError(f"R script not found at {r_script_path}")
 
     # ✅ Rscript 실행 (6개 인자 정확히 전달)
     cmd = [
@@ -76,34 +107,20 @@ def run_cnetplot(req: CnetRequest, background_tasks: BackgroundTasks):
 
     print("Running command:", " ".join(cmd))
 
-    try:
-        # Rscript 실행
-        result = subprocess.run(cmd, text=True, capture_output=True)
-
-        if result.returncode != 0:
-            print("❌ Rscript stderr:")
-            print(result.stderr)
-            raise HTTPException(
-                status_code=500,
-                detail=f"Rscript execution failed:\n{result.stderr}"
-            )
-
-        # 결과를 ZIP으로 패키징
-        zip_path = output_dir / "cnetplot.zip"
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for file in output_dir.rglob("*"):
-                if file.is_file() and file != zip_path:
-                    arcname = file.relative_to(output_dir)
-                    zipf.write(file, arcname)
-
-        # ZIP 파일 응답 후 자동 삭제
-        background_tasks.add_task(zip_path.unlink)
-
-        return FileResponse(
-            zip_path,
-            media_type="application/zip",
-            filename="cnetplot.zip"
-        )
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+    # Rscript 실행
+    result = ctx.run(cmd, req.execution_id, output_dir)
+
+    if result.returncode != 0:
+        print("❌ Rscript stderr:")
+        print(result.stderr)
+        raise tasks.TaskError(f"Rscript execution failed:\n{result.stderr}")
+
+    # 결과를 ZIP으로 패키징
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for file in output_dir.rglob("*"):
+            if file.is_file() and file != zip_path:
+                arcname = file.relative_to(output_dir)
+                zipf.write(file, arcname)
+
+    http_cache.store_etag(zip_path, spec["etag"])
+    return tasks.artifact(zip_path, "application/zip", "cnetplot.zip", spec["etag"])
@@ -1,27 +1,27 @@
-from fastapi import APIRouter, Form, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Form, HTTPException, Request
 from pathlib import Path
-import subprocess
+from typing import Optional
 import tempfile
 import zipfile
 import os
 import shutil
+import numpy as np
+
+from app import http_cache, row_index, tasks
 
 router = APIRouter(prefix="/deg", tags=["DEG"])
 
-@router.post("/")
-async def run_deg(
-    background_tasks: BackgroundTasks,
-    csv_path: str = Form(...),
-    fc_input: str = Form(...),
-    pval_input: str = Form(...)
-):
-    csv_file = Path(csv_path).resolve()
-    if not csv_file.exists():
-        raise HTTPException(status_code=400, detail=f"{csv_file} does not exist.")
+# R 메모리 예산(MB): 테이블을 통째로 읽으면 예산을 넘을 때 행 chunk 단위로 스트리밍 (0 이면 항상 전체 읽기)
+DEG_MEMORY_BUDGET_MB = float(os.environ.get("DEG_MEMORY_BUDGET_MB", 0))
+
+@tasks.task("deg")
+def deg_task(spec, ctx):
+    """Worker side of ``POST /deg/``: combo filtering in R + ZIP + ETag sidecar."""
+    csv_file = Path(spec["csv_path"])
+    result_dir = Path(spec["result_dir"])
+    zip_path = result_dir / "deg.zip"
+    pval_input = spec["pval_input"]
 
-    # 결과 디렉토리 설정
-    result_dir = csv_file.parent.parent / "Deg"
     if result_dir.exists():
         shutil.rmtree(result_dir)
     result_dir.mkdir(parents=True, exist_ok=True)
@@ -29,44 +29,90 @@ async def run_deg(
     # R 스크립트 경로 지정
     r_script_path = Path(__file__).resolve().parent.parent / "rcode" / "run_deg.R"
 
+    # 정렬 인덱스로 가장 느슨한 pvalue / |foldchange| 기준을 모두 만족하는 행만 R 에 전달
+    # (값이 NA 인 행은 R 의 필터 결과와 같도록 함께 포함)
+    input_csv = csv_file
+    tmp_csv = None
+    classes_args = []
+    idx = row_index.load_index(csv_file)
+    if idx is not None and idx.has("pvalue"):
+        max_pval = max(float(p) for p in pval_input.split(","))
+        rows = idx.rows_at_most("pvalue", max_pval, include_nan=True)
+        if idx.has("absfc"):
+            min_fc = min(float(f) for f in spec["fc_input"].split(","))
+            rows = np.intersect1d(rows, idx.rows_at_most("absfc", min_fc, include_nan=True))
+        with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as tmp:
+            tmp_csv = Path(tmp.name)
+        input_csv = idx.write_rows(rows, tmp_csv)
+        # 부분 파일도 전체 파일과 같은 열 타입(colClasses)으로 읽도록 원본과 캐시 경로 전달
+        classes_args = [str(csv_file), str(idx.classes_path())]
+
     # R 스크립트 실행 명령어 구성
     cmd = [
         "Rscript",
         str(r_script_path),
-        str(csv_file),
-        fc_input,
+        str(input_csv),
+        spec["fc_input"],
         pval_input,
-        str(result_dir)
+        str(result_dir),
+        str(spec["memory_budget_mb"]),
+        *classes_args
     ]
 
     try:
-        result = subprocess.run(cmd, text=True, capture_output=True)
-
-        if result.returncode != 0:
-            print("❌ Rscript stderr:")
-            print(result.stderr)
-            raise HTTPException(
-                status_code=500,
-                detail=f"Rscript execution failed:\n{result.stderr}"
-            )
-        
-        zip_path = result_dir / "deg.zip"
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for file in result_dir.rglob("*"):
-                if file.is_file() and file != zip_path:
-                    arcname = file.relative_to(result_dir)
-                    zipf.write(file, arcname)
-
-        # ✅ 응답 후 zip 파일 자동 삭제
-        background_tasks.add_task(zip_path.unlink)
-
-        return FileResponse(
-            zip_path,
-            media_type="application/zip",
-            filename="deg.zip"
-        )
-
-    except subprocess.SubprocessError as e:
-        raise HTTPException(status_code=500, detail=f"Subprocess error: {e}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        result = ctx.run(cmd)
+    finally:
+        if tmp_csv is not None:
+            tmp_csv.unlink(missing_ok=True)
+
+    if result.returncode != 0:
+        print("❌ Rscript stderr:")
+        print(result.stderr)
+        raise tasks.TaskError(f"Rscript execution failed:\n{result.stderr}")
+
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for file in result_dir.rglob("*"):
+            if file.is_file() and file != zip_path:
+                arcname = file.relative_to(result_dir)
+                zipf.write(file, arcname)
+
+    http_cache.store_etag(zip_path, spec["etag"])
+    return tasks.artifact(zip_path, "application/zip", "deg.zip", spec["etag"])
+
+
+@router.post("/")
+def run_deg(
+    request: Request,
+    csv_path: str = Form(...),
+    fc_input: str = Form(...),
+    pval_input: str = Form(...),
+    memory_budget_mb: Optional[float] = Form(None)
+):
+    csv_file = Path(csv_path).resolve()
+    if not csv_file.exists():
+        raise HTTPException(status_code=400, detail=f"{csv_file} does not exist.")
+    try:
+        for x in fc_input.split(",") + pval_input.split(","):
+            float(x)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="fc_input / pval_input must be comma-separated numbers")
+
+    # 결과 디렉토리 설정
+    result_dir = csv_file.parent.parent / "Deg"
+    zip_path = result_dir / "deg.zip"
+
+    # 입력이 같으면 R 실행 없이 기존 ZIP 재사용 (Range 이어받기 지원)
+    etag = http_cache.input_etag([csv_file], {"route": "deg", "fc": fc_input, "pval": pval_input})
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag)
+    if http_cache.stored_etag(zip_path) == etag:
+        return http_cache.artifact_response(request, zip_path, "application/zip", "deg.zip", etag)
+
+    spec = {
+        "csv_path": str(csv_file), "result_dir": str(result_dir), "fc_input": fc_input,
+        "pval_input": pval_input, "etag": etag,
+        "memory_budget_mb": memory_budget_mb if memory_budget_mb is not None else DEG_MEMORY_BUDGET_MB,
+    }
+    return tasks.dispatch(request, "deg", spec, lambda result: http_cache.artifact_response(
+        request, zip_path, "application/zip", "deg.zip", etag
+    ), lock=result_dir, inputs=[csv_file])
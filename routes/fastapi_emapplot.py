@@ -1,13 +1,13 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
-import subprocess
-import os
 import shutil
 from pathlib import Path
 import pandas as pd
 import math
 import zipfile
+from typing import Literal
+
+from app import http_cache, tasks
 
 router = APIRouter(prefix="/emapplot", tags=["Emapplot"])
 
@@ -21,10 +21,11 @@ class EmapRequest(BaseModel):
     showCategory: int
     plot_width: float
     plot_height: float
+    sim_method: Literal["JC", "OC"] = "JC"  # term 유사도: JC(Jaccard) 또는 OC(overlap)
 
 
 @router.post("/")
-def run_emapplot(req: EmapRequest, background_tasks: BackgroundTasks):
+def run_emapplot(req: EmapRequest, request: Request):
     """Generate Emap plots for selected combos and return ZIP file."""
 
     combo_csv = Path(req.combo_root) / "combo_names.csv"
@@ -49,6 +50,32 @@ def run_emapplot(req: EmapRequest, background_tasks: BackgroundTasks):
 
     # ✅ 결과 디렉토리 준비
     output_dir = Path(req.output_root)
+    zip_path = output_dir / "emapplot.zip"
+
+    # 선택된 combo 의 ego RDS 내용 + 파라미터 기반 ETag
+    ego_files = [
+        f for c in selected_combos for f in (Path(req.result_root) / c).glob("GO_*_ego.rds")
+    ]
+    etag = http_cache.input_etag(ego_files, {"route": "emapplot", "combos": selected_combos, **req.dict()})
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag)
+    if http_cache.stored_etag(zip_path) == etag:
+        return http_cache.artifact_response(request, zip_path, "application/zip", "emapplot.zip", etag)
+
+    spec = {"request": req.dict(), "combos": selected_combos, "ego_files": [str(f) for f in ego_files], "etag": etag}
+    return tasks.dispatch(request, "emapplot", spec, lambda result: http_cache.artifact_response(
+        request, zip_path, "application/zip", "emapplot.zip", etag
+    ), lock=output_dir, inputs=ego_files)
+
+
+@tasks.task("emapplot")
+def emapplot_task(spec, ctx):
+    """Worker side of ``POST /emapplot/``: R run + ZIP + ETag sidecar."""
+    req = EmapRequest(**spec["request"])
+    selected_combos = spec["combos"]
+    output_dir = Path(req.output_root)
+    zip_path = output_dir / "emapplot.zip"
+
     if output_dir.exists():
         shutil.rmtree(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
@@ -60,9 +87,9 @@ def run_emapplot(req: EmapRequest, background_tasks: BackgroundTasks):
     # ✅ R 스크립트 경로
     r_script_path = Path(__file__).resolve().parent.parent / "rcode" / "run_emapplot.R"
     if not r_script_path.exists():
-        raise HTTPException(status_code=500, detail=f"R script not found at {r_script_path}")
+        raise tasks.TaskError(f"R script not found at {r_script_path}")
 
-    # ✅ Rscript 실행 (6개 인자 전달)
+    # ✅ Rscript 실행 (7개 인자 전달)
     cmd = [
         "Rscript",
         str(r_script_path),
@@ -72,38 +99,25 @@ def run_emapplot(req: EmapRequest, background_tasks: BackgroundTasks):
         str(req.showCategory),
         str(req.plot_width),
         str(req.plot_height),
+        req.sim_method,
     ]
 
     print("Running command:", " ".join(cmd))
 
-    try:
-        # Rscript 실행
-        result = subprocess.run(cmd, text=True, capture_output=True)
-
-        if result.returncode != 0:
-            print("❌ Rscript stderr:")
-            print(result.stderr)
-            raise HTTPException(
-                status_code=500,
-                detail=f"Rscript execution failed:\n{result.stderr}"
-            )
-
-        # 결과를 ZIP으로 패키징
-        zip_path = output_dir / "emapplot.zip"
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for file in output_dir.rglob("*"):
-                if file.is_file() and file != zip_path:
-                    arcname = file.relative_to(output_dir)
-                    zipf.write(file, arcname)
-
-        # ZIP 파일 응답 후 자동 삭제
-        background_tasks.add_task(zip_path.unlink)
-
-        return FileResponse(
-            zip_path,
-            media_type="application/zip",
-            filename="emapplot.zip"
-        )
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+    # Rscript 실행
+    result = ctx.run(cmd)
+
+    if result.returncode != 0:
+        print("❌ Rscript stderr:")
+        print(result.stderr)
+        raise tasks.TaskError(f"Rscript execution failed:\n{result.stderr}")
+
+    # 결과를 ZIP으로 패키징
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for file in output_dir.rglob("*"):
+            if file.is_file() and file != zip_path:
+                arcname = file.relative_to(output_dir)
+                zipf.write(file, arcname)
+
+    http_cache.store_etag(zip_path, spec["etag"])
+    return tasks.artifact(zip_path, "application/zip", "emapplot.zip", spec["etag"])
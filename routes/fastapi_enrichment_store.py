@@ -0,0 +1,93 @@
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from typing import List, Optional
+from pathlib import Path
+import math
+
+from app import enrichment_store
+
+router = APIRouter(prefix="/enrichment_store", tags=["Enrichment Store"])
+
+
+class IngestRequest(BaseModel):
+    dataset: str                     # 분석 단위 이름 (partition 키)
+    enrich_root: Optional[str] = None  # enrichplot output_root (<combo>/GO_<ont>_result.csv)
+    gsea_dir: Optional[str] = None     # gsego out_dir (gse_<ont>.csv)
+
+
+class QueryRequest(BaseModel):
+    dataset: Optional[str] = None
+    combos: Optional[List[str]] = None
+    onts: Optional[List[str]] = None
+    kind: Optional[str] = None       # ORA / GSEA
+    max_padj: Optional[float] = None
+    ids: Optional[List[str]] = None
+    description: Optional[str] = None  # 대소문자 무시 부분 일치
+    top_k: Optional[int] = None      # (dataset, combo, ont) 별 p.adjust 상위 k 개
+    columns: Optional[List[str]] = None
+
+
+class MatrixRequest(BaseModel):
+    dataset: str
+    ont: str = "BP"
+    combos: Optional[List[str]] = None
+    top_k: int = 20
+    max_padj: float = 0.05
+    value: str = "padj"              # padj (-log10 p.adjust) / nes
+    kind: Optional[str] = "ORA"      # ORA / GSEA (None 이면 둘 다)
+
+
+def _json_value(v):
+    return None if isinstance(v, float) and not math.isfinite(v) else v
+
+
+@router.post("/ingest")
+def ingest_results(req: IngestRequest):
+    """Load enrichment / GSEA result CSVs into the Parquet store (replacing the dataset's ORA and/or GSEA combos)."""
+    if not enrichment_store.valid_name(req.dataset):
+        raise HTTPException(status_code=400, detail=f"Invalid dataset name: {req.dataset}")
+    for d in (req.enrich_root, req.gsea_dir):
+        if d and not Path(d).is_dir():
+            raise HTTPException(status_code=400, detail=f"{d} does not exist.")
+    if not (req.enrich_root or req.gsea_dir):
+        raise HTTPException(status_code=400, detail="enrich_root or gsea_dir is required")
+
+    written = enrichment_store.ingest(req.dataset, req.enrich_root, req.gsea_dir)
+    if not written:
+        raise HTTPException(status_code=404, detail="No result CSVs found")
+    return {"dataset": req.dataset, "partitions": written}
+
+
+@router.post("/query")
+def query_results(req: QueryRequest):
+    unknown = set(req.columns or []) - set(enrichment_store.SCHEMA.names)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown columns: {sorted(unknown)}")
+
+    df = enrichment_store.query(
+        dataset=req.dataset, combos=req.combos, onts=req.onts, kind=req.kind,
+        max_padj=req.max_padj, ids=req.ids, description=req.description,
+        top_k=req.top_k, columns=req.columns,
+    )
+    rows = [{k: _json_value(v) for k, v in r.items()} for r in df.to_dict(orient="records")]
+    return {"count": len(rows), "rows": rows}
+
+
+@router.post("/matrix")
+def term_combo_matrix(req: MatrixRequest):
+    """Term x combo significance (or NES) matrix for cross-combo comparison."""
+    if req.value not in ("padj", "nes"):
+        raise HTTPException(status_code=400, detail="value must be 'padj' or 'nes'")
+
+    mat, desc = enrichment_store.term_matrix(
+        req.dataset, req.ont, combos=req.combos, top_k=req.top_k,
+        max_padj=req.max_padj, value=req.value, kind=req.kind,
+    )
+    return {
+        "ont": req.ont,
+        "value": req.value,
+        "terms": mat.index.tolist(),
+        "descriptions": [_json_value(d) for d in desc.tolist()],
+        "combos": mat.columns.tolist(),
+        "values": [[_json_value(float(v)) for v in row] for row in mat.to_numpy()],
+    }
@@ -1,12 +1,11 @@
-import subprocess
 from pathlib import Path
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Body
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Request, Body
 from pydantic import BaseModel
-import shutil
-import tempfile
+from typing import Optional
 import zipfile
 
+from app import enrichment_store, http_cache, progress, tasks
+
 router = APIRouter(prefix="/enrichplot", tags=["Enrichplot"])
 
 class EnrichplotParams(BaseModel):
@@ -17,10 +16,12 @@ class EnrichplotParams(BaseModel):
     pvalueCutoff: float
     plot_width: float
     plot_height: float
+    execution_id: Optional[str] = None   # 지정 시 /api/progress/{execution_id} 로 진행 상황 전송
+    dataset: Optional[str] = None        # enrichment store 데이터셋 이름 (기본: output_root 의 상위 폴더 이름)
 
 @router.post("/")
 def run_enrichplot(
-    background_tasks: BackgroundTasks,
+    request: Request,
     params: EnrichplotParams = Body(...)
 ):
     """Run GO enrichment analysis and return results as a ZIP file."""
@@ -30,6 +31,9 @@ def run_enrichplot(
         if not r_script_path.exists():
             raise HTTPException(status_code=500, detail=f"R script not found at {r_script_path}")
 
+        if params.dataset is not None and not enrichment_store.valid_name(params.dataset):
+            raise HTTPException(status_code=400, detail=f"Invalid dataset name: {params.dataset}")
+
         # 절대 경로 변환
         result_root = str(Path(params.result_root).resolve())
         output_root = str(Path(params.output_root).resolve())
@@ -38,50 +42,84 @@ def run_enrichplot(
         print(f"[DEBUG] result_root = {result_root}")
         print(f"[DEBUG] output_root = {output_root}")
 
-        # Rscript 실행
-        cmd = [
-            "Rscript",
-            str(r_script_path),
-            result_root,
-            output_root,
-            params.org_db,
-            str(params.showCategory),
-            str(params.pvalueCutoff),
-            str(params.plot_width),
-            str(params.plot_height),
-        ]
-
-        result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8")
-
-        if result.returncode != 0:
-            print("❌ Rscript stderr:", result.stderr)
-            raise HTTPException(status_code=500, detail=f"Rscript execution failed:\n{result.stderr}")
-
-        # 결과 폴더 압축
-        output_path = Path(output_root)
-        if not output_path.exists():
-            raise HTTPException(status_code=500, detail=f"Output directory not found: {output_root}")
-
-        # 임시 디렉토리에서 ZIP 생성
-        tmp_dir = tempfile.mkdtemp()
-        zip_path = Path(tmp_dir) / "enrichment_results.zip"
-
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for file in output_path.rglob("*"):
-                if file.is_file():
-                    arcname = file.relative_to(output_path)
-                    zipf.write(file, arcname)
-
-        # ZIP 파일 응답 후 삭제
-        background_tasks.add_task(shutil.rmtree, tmp_dir)
-
-        return FileResponse(
-            zip_path,
-            media_type="application/zip",
-            filename="enrichment_results.zip"
-        )
-
-    except subprocess.SubprocessError as e:
-        raise HTTPException(status_code=500, detail=f"Subprocess error: {e}")
+        # DEG 결과(combo_names.csv + combo 별 gene list) 내용 + 파라미터 기반 ETag
+        zip_path = Path(output_root) / "enrichment_results.zip"
+        input_files = [Path(result_root) / "combo_names.csv"]
+        input_files += sorted(Path(result_root).glob("*/filtered_gene_list.csv"))
+        input_files = [f for f in input_files if f.exists()]
+        etag = http_cache.input_etag(input_files, {
+            "route": "enrichplot", **params.dict(exclude={"execution_id", "dataset"})
+        })
+        if http_cache.etag_matches(request, etag):
+            progress.replay_done(params.execution_id, output_root)
+            return http_cache.not_modified(etag)
+        if http_cache.stored_etag(zip_path) == etag:
+            progress.replay_done(params.execution_id, output_root)
+            return http_cache.artifact_response(
+                request, zip_path, "application/zip", "enrichment_results.zip", etag
+            )
+
+        # 같은 입력/파라미터의 작업이 이미 대기/실행 중이면 그 작업 결과를 함께 받음
+        spec = {
+            "request": params.dict(), "result_root": result_root, "output_root": output_root,
+            "input_files": [str(f) for f in input_files], "etag": etag,
+        }
+        return tasks.dispatch(request, "enrichplot", spec, lambda result: http_cache.artifact_response(
+            request, zip_path, "application/zip", "enrichment_results.zip", etag
+        ), key=etag, execution_id=params.execution_id, output_root=output_root, lock=output_root, inputs=input_files)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@tasks.task("enrichplot")
+def enrichplot_task(spec, ctx):
+    """Worker side of ``POST /enrichplot/``: R run + ZIP + ETag sidecar + enrichment store."""
+    params = EnrichplotParams(**spec["request"])
+    result_root, output_root = spec["result_root"], spec["output_root"]
+    zip_path = Path(output_root) / "enrichment_results.zip"
+    r_script_path = Path(__file__).resolve().parent.parent / "rcode" / "run_enrichplot.R"
+
+    # Rscript 실행
+    cmd = [
+        "Rscript",
+        str(r_script_path),
+        result_root,
+        output_root,
+        params.org_db,
+        str(params.showCategory),
+        str(params.pvalueCutoff),
+        str(params.plot_width),
+        str(params.plot_height),
+    ]
+
+    result = ctx.run(cmd, params.execution_id, output_root)
+
+    if result.returncode != 0:
+        print("❌ Rscript stderr:", result.stderr)
+        raise tasks.TaskError(f"Rscript execution failed:\n{result.stderr}")
+
+    # 결과 폴더 압축
+    output_path = Path(output_root)
+    if not output_path.exists():
+        raise tasks.TaskError(f"Output directory not found: {output_root}")
+
+    # 결과 폴더 안에 ZIP 생성 (이어받기를 위해 응답 후에도 유지)
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for file in output_path.rglob("*"):
+            if file.is_file() and file.name not in (zip_path.name, zip_path.name + ".etag"):
+                arcname = file.relative_to(output_path)
+                zipf.write(file, arcname)
+
+    http_cache.store_etag(zip_path, spec["etag"])
+
+    # 조회/비교용 Parquet store 에 결과 반영 (실패해도 분석 결과 응답은 그대로)
+    try:
+        enrichment_store.ingest(params.dataset or enrichment_store.dataset_name(output_root),
+                                enrich_root=output_root)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        print(f"[enrichment_store] ingest failed: {e}")
+
+    return tasks.artifact(zip_path, "application/zip", "enrichment_results.zip", spec["etag"])
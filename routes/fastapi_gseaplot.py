@@ -1,10 +1,17 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-import subprocess
+from pathlib import Path
+import re
 import os
+import numpy as np
+
+from app import gsea_store, row_index, tasks
 
 router = APIRouter(prefix="/gseaplot", tags=["GSEA Plot"])
 
+ONTOLOGIES = ("BP", "CC", "MF")
+
 class GSEAPayload(BaseModel):
     input_dir: str
     output_dir: str
@@ -14,11 +21,42 @@ class GSEAPayload(BaseModel):
     ont: str = "BP"
     idx: int = 1
 
+def _top_rows(input_dir, ont, store, n):
+    """Store rows of the ``n`` terms with the lowest p.adjust, read through gse_<ont>.csv's index."""
+    table = Path(input_dir) / f"gse_{ont}.csv"
+    idx = row_index.load_index(table) if table.exists() else None
+    if idx is None or not idx.has("padj"):
+        return store.top_by_padj(n)
+    top = idx.rows_at_most("padj", np.inf)[:n]
+    ids = idx.read_rows(top, usecols=["ID"]).loc[top, "ID"].astype(str)
+    pos = {tid: i for i, tid in enumerate(store.terms["ID"].astype(str))}
+    return [pos[tid] for tid in ids if tid in pos]
+
+
 # ----------------- Total gseaplot2 -----------------
-@router.post("/total")
-def run_gseaplot_total(payload: GSEAPayload):
+@tasks.task("gseaplot_total")
+def gseaplot_total_task(spec, ctx):
+    payload = GSEAPayload(**spec["payload"])
     os.makedirs(payload.output_dir, exist_ok=True)
-    r_script_path = os.path.join(os.path.dirname(__file__), "../../r/run_gseaplot_total.R")
+
+    # GSEA 완료 시 저장된 running score 배열이 있으면 R 없이 바로 그림
+    stores = {ont: gsea_store.load_store(payload.input_dir, ont) for ont in ONTOLOGIES}
+    if any(s is not None for s in stores.values()):
+        for ont, store in stores.items():
+            if store is None:
+                continue
+            rows = _top_rows(payload.input_dir, ont, store, payload.topN)
+            if not rows:
+                continue
+            out_name = f"gseaplot2_{ont}_top{len(rows)}.svg"
+            gsea_store.render_svg(
+                store, rows, os.path.join(payload.output_dir, out_name),
+                title=f"Top {len(rows)} enriched GO:{ont} terms",
+                width=payload.width, height=payload.height,
+            )
+        return {"message": "Total gseaplot2 generation completed!"}
+
+    r_script_path = os.path.join(os.path.dirname(__file__), "../rcode/run_gseaplot_total.R")
     if not os.path.exists(r_script_path):
         return {"error": f"R script not found: {r_script_path}"}
 
@@ -31,16 +69,32 @@ def run_gseaplot_total(payload: GSEAPayload):
         str(payload.width),
         str(payload.height)
     ]
-    result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8")
+    result = ctx.run(cmd)
     if result.returncode != 0:
         return {"error": result.stderr}
     return {"message": "Total gseaplot2 generation completed!"}
 
 # ----------------- GSEA Term Plot -----------------
-@router.post("/term")
-def run_gseaplot_term(payload: GSEAPayload):
+@tasks.task("gseaplot_term")
+def gseaplot_term_task(spec, ctx):
+    payload = GSEAPayload(**spec["payload"])
     os.makedirs(payload.output_dir, exist_ok=True)
-    r_script_path = os.path.join(os.path.dirname(__file__), "../../r/run_gseaplot_term.R")
+
+    store = gsea_store.load_store(payload.input_dir, payload.ont) if payload.ont in ONTOLOGIES else None
+    if store is not None:
+        if payload.idx < 1 or payload.idx > len(store):
+            return {"error": f"idx must be 1 ~ {len(store)}"}
+        term = store.terms.iloc[payload.idx - 1]
+        term_id = str(term["ID"])
+        out_name = "gseaplot_{}_idx{}_{}.svg".format(payload.ont, payload.idx, re.sub(r"[:/\\]+", "_", term_id))
+        gsea_store.render_svg(
+            store, [payload.idx - 1], os.path.join(payload.output_dir, out_name),
+            title=str(term.get("Description", term_id)),
+            width=payload.width, height=payload.height,
+        )
+        return {"message": f"GSEA Term plot ({payload.ont}, idx={payload.idx}) completed!"}
+
+    r_script_path = os.path.join(os.path.dirname(__file__), "../rcode/run_gseaplot_term.R")
     if not os.path.exists(r_script_path):
         return {"error": f"R script not found: {r_script_path}"}
 
@@ -54,7 +108,22 @@ def run_gseaplot_term(payload: GSEAPayload):
         payload.ont,
         str(payload.idx)
     ]
-    result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8")
+    result = ctx.run(cmd)
     if result.returncode != 0:
         return {"error": result.stderr}
-    return {"message": f"GSEA Term plot ({payload.ont}, idx={payload.idx}) completed!"}
\ No newline at end of file
+    return {"message": f"GSEA Term plot ({payload.ont}, idx={payload.idx}) completed!"}
+
+
+# 그리기(R 또는 running score 렌더링)는 worker 에서 수행
+@router.post("/total")
+def run_gseaplot_total(payload: GSEAPayload, request: Request):
+    return tasks.dispatch(request, "gseaplot_total", {"payload": payload.dict()},
+                          lambda result: JSONResponse(content=result), lock=payload.output_dir,
+                          inputs=[payload.input_dir])
+
+
+@router.post("/term")
+def run_gseaplot_term(payload: GSEAPayload, request: Request):
+    return tasks.dispatch(request, "gseaplot_term", {"payload": payload.dict()},
+                          lambda result: JSONResponse(content=result), lock=payload.output_dir,
+                          inputs=[payload.input_dir])
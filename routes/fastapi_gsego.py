@@ -1,12 +1,12 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
-import subprocess
-import os
+from typing import Optional
 import shutil
 import zipfile
 from pathlib import Path
 
+from app import enrichment_store, gsea_store, http_cache, progress, row_index, tasks
+
 router = APIRouter(prefix="/gsego", tags=["Gsego"])
 
 class GSEAParams(BaseModel):
@@ -18,13 +18,47 @@ class GSEAParams(BaseModel):
     pvalue_cutoff: float
     plot_width: float
     plot_height: float
+    execution_id: Optional[str] = None   # 지정 시 /api/progress/{execution_id} 로 진행 상황 전송
+    dataset: Optional[str] = None        # enrichment store 데이터셋 이름 (기본: out_dir 의 상위 폴더 이름)
 
 @router.post("/")
-def run_gsego(req: GSEAParams, background_tasks: BackgroundTasks):
+def run_gsego(req: GSEAParams, request: Request):
     """Run GSEA analysis using an external R script and return ZIP file."""
 
     # ✅ 출력 디렉토리 준비
     output_dir = Path(req.out_dir)
+    zip_path = output_dir / "gsego_results.zip"
+
+    input_file = Path(req.file_path)
+    if not input_file.exists():
+        raise HTTPException(status_code=400, detail=f"{input_file} does not exist.")
+    if req.dataset is not None and not enrichment_store.valid_name(req.dataset):
+        raise HTTPException(status_code=400, detail=f"Invalid dataset name: {req.dataset}")
+
+    # 입력 CSV 내용 + 파라미터 기반 ETag → 같으면 GSEA 재실행 없이 응답
+    etag = http_cache.input_etag([input_file], {"route": "gsego", **req.dict(exclude={"execution_id", "dataset"})})
+    if http_cache.etag_matches(request, etag):
+        progress.replay_done(req.execution_id, output_dir)
+        return http_cache.not_modified(etag)
+    if http_cache.stored_etag(zip_path) == etag:
+        progress.replay_done(req.execution_id, output_dir)
+        return http_cache.artifact_response(request, zip_path, "application/zip", "gsego_results.zip", etag)
+
+    # 같은 입력/파라미터의 작업이 이미 대기/실행 중이면 그 작업 결과를 함께 받음
+    spec = {"request": req.dict(), "etag": etag}
+    return tasks.dispatch(request, "gsego", spec, lambda result: http_cache.artifact_response(
+        request, zip_path, "application/zip", "gsego_results.zip", etag
+    ), key=etag, execution_id=req.execution_id, output_root=output_dir, lock=output_dir, inputs=[input_file])
+
+
+@tasks.task("gsego")
+def gsego_task(spec, ctx):
+    """Worker side of ``POST /gsego/``: GSEA in R + gsea_store + ZIP + ETag sidecar + enrichment store."""
+    req = GSEAParams(**spec["request"])
+    etag = spec["etag"]
+    output_dir = Path(req.out_dir)
+    zip_path = output_dir / "gsego_results.zip"
+
     if output_dir.exists():
         shutil.rmtree(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
@@ -32,7 +66,7 @@ def run_gsego(req: GSEAParams, background_tasks: BackgroundTasks):
     # ✅ R 스크립트 경로
     r_script_path = Path(__file__).resolve().parent.parent / "rcode" / "run_gsego.R"
     if not r_script_path.exists():
-        raise HTTPException(status_code=500, detail=f"R script not found at {r_script_path}")
+        raise tasks.TaskError(f"R script not found at {r_script_path}")
 
     # ✅ Rscript 실행 명령어
     cmd = [
@@ -45,38 +79,40 @@ def run_gsego(req: GSEAParams, background_tasks: BackgroundTasks):
         str(req.max_gs_size),
         str(req.pvalue_cutoff),
         str(req.plot_width),
-        str(req.plot_height),  
+        str(req.plot_height),
     ]
 
     print("Running command:", " ".join(cmd))
 
-    try:
-        result = subprocess.run(cmd, text=True, capture_output=True)
-
-        if result.returncode != 0:
-            print("❌ Rscript stderr:")
-            print(result.stderr)
-            raise HTTPException(
-                status_code=500,
-                detail=f"GSEA execution failed:\n{result.stderr}"
-            )
-
-        # ✅ 결과 ZIP으로 패키징
-        zip_path = output_dir / "gsego_results.zip"
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for file in output_dir.rglob("*"):
-                if file.is_file() and file != zip_path:
-                    arcname = file.relative_to(output_dir)
-                    zipf.write(file, arcname)
-
-        # ✅ ZIP 파일 응답 후 자동 삭제
-        background_tasks.add_task(zip_path.unlink)
-
-        return FileResponse(
-            zip_path,
-            media_type="application/zip",
-            filename="gsego_results.zip",
-        )
+    result = ctx.run(cmd, req.execution_id, output_dir)
+
+    if result.returncode != 0:
+        print("❌ Rscript stderr:")
+        print(result.stderr)
+        raise tasks.TaskError(f"GSEA execution failed:\n{result.stderr}")
+
+    # gseaplot 을 R 없이 그릴 수 있도록 term 별 running score 배열 생성
+    gsea_store.build_all(output_dir)
+
+    # GSEA 결과 테이블마다 p.adjust 정렬 / ID 인덱스 생성 (gseaplot, pathway_gene 의 top-N)
+    for result_csv in output_dir.glob("gse_*.csv"):
+        row_index.build_index(result_csv)
 
+    # ✅ 결과 ZIP으로 패키징 (인덱스 / lock 파일 제외)
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for file in output_dir.rglob("*"):
+            parts = file.relative_to(output_dir).parts
+            if (file.is_file() and file != zip_path and gsea_store.STORE_DIRNAME not in parts
+                    and not any(p.startswith(".") or p.endswith(".index") for p in parts)):
+                arcname = file.relative_to(output_dir)
+                zipf.write(file, arcname)
+
+    http_cache.store_etag(zip_path, etag)
+
+    # 조회/비교용 Parquet store 에 결과 반영 (실패해도 분석 결과 응답은 그대로)
+    try:
+        enrichment_store.ingest(req.dataset or enrichment_store.dataset_name(output_dir), gsea_dir=output_dir)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        print(f"[enrichment_store] ingest failed: {e}")
+
+    return tasks.artifact(zip_path, "application/zip", "gsego_results.zip", etag)
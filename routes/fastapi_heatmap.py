@@ -1,12 +1,71 @@
-from fastapi import APIRouter, Form, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Form, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
 from pathlib import Path
-import subprocess
+import tempfile
+from urllib.parse import quote
+
+from app import heatmap_tiles, http_cache, row_index, sample_matrix, tasks
 
 router = APIRouter(prefix="/heatmap", tags=["heatmap"])
 
+@tasks.task("heatmap")
+def heatmap_task(spec, ctx):
+    """Worker side of ``POST /heatmap/``: R run + ETag sidecar."""
+    csv_file = Path(spec["csv_path"])
+    output_path = Path(spec["output_path"])
+    top_n_genes = spec["top_n_genes"]
+
+    # R 스크립트 경로 (예: backend/scripts/run_heatmap.R)
+    r_script_path = Path(__file__).resolve().parent.parent / "rcode" / "run_heatmap.R"
+
+    input_csv = csv_file
+    tmp_csv = None
+    cache_args = []
+    cache = sample_matrix.load_cache(csv_file)
+    if cache is not None and cache.has_pvalue_order():
+        # 공유 sample matrix 캐시 (행렬, pvalue 순서, 샘플 간 거리) 를 R 이 직접 읽음
+        cache_args = [str(cache.dir)]
+    else:
+        # 정렬 인덱스로 pvalue 상위 N 개 행만 잘라서 R 에 전달 (전체 테이블 스캔 방지)
+        idx = row_index.load_index(csv_file)
+        if idx is not None and idx.has("pvalue"):
+            with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as tmp:
+                tmp_csv = Path(tmp.name)
+            input_csv = idx.write_rows(idx.top_n("pvalue", top_n_genes), tmp_csv)
+
+    # subprocess 명령어 구성
+    cmd = [
+        "Rscript",
+        str(r_script_path),
+        str(input_csv),
+        str(spec["width"]),
+        str(spec["height"]),
+        str(top_n_genes),
+        str(output_path),
+        *cache_args
+    ]
+
+    try:
+        result = ctx.run(cmd)
+    finally:
+        if tmp_csv is not None:
+            tmp_csv.unlink(missing_ok=True)
+
+    if result.returncode != 0:
+        print("❌ Rscript stderr:")
+        print(result.stderr)
+        raise tasks.TaskError(f"Rscript execution failed:\n{result.stderr}")
+
+    if not output_path.exists():
+        raise tasks.TaskError("Rscript finished but no SVG file was generated.")
+
+    http_cache.store_etag(output_path, spec["etag"])
+    return tasks.artifact(output_path, "image/svg+xml", "heatmap.svg", spec["etag"])
+
+
 @router.post("/")
-async def run_heatmap(
+def run_heatmap(
+    request: Request,
     csv_path: str = Form(...),
     width: float = Form(...),
     height: float = Form(...),
@@ -19,44 +78,90 @@ async def run_heatmap(
     # 출력 파일 경로
     output_path = csv_file.parent / "heatmap.svg"
 
-    # R 스크립트 경로 (예: backend/scripts/run_heatmap.R)
-    r_script_path = Path(__file__).resolve().parent.parent / "rcode" / "run_heatmap.R"
+    # 입력 CSV 내용 + 파라미터 기반 ETag → 같으면 R 실행 없이 응답
+    etag = http_cache.input_etag([csv_file], {
+        "route": "heatmap", "width": width, "height": height, "top_n_genes": top_n_genes
+    })
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag)
+    if http_cache.stored_etag(output_path) == etag:
+        return http_cache.artifact_response(request, output_path, "image/svg+xml", "heatmap.svg", etag)
+
+    # R 실행은 worker 가 처리 (완료될 때까지 기다렸다가 SVG 반환)
+    spec = {
+        "csv_path": str(csv_file), "output_path": str(output_path), "width": width,
+        "height": height, "top_n_genes": top_n_genes, "etag": etag,
+    }
+    return tasks.dispatch(request, "heatmap", spec, lambda result: http_cache.artifact_response(
+        request, output_path, "image/svg+xml", "heatmap.svg", etag
+    ), lock=output_path, inputs=[csv_file])
 
-    # subprocess 명령어 구성
-    cmd = [
-        "Rscript",
-        str(r_script_path),
-        str(csv_file),
-        str(width),
-        str(height),
-        str(top_n_genes),
-        str(output_path)
-    ]
 
+# ----------------- Whole-transcriptome tiled heatmap -----------------
+@tasks.task("heatmap_tiles")
+def heatmap_tiles_task(spec, ctx):
     try:
-        result = subprocess.run(cmd, text=True, capture_output=True)
-
-        if result.returncode != 0:
-            print("❌ Rscript stderr:")
-            print(result.stderr)
-            raise HTTPException(
-                status_code=500,
-                detail=f"Rscript execution failed:\n{result.stderr}"
-            )
-
-        if not output_path.exists():
-            raise HTTPException(
-                status_code=500,
-                detail="Rscript finished but no SVG file was generated."
-            )
-
-        return FileResponse(
-            path=output_path,
-            media_type="image/svg+xml",
-            filename="heatmap.svg"
-        )
-
-    except subprocess.SubprocessError as e:
-        raise HTTPException(status_code=500, detail=f"Subprocess error: {e}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        meta = heatmap_tiles.load_meta(spec["csv_path"], tile_size=spec["tile_size"])
+    except ValueError as e:
+        raise tasks.TaskError(str(e), 400)
+    return {"meta": meta}
+
+
+@router.post("/tiles")
+def build_heatmap_tiles(
+    request: Request,
+    csv_path: str = Form(...),
+    tile_size: int = Form(heatmap_tiles.TILE_SIZE)
+):
+    """Cluster the full matrix once and return the tile pyramid layout."""
+    csv_file = Path(csv_path).resolve()
+    if not csv_file.exists():
+        raise HTTPException(status_code=400, detail=f"{csv_file} does not exist.")
+    if not 16 <= tile_size <= 2048:
+        raise HTTPException(status_code=400, detail="tile_size must be between 16 and 2048")
+
+    def layout(meta):
+        return {
+            **{k: v for k, v in meta.items() if k != "source"},
+            "tile_url": "/api/heatmap/tiles/{level}/{x}/{y}?csv_path=" + quote(str(csv_file), safe=""),
+        }
+
+    meta = heatmap_tiles.load_meta(csv_file, build=False, tile_size=tile_size)
+    if meta is not None:
+        return layout(meta)
+
+    # 전체 행렬 클러스터링은 worker 에서 한 번만 수행
+    return tasks.dispatch(request, "heatmap_tiles", {"csv_path": str(csv_file), "tile_size": tile_size},
+                          lambda result: JSONResponse(content=layout(result["meta"])), lock=csv_file,
+                          inputs=[csv_file])
+
+
+@router.get("/tiles/labels")
+def heatmap_tile_labels(csv_path: str, start: int = 0, end: int = 256):
+    """Gene names for full-resolution rows [start, end) in clustered order."""
+    csv_file = Path(csv_path).resolve()
+    if heatmap_tiles.load_meta(csv_file, build=False) is None:
+        raise HTTPException(status_code=404, detail="Tile pyramid not built for this dataset.")
+    return {"start": start, "genes": heatmap_tiles.row_labels(csv_file, start, end)}
+
+
+@router.get("/tiles/{level}/{x}/{y}")
+def get_heatmap_tile(level: int, x: int, y: int, csv_path: str, format: str = "png"):
+    """One tile of the pyramid as a PNG or raw little-endian float32 z-scores."""
+    csv_file = Path(csv_path).resolve()
+    meta = heatmap_tiles.load_meta(csv_file, build=False)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Tile pyramid not built for this dataset.")
+
+    headers = {"Cache-Control": "private, max-age=3600"}
+    if format == "bin":
+        values = heatmap_tiles.tile_values(csv_file, meta, level, x, y)
+        if values is None:
+            raise HTTPException(status_code=404, detail="Tile out of range.")
+        headers.update({"X-Tile-Rows": str(values.shape[0]), "X-Tile-Cols": str(values.shape[1])})
+        return Response(values.astype("<f4").tobytes(), media_type="application/octet-stream", headers=headers)
+
+    path = heatmap_tiles.tile_png(csv_file, meta, level, x, y)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Tile out of range.")
+    return FileResponse(path, media_type="image/png", headers=headers)
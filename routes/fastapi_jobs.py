@@ -0,0 +1,65 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+from typing import List
+from pathlib import Path
+
+from app import http_cache, job_queue, scheduler, tasks
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+RCODE_DIR = Path(__file__).resolve().parent.parent / "rcode"
+
+
+class JobRequest(BaseModel):
+    route: str             # 어떤 분석 route 의 작업인지 (heatmap, gsego, ...)
+    script: str            # rcode/ 안의 R 스크립트 이름 (예: run_gsego.R)
+    args: List[str]        # 해당 route 가 Rscript 에 넘기는 인자 그대로
+    max_attempts: int = 3
+
+
+@router.post("/")
+def enqueue_job(req: JobRequest):
+    """Queue an Rscript job for the worker processes and return its id."""
+    script_path = (RCODE_DIR / req.script).resolve()
+    if script_path.parent != RCODE_DIR.resolve() or not script_path.exists():
+        raise HTTPException(status_code=400, detail=f"Unknown R script: {req.script}")
+
+    job_id = job_queue.enqueue(
+        req.route,
+        {"script": req.script, "args": req.args},
+        max_attempts=req.max_attempts,
+        lane=scheduler.classify(req.route, 0)
+    )
+    return {"job_id": job_id, "status": "queued"}
+
+
+@router.get("/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+
+@router.get("/{job_id}/artifact")
+def get_job_artifact(job_id: str, request: Request):
+    """Download the file a finished job produced (for requests sent with ``Prefer: respond-async``)."""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "failed":
+        raise tasks.job_error(job)
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+
+    result = job["result"] or {}
+    if "artifact" not in result:
+        raise HTTPException(status_code=404, detail="Job has no downloadable artifact")
+    path = Path(result["artifact"])
+    if not path.exists():
+        raise HTTPException(status_code=410, detail="Artifact no longer exists")
+    if result.get("etag"):
+        return http_cache.artifact_response(request, path, result["media_type"], result["filename"], result["etag"])
+    return FileResponse(path, media_type=result["media_type"], filename=result["filename"])
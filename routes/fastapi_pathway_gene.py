@@ -1,9 +1,13 @@
 import os
-import subprocess
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
+from pathlib import Path
+import tempfile
 import zipfile
-import io
+import numpy as np
+
+from app import profiling, row_index, tasks
 
 router = APIRouter(
     prefix="/pathway_gene",
@@ -19,57 +23,125 @@ class PathwayGeneRequest(BaseModel):
     width: float = 12.0
     height: float = 6.0
     max_setsize: int = 50
+    profile: bool = False   # 관리자 전용: Rprof + Python 샘플링 결과를 ZIP 에 포함
+
+ONTOLOGIES = ("BP", "CC", "MF")
+TERM_COLUMNS = ("ID", "setSize", "p.adjust", "core_enrichment")
+
+
+def _top_terms(eidx, k, max_setsize):
+    """Rows that can be among R's ``head(result[order(p.adjust), ], k)`` after the setSize filter.
+
+    The CSV keeps 15 significant digits, so ties at the k-th value are all
+    included; the result is a superset of R's pick, never a subset.
+    """
+    order = eidx.top_n("padj", eidx.meta["rows"])
+    m = 4 * k
+    while True:
+        df = eidx.read_rows(order[:m], usecols=lambda c: c in TERM_COLUMNS)
+        kept = df[~(df["setSize"] > max_setsize)] if "setSize" in df else df
+        if len(kept) >= k or m >= len(order):
+            break
+        m *= 2
+    vals = np.sort(kept["p.adjust"].dropna().to_numpy(dtype=float))
+    if len(vals) >= k:
+        # k 번째 값과 같은 값까지 모두 포함
+        df = eidx.read_rows(eidx.rows_at_most("padj", vals[k - 1]), usecols=lambda c: c in TERM_COLUMNS)
+        kept = df[~(df["setSize"] > max_setsize)] if "setSize" in df else df
+    return kept
+
+
+def _core_gene_rows(request, out_path):
+    """Write only the dataset rows run_pathway_gene.R can use; None means pass the whole CSV.
+
+    R keeps the fold changes of the core genes of each ontology's top pathways.
+    The subset is used only when every ontology's core genes are found under
+    ``Geneid`` as they are (otherwise R maps IDs with bitr over all genes).
+    """
+    if request.top_pathways < 1:
+        return None
+    idx = row_index.load_index(request.csv_path)
+    if idx is None or idx.meta.get("gene_column") != "Geneid":
+        return None
+    rows = []
+    for ont in ONTOLOGIES:
+        if not os.path.exists(os.path.join(request.edox_dir, f"gse_{ont}.rds")):
+            continue
+        table = Path(request.edox_dir) / f"gse_{ont}.csv"
+        eidx = row_index.load_index(table) if table.exists() else None
+        if eidx is None or not eidx.has("padj"):
+            return None
+        top = _top_terms(eidx, request.top_pathways, request.max_setsize)
+        if top.empty:
+            continue
+        genes = {g for core in top["core_enrichment"].dropna().astype(str) for g in core.split("/")}
+        found = idx.lookup(genes)
+        if len(found) == 0:
+            return None
+        rows.append(found)
+    return idx.write_rows(np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64), out_path)
 
-@router.post("/", response_class=None)  # ZIP 바이너리 반환
-def run_pathway_heatplot(request: PathwayGeneRequest):
-    # 요청값
-    edox_dir = request.edox_dir
-    csv_path = request.csv_path
+
+@tasks.task("pathway_gene")
+def pathway_gene_task(spec, ctx):
+    """Worker side of ``POST /pathway_gene/``: heatplots in R, packed as ``<output_dir>/pathway_gene.zip``."""
+    request = PathwayGeneRequest(**spec["request"])
     output_dir = request.output_dir
-    top_pathways = request.top_pathways
-    top_genes = request.top_genes_per_pathway
-    width = request.width
-    height = request.height
-    max_setsize = request.max_setsize
-
-    if not os.path.exists(csv_path):
-        raise HTTPException(status_code=400, detail=f"CSV file not found: {csv_path}")
-    if not os.path.exists(edox_dir):
-        raise HTTPException(status_code=400, detail=f"Edox directory not found: {edox_dir}")
     os.makedirs(output_dir, exist_ok=True)
 
     # R 스크립트 경로
-    r_script_path = os.path.join(os.path.dirname(__file__), "../../r/run_pathway_gene.R")
+    r_script_path = os.path.join(os.path.dirname(__file__), "../rcode/run_pathway_gene.R")
     if not os.path.exists(r_script_path):
-        raise HTTPException(status_code=500, detail=f"R script not found: {r_script_path}")
-
-    # subprocess 호출
-    cmd = [
-        "Rscript",
-        r_script_path,
-        csv_path,
-        edox_dir,
-        output_dir,
-        str(top_pathways),
-        str(top_genes),
-        str(width),
-        str(height),
-        str(max_setsize)
-    ]
-
-    try:
-        subprocess.run(cmd, check=True, text=True)
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(status_code=500, detail=f"R script execution failed: {e}")
+        raise tasks.TaskError(f"R script not found: {r_script_path}")
+
+    with profiling.Profile(output_dir, enabled=request.profile) as prof:
+        # 정렬 / 유전자 인덱스로 필요한 행만 골라 R 에 전달
+        with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as tmp:
+            tmp_csv = Path(tmp.name)
+        try:
+            input_csv = _core_gene_rows(request, tmp_csv) or request.csv_path
+
+            # subprocess 호출
+            cmd = [
+                "Rscript",
+                r_script_path,
+                str(input_csv),
+                request.edox_dir,
+                output_dir,
+                str(request.top_pathways),
+                str(request.top_genes_per_pathway),
+                str(request.width),
+                str(request.height),
+                str(request.max_setsize)
+            ]
+            result = prof.run(ctx, cmd)
+        finally:
+            tmp_csv.unlink(missing_ok=True)
+    if result.returncode != 0:
+        raise tasks.TaskError(f"R script execution failed: {result.stderr}")
 
     # 생성된 SVG들을 ZIP으로 반환
     svg_files = [os.path.join(output_dir, f) for f in os.listdir(output_dir) if f.endswith(".svg")]
     if not svg_files:
-        raise HTTPException(status_code=500, detail="No heatplot SVGs generated.")
+        raise tasks.TaskError("No heatplot SVGs generated.")
 
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w") as zipf:
-        for f in svg_files:
+    zip_path = os.path.join(output_dir, "pathway_gene.zip")
+    with zipfile.ZipFile(zip_path, "w") as zipf:
+        for f in svg_files + [str(p) for p in prof.paths.values()]:
             zipf.write(f, arcname=os.path.basename(f))
-    zip_buffer.seek(0)
-    return zip_buffer.read()
\ No newline at end of file
+    return tasks.artifact(zip_path, "application/zip", "pathway_gene.zip")
+
+
+@router.post("/")  # ZIP 바이너리 반환
+def run_pathway_heatplot(request: PathwayGeneRequest, http_request: Request):
+    if request.profile:
+        profiling.require_admin(http_request)
+
+    if not os.path.exists(request.csv_path):
+        raise HTTPException(status_code=400, detail=f"CSV file not found: {request.csv_path}")
+    if not os.path.exists(request.edox_dir):
+        raise HTTPException(status_code=400, detail=f"Edox directory not found: {request.edox_dir}")
+
+    return tasks.dispatch(http_request, "pathway_gene", {"request": request.dict()}, lambda result: FileResponse(
+        result["artifact"], media_type="application/zip", filename="pathway_gene.zip"
+    ), lock=request.output_dir, inputs=[request.csv_path, request.edox_dir])
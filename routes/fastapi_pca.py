@@ -1,9 +1,9 @@
-import subprocess
 from pathlib import Path
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 
+from app import http_cache, sample_matrix, tasks
+
 router = APIRouter(prefix="/pca", tags=["PCA"])
 
 # ✅ JSON 본문으로 받을 데이터 모델 정의
@@ -15,18 +15,19 @@ class PCARequest(BaseModel):
     pointsize: float
     text_size: float
 
-@router.post("/")
-async def run_pca(req: PCARequest):
-    csv_file = Path(req.csv_path).resolve()
-    if not csv_file.exists():
-        raise HTTPException(status_code=400, detail=f"{csv_file} does not exist.")
-
-    # 출력 파일 경로 (CSV와 동일 폴더에 pca.svg 저장)
-    output_path = csv_file.parent / "pca.svg"
+@tasks.task("pca")
+def pca_task(spec, ctx):
+    """Worker side of ``POST /pca/``: R run + ETag sidecar."""
+    req = PCARequest(**spec["request"])
+    csv_file = Path(spec["csv_path"])
+    output_path = Path(spec["output_path"])
 
     # R 스크립트 경로 (예: backend/rcode/run_pca.R)
     r_script_path = Path(__file__).resolve().parent.parent / "rcode" / "run_pca.R"
 
+    # 공유 sample matrix 캐시의 z-score 행렬을 R 이 직접 읽음 (없으면 CSV 파싱)
+    cache = sample_matrix.load_cache(csv_file)
+
     # subprocess 명령어 구성
     cmd = [
         "Rscript",
@@ -37,34 +38,42 @@ async def run_pca(req: PCARequest):
         str(req.pointshape),
         str(req.pointsize),
         str(req.text_size),
-        str(output_path)
+        str(output_path),
+        *([str(cache.dir)] if cache is not None else [])
     ]
 
-    try:
-        result = subprocess.run(cmd, text=True, capture_output=True)
-
-        if result.returncode != 0:
-            print("❌ Rscript stderr:")
-            print(result.stderr)
-            raise HTTPException(
-                status_code=500,
-                detail=f"Rscript execution failed:\n{result.stderr}"
-            )
-
-        if not output_path.exists():
-            raise HTTPException(
-                status_code=500,
-                detail="Rscript finished but no SVG file was generated."
-            )
-
-        # PCA 결과 SVG 파일 반환
-        return FileResponse(
-            path=output_path,
-            media_type="image/svg+xml",
-            filename="pca.svg"
-        )
-
-    except subprocess.SubprocessError as e:
-        raise HTTPException(status_code=500, detail=f"Subprocess error: {e}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+    result = ctx.run(cmd)
+
+    if result.returncode != 0:
+        print("❌ Rscript stderr:")
+        print(result.stderr)
+        raise tasks.TaskError(f"Rscript execution failed:\n{result.stderr}")
+
+    if not output_path.exists():
+        raise tasks.TaskError("Rscript finished but no SVG file was generated.")
+
+    http_cache.store_etag(output_path, spec["etag"])
+    return tasks.artifact(output_path, "image/svg+xml", "pca.svg", spec["etag"])
+
+
+@router.post("/")
+def run_pca(req: PCARequest, request: Request):
+    csv_file = Path(req.csv_path).resolve()
+    if not csv_file.exists():
+        raise HTTPException(status_code=400, detail=f"{csv_file} does not exist.")
+
+    # 출력 파일 경로 (CSV와 동일 폴더에 pca.svg 저장)
+    output_path = csv_file.parent / "pca.svg"
+
+    # 입력 CSV 내용 + 파라미터 기반 ETag → 같으면 R 실행 없이 응답
+    etag = http_cache.input_etag([csv_file], {"route": "pca", **req.dict()})
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag)
+    if http_cache.stored_etag(output_path) == etag:
+        return http_cache.artifact_response(request, output_path, "image/svg+xml", "pca.svg", etag)
+
+    # PCA 결과 SVG 는 worker 가 만든 뒤 반환
+    spec = {"request": req.dict(), "csv_path": str(csv_file), "output_path": str(output_path), "etag": etag}
+    return tasks.dispatch(request, "pca", spec, lambda result: http_cache.artifact_response(
+        request, output_path, "image/svg+xml", "pca.svg", etag
+    ), lock=output_path, inputs=[csv_file])
@@ -0,0 +1,212 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+from typing import List, Optional
+import math
+import shutil
+import tempfile
+import zipfile
+from pathlib import Path
+
+from app import tasks
+
+router = APIRouter(prefix="/pipeline", tags=["Pipeline"])
+
+RCODE_DIR = Path(__file__).resolve().parent.parent / "rcode"
+
+# stage 이름 -> (의존 stage, 결과 폴더 이름)
+STAGES = {
+    "deg":            (None,         "Deg"),
+    "enrichplot":     ("deg",        "Enrich"),
+    "cnetplot":       ("enrichplot", "Cnetplot"),
+    "emapplot":       ("enrichplot", "Emapplot"),
+    "gsego":          (None,         "Gsego"),
+    "ridgeplot":      (None,         "Ridgeplot"),
+    "gseaplot_total": ("ridgeplot",  "Gseaplot"),
+    "pathway_gene":   ("ridgeplot",  "PathwayGene"),
+}
+
+
+class PipelineRequest(BaseModel):
+    csv_path: str                  # 업로드된 발현/DEG CSV
+    work_root: str                 # stage 별 결과가 저장될 루트 폴더
+    outputs: List[str]             # 원하는 산출물 (STAGES 의 key)
+    fc_input: str = "1"
+    pval_input: str = "0.05"
+    fc_threshold: Optional[float] = None    # cnet/emap 대상 combo (기본: 첫 번째 threshold)
+    pval_threshold: Optional[float] = None
+    org_db: str = "org.Hs.eg.db"
+    showCategory: int = 10
+    pvalueCutoff: float = 0.05
+    gsea_file: Optional[str] = None         # gsego 입력 (gene, logFC)
+    min_gs_size: int = 10
+    max_gs_size: int = 500
+    topN: int = 10
+    top_pathways: int = 5
+    top_genes_per_pathway: int = 20
+    max_setsize: int = 50
+    plot_width: float = 8.0
+    plot_height: float = 6.0
+
+
+def resolve_stages(outputs):
+    """Return the requested stages plus every stage they depend on."""
+    unknown = [o for o in outputs if o not in STAGES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown pipeline outputs: {unknown}")
+    needed = set()
+    for name in outputs:
+        while name and name not in needed:
+            needed.add(name)
+            name = STAGES[name][0]
+    return needed
+
+
+def r_num(x):
+    """``as.character`` of an R double (what ``paste0`` puts in combo names).
+
+    R keeps up to 15 significant digits and writes the number in fixed notation
+    unless scientific notation is shorter: 0.001 -> "0.001", 0.0001 -> "1e-04",
+    1e5 -> "1e+05", 0.00015 -> "0.00015".
+    """
+    x = float(x)
+    if x == 0:
+        return "0"
+    if math.isinf(x):
+        return "Inf" if x > 0 else "-Inf"
+    mant, exp = f"{x:.14e}".split("e")
+    mant, exp = mant.rstrip("0").rstrip("."), int(exp)
+    sci = f"{mant}e{'-' if exp < 0 else '+'}{abs(exp):02d}"
+    digits = len(mant.lstrip("-").replace(".", ""))
+    fixed = f"{x:.{max(0, digits - 1 - exp)}f}"
+    return fixed if len(fixed) <= len(sci) else sci
+
+
+def select_combos(req: PipelineRequest):
+    """Combo names run_deg.R will create, filtered like the cnet/emap routes."""
+    fcs = [float(x) for x in req.fc_input.split(",")]
+    pvals = [float(x) for x in req.pval_input.split(",")]
+    fc_t = req.fc_threshold if req.fc_threshold is not None else fcs[0]
+    p_t = req.pval_threshold if req.pval_threshold is not None else pvals[0]
+    return [
+        f"FC{r_num(fc)}_p{r_num(p)}" for fc in fcs for p in pvals
+        if math.isclose(fc, fc_t, rel_tol=1e-3) and math.isclose(p, p_t, rel_tol=1e-3)
+    ]
+
+
+def stage_args(name, req: PipelineRequest, dirs, combos):
+    w, h = str(req.plot_width), str(req.plot_height)
+    if name == "deg":
+        return [req.csv_path, req.fc_input, req.pval_input, dirs["deg"]]
+    if name == "enrichplot":
+        return [dirs["deg"], dirs["enrichplot"], req.org_db, str(req.showCategory),
+                str(req.pvalueCutoff), w, h]
+    if name in ("cnetplot", "emapplot"):
+        return [dirs["enrichplot"], dirs[name], ",".join(combos), str(req.showCategory), w, h]
+    if name == "gsego":
+        return [req.gsea_file, dirs["gsego"], req.org_db, str(req.min_gs_size),
+                str(req.max_gs_size), str(req.pvalueCutoff), w, h]
+    if name == "ridgeplot":
+        return [req.csv_path, dirs["ridgeplot"], w, h]
+    if name == "gseaplot_total":
+        return [dirs["ridgeplot"], dirs["gseaplot_total"], str(req.topN), w, h]
+    if name == "pathway_gene":
+        return [req.csv_path, dirs["ridgeplot"], dirs["pathway_gene"], str(req.top_pathways),
+                str(req.top_genes_per_pathway), w, h, str(req.max_setsize)]
+    raise ValueError(name)
+
+
+def _r_str(value):
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def plan_width(stages):
+    """Most R processes run_pipeline.R would run at once (independent branches fork)."""
+    def width(names):
+        return sum(max(1, width([c for c in stages if STAGES[c][0] == n])) for n in names)
+    return max(1, width([s for s in stages if STAGES[s][0] is None]))
+
+
+def render_plan(stages, req: PipelineRequest, dirs, combos, max_parallel=1):
+    """Write the stage tree (and the fork budget) as R code for run_pipeline.R."""
+    def node(name):
+        children = [c for c in sorted(stages) if STAGES[c][0] == name]
+        script = RCODE_DIR / f"run_{name}.R"
+        args = ", ".join(_r_str(a) for a in stage_args(name, req, dirs, combos))
+        kids = ", ".join(node(c) for c in children)
+        return (f"list(name = {_r_str(name)}, file = {_r_str(script)}, "
+                f"args = c({args}), children = list({kids}))")
+
+    roots = [s for s in sorted(stages) if STAGES[s][0] is None]
+    return (f"max_parallel <- {int(max_parallel)}L\n"
+            "roots <- list(\n  " + ",\n  ".join(node(r) for r in roots) + "\n)\n")
+
+
+@tasks.task("pipeline")
+def pipeline_task(spec, ctx):
+    """Worker side of ``POST /pipeline/``: the whole DAG in one R session + one ZIP."""
+    req = PipelineRequest(**spec["request"])
+    stages = set(spec["stages"])
+    combos = spec["combos"]
+
+    # ✅ stage 별 결과 디렉토리 준비
+    work_root = Path(req.work_root).resolve()
+    dirs = {name: str(work_root / STAGES[name][1]) for name in STAGES}
+    for name in stages:
+        out = Path(dirs[name])
+        if out.exists():
+            shutil.rmtree(out)
+        out.mkdir(parents=True, exist_ok=True)
+
+    # R 쪽 fork 수는 큐에서 이 작업이 잡은 슬롯 수로 제한
+    plan_path = None
+    try:
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".R", delete=False, encoding="utf-8") as tmp_r:
+            tmp_r.write(render_plan(stages, req, dirs, combos, max_parallel=ctx.slots))
+            plan_path = tmp_r.name
+
+        cmd = ["Rscript", str(RCODE_DIR / "run_pipeline.R"), plan_path]
+        print("Running command:", " ".join(cmd))
+        result = ctx.run(cmd)
+    finally:
+        if plan_path:
+            Path(plan_path).unlink(missing_ok=True)
+
+    if result.returncode != 0:
+        print("❌ Rscript stderr:")
+        print(result.stderr)
+        raise tasks.TaskError(f"Pipeline execution failed:\n{result.stderr}")
+
+    # ✅ 모든 stage 결과를 하나의 ZIP 으로 묶음
+    zip_path = work_root / "pipeline_results.zip"
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for name in sorted(stages):
+            stage_dir = Path(dirs[name])
+            for file in stage_dir.rglob("*"):
+                if file.is_file():
+                    zipf.write(file, file.relative_to(work_root))
+
+    return tasks.artifact(zip_path, "application/zip", "pipeline_results.zip")
+
+
+@router.post("/")
+def run_pipeline(req: PipelineRequest, request: Request):
+    """Run the requested analysis DAG in one R session and return every artifact as one ZIP."""
+    csv_file = Path(req.csv_path).resolve()
+    if not csv_file.exists():
+        raise HTTPException(status_code=400, detail=f"{csv_file} does not exist.")
+
+    stages = resolve_stages(req.outputs)
+    if "gsego" in stages and not (req.gsea_file and Path(req.gsea_file).exists()):
+        raise HTTPException(status_code=400, detail="gsego requires an existing gsea_file")
+
+    combos = select_combos(req)
+    if {"cnetplot", "emapplot"} & stages and not combos:
+        raise HTTPException(status_code=400, detail="No matching combos found")
+
+    spec = {"request": req.dict(), "stages": sorted(stages), "combos": combos}
+    return tasks.dispatch(request, "pipeline", spec, lambda result: FileResponse(
+        result["artifact"],
+        media_type="application/zip",
+        filename="pipeline_results.zip"
+    ), lock=req.work_root, inputs=[csv_file], slots=plan_width(stages))
@@ -0,0 +1,67 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse
+import asyncio
+import json
+import mimetypes
+import time
+
+from app import progress
+
+router = APIRouter(prefix="/progress", tags=["Progress"])
+
+POLL_INTERVAL = 0.25
+CHANNEL_WAIT = 120  # 이 시간 안에 실행 요청이 오지 않으면 스트림 종료
+
+
+@router.get("/{execution_id}")
+async def stream_progress(execution_id: str, request: Request):
+    """Server-Sent Events stream of stage / file events for one execution."""
+    try:
+        last_id = int(request.headers.get("last-event-id", -1))
+    except ValueError:
+        last_id = -1
+
+    async def event_stream():
+        nonlocal last_id
+        # 실행 요청보다 SSE 연결이 먼저 올 수 있으므로 채널 생성을 기다림
+        # (채널은 worker 와 공유하는 SQLite 에 있으므로 조회는 스레드에서)
+        deadline = time.monotonic() + CHANNEL_WAIT
+        while (ch := await asyncio.to_thread(progress.get_channel, execution_id)) is None:
+            if await request.is_disconnected():
+                return
+            if time.monotonic() >= deadline:
+                yield f"event: error\ndata: {json.dumps({'detail': 'Unknown execution'})}\n\n"
+                return
+            await asyncio.sleep(POLL_INTERVAL)
+
+        while True:
+            events, closed = await asyncio.to_thread(ch.since, last_id)
+            for ev in events:
+                last_id = ev["id"]
+                yield f"id: {ev['id']}\nevent: {ev['event']}\ndata: {json.dumps(ev['data'])}\n\n"
+            if closed and not events:
+                return
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(POLL_INTERVAL)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/{execution_id}/files")
+def download_progress_file(execution_id: str, path: str):
+    """Download a figure/CSV reported by an execution while it is still running."""
+    ch = progress.get_channel(execution_id)
+    if ch is None or ch.output_root is None:
+        raise HTTPException(status_code=404, detail="Unknown execution")
+
+    file_path = (ch.output_root / path).resolve()
+    if ch.output_root not in file_path.parents or not file_path.is_file():
+        raise HTTPException(status_code=404, detail="File not found")
+
+    media_type = mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+    return FileResponse(file_path, media_type=media_type, filename=file_path.name)
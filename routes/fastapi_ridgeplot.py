@@ -1,49 +1,63 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import JSONResponse
-import subprocess
 import os
 from pathlib import Path
 
+from app import gsea_store, profiling, tasks
+
 router = APIRouter(prefix="/ridgeplot", tags=["Ridgeplot"])
 
+@tasks.task("ridgeplot")
+def ridgeplot_task(spec, ctx):
+    """Worker side of ``POST /ridgeplot/``: R run (optionally profiled) + gsea_store."""
+    input_file, output_dir = spec["input_file"], spec["output_dir"]
+    profile = spec["profile"]
+    os.makedirs(output_dir, exist_ok=True)
+
+    # ✅ R 스크립트 경로 (예: backend/rcode/run_ridgeplot.R)
+    r_script_path = Path(__file__).resolve().parent.parent / "rcode" / "run_ridgeplot.R"
+
+    # ✅ Rscript 명령어 인자 구성
+    cmd = [
+        "Rscript",
+        str(r_script_path),
+        input_file,
+        output_dir,
+        str(spec["width"]),
+        str(spec["height"])
+    ]
+
+    # ✅ Rscript 실행 (profile 이면 R 과 Python 작업 모두 프로파일링)
+    with profiling.Profile(output_dir, enabled=profile) as prof:
+        result = prof.run(ctx, cmd)
+        if result.returncode != 0:
+            raise tasks.TaskError(result.stderr)
+
+        # gseaplot 을 R 없이 그릴 수 있도록 term 별 running score 배열 생성
+        gsea_store.build_all(output_dir)
+
+    content = {"message": "Ridgeplot GSEA completed successfully!", "stdout": result.stdout}
+    if prof.paths:
+        content["profile"] = {k: str(v) for k, v in prof.paths.items()}
+    return content
+
+
 @router.post("/")
-async def run_ridgeplot(request_data: dict):
-    try:
-        input_file = request_data.get("input_file")
-        output_dir = request_data.get("output_dir")
-        width = request_data.get("width")
-        height = request_data.get("height")
-
-        if not all([input_file, output_dir, width, height]):
-            raise HTTPException(status_code=400, detail="Missing required parameters.")
-
-        os.makedirs(output_dir, exist_ok=True)
-
-        # ✅ R 스크립트 경로 (예: backend/rcode/run_ridgeplot.R)
-        r_script_path = Path(__file__).resolve().parent.parent / "rcode" / "run_ridgeplot.R"
-
-        # ✅ Rscript 명령어 인자 구성
-        cmd = [
-            "Rscript",
-            str(r_script_path),
-            input_file,
-            output_dir,
-            str(width),
-            str(height)
-        ]
-
-        # ✅ Rscript 실행
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            encoding="utf-8"
-        )
-
-        if result.returncode == 0:
-            return JSONResponse(content={"message": "Ridgeplot GSEA completed successfully!", "stdout": result.stdout})
-        else:
-            raise HTTPException(status_code=500, detail=result.stderr)
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+def run_ridgeplot(request_data: dict, request: Request):
+    input_file = request_data.get("input_file")
+    output_dir = request_data.get("output_dir")
+    width = request_data.get("width")
+    height = request_data.get("height")
+    profile = profiling.parse_flag(request_data.get("profile"))
+
+    if not all([input_file, output_dir, width, height]):
+        raise HTTPException(status_code=400, detail="Missing required parameters.")
+
+    # 프로파일링은 관리자 요청만 허용
+    if profile:
+        profiling.require_admin(request)
+
+    spec = {"input_file": input_file, "output_dir": output_dir, "width": width, "height": height,
+            "profile": profile}
+    return tasks.dispatch(request, "ridgeplot", spec, lambda result: JSONResponse(content=result),
+                          lock=output_dir, inputs=[input_file])
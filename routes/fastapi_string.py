@@ -1,85 +1,103 @@
 # fastapi_string.py
 import os
-import subprocess
-import tempfile
-from fastapi import APIRouter, HTTPException, Form
-from pydantic import BaseModel
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from fastapi import APIRouter, HTTPException, Form, Request
 from typing import Optional
 from fastapi.responses import JSONResponse
+import pandas as pd
 
-router = APIRouter(prefix="/run-string", tags=["STRING Network"])
+from app import string_engine, tasks
 
-class STRINGRequest(BaseModel):
-    input_root: str
-    combo_file: str
-    output_dir: str
-    taxon_id: int
-    cutoff: float
-    limit: int
+router = APIRouter(prefix="/run-string", tags=["STRING Network"])
 
-@router.post("/")
-async def run_string(
-    input_root: str = Form(...),
-    combo_file: str = Form(...),
-    output_dir: str = Form(...),
-    taxon_id: int = Form(...),
-    cutoff: float = Form(...),
-    limit: int = Form(...)
-):
-    try:
-        os.makedirs(output_dir, exist_ok=True)
+SYMBOL_COLUMNS = ("geneid", "gene_symbol", "symbol")
 
-        # 임시 R 스크립트 생성
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".R", delete=False, encoding="utf-8") as tmp_r:
-            r_script_path = tmp_r.name
+def _read_genes(gene_csv: Path):
+    df = pd.read_csv(gene_csv, dtype=str)
+    sym_col = next((c for c in df.columns if c.lower() in SYMBOL_COLUMNS), None)
+    if sym_col is None:
+        return []
+    genes = df[sym_col].dropna().str.strip()
+    return list(dict.fromkeys(g for g in genes if g))
 
-            tmp_r.write(f"""
-library(RCy3)
-library(readr)
 
-ping <- tryCatch(cytoscapePing(), error=function(e) NULL)
-if (is.null(ping)) stop("Cytoscape not reachable at localhost:1234")
+def _read_combo_names(combo_path: Path, ctx):
+    # 기존 RDS (character vector) 와 combo 열이 있는 CSV 둘 다 허용
+    if combo_path.suffix.lower() == ".rds":
+        result = ctx.run(
+            ["Rscript", "-e", "writeLines(as.character(readRDS(commandArgs(TRUE)[1])))", str(combo_path)]
+        )
+        if result.returncode != 0:
+            raise tasks.TaskError(f"Cannot read {combo_path}: {result.stderr}", 400)
+        return [nm for nm in result.stdout.splitlines() if nm]
 
-combo_names <- readRDS(file.path("{input_root}", "{combo_file}"))
-result_root <- "{input_root}"
-out_dir     <- "{output_dir}"
+    df = pd.read_csv(combo_path, dtype=str)
+    if "combo" not in df.columns:
+        raise tasks.TaskError(f"{combo_path} has no 'combo' column", 400)
+    return df["combo"].dropna().tolist()
 
-for (nm in combo_names) {{
-    combo_dir <- file.path(result_root, nm)
-    f <- file.path(combo_dir, "filtered_gene_list.csv")
-    if (!file.exists(f)) next
 
-    df <- read.csv(f, check.names = FALSE, stringsAsFactors = FALSE)
-    sym_col <- grep("^(Geneid|Gene_Symbol|SYMBOL)$", names(df), ignore.case=TRUE, value=TRUE)[1]
-    if (is.na(sym_col)) next
+def _run_combo(index, nm, input_root, output_dir, cutoff, limit):
+    f = Path(input_root) / nm / "filtered_gene_list.csv"
+    if not f.exists():
+        return nm, None
+    genes = _read_genes(f)
+    if len(genes) < 2:
+        return nm, None
 
-    genes <- unique(na.omit(trimws(as.character(df[[sym_col]]))))
-    if (length(genes) < 2) next
+    combo_out = Path(output_dir) / nm
+    combo_out.mkdir(parents=True, exist_ok=True)
+    svg_path = combo_out / f"STRING_{nm}.svg"
+    return nm, string_engine.build_network(index, genes, cutoff, limit, svg_path, title=f"STRING_{nm}")
 
-    gene_str <- paste(genes, collapse=",")
 
-    cmd <- sprintf('string protein query query="%s" taxonID=%d cutoff=%s limit=%d',
-                   gene_str, {taxon_id}, {cutoff}, {limit})
-    commandsRun(cmd)
+@tasks.task("string")
+def string_task(spec, ctx):
+    """Worker side of ``POST /run-string/``: local STRING networks for every combo."""
+    input_root, output_dir = spec["input_root"], spec["output_dir"]
+    os.makedirs(output_dir, exist_ok=True)
+    combo_names = _read_combo_names(Path(input_root) / spec["combo_file"], ctx)
 
-    net_suid <- getNetworkSuid()
-    net_name <- paste0("STRING_", nm)
-    renameNetwork(net_name, network=net_suid)
+    # 로컬 STRING 인덱스 (최초 호출 시 links/info 파일로부터 생성 후 캐시)
+    try:
+        index = string_engine.load_index(spec["taxon_id"], spec["string_data_dir"])
+    except FileNotFoundError as e:
+        raise tasks.TaskError(str(e), 404)
 
-    combo_out <- file.path(out_dir, nm)
-    if (!dir.exists(combo_out)) dir.create(combo_out, recursive=TRUE)
-    out_file <- file.path(combo_out, paste0("STRING_", nm, ".svg"))
-    fitContent()
-    exportImage(out_file, type="SVG")
-}}
-""")
+    # combo 별 네트워크는 서로 독립적이므로 병렬 처리
+    with ThreadPoolExecutor(max_workers=min(8, max(1, len(combo_names)))) as pool:
+        results = dict(pool.map(
+            lambda nm: _run_combo(index, nm, input_root, output_dir, spec["cutoff"], spec["limit"]),
+            combo_names
+        ))
 
-        # Rscript 실행
-        result = subprocess.run(["Rscript", r_script_path], capture_output=True, text=True, encoding="utf-8")
-        if result.returncode != 0:
-            raise HTTPException(status_code=500, detail=result.stderr)
+    networks = {nm: r for nm, r in results.items() if r is not None}
+    return {
+        "success": True,
+        "message": "STRING network generation completed.",
+        "networks": networks
+    }
 
-        return JSONResponse(content={"success": True, "message": "STRING network generation completed."})
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+@router.post("/")
+def run_string(
+    request: Request,
+    input_root: str = Form(...),
+    combo_file: str = Form(...),
+    output_dir: str = Form(...),
+    taxon_id: int = Form(...),
+    cutoff: float = Form(...),
+    limit: int = Form(...),
+    string_data_dir: Optional[str] = Form(None)
+):
+    combo_path = Path(input_root) / combo_file
+    if not combo_path.exists():
+        raise HTTPException(status_code=404, detail=f"{combo_path} not found")
+
+    spec = {
+        "input_root": input_root, "combo_file": combo_file, "output_dir": output_dir,
+        "taxon_id": taxon_id, "cutoff": cutoff, "limit": limit, "string_data_dir": string_data_dir,
+    }
+    return tasks.dispatch(request, "string", spec, lambda result: JSONResponse(content=result),
+                          lock=output_dir)
@@ -1,18 +1,37 @@
 # fastapi_upload.py
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from pathlib import Path
+import shutil
+
+from app import row_index, sample_matrix
 
 router = APIRouter(prefix="/upload-csv", tags=["Upload CSV"])
 
+COPY_CHUNK = 1024 * 1024
+
+
+# 파일 복사와 인덱스 생성이 이벤트 루프를 막지 않도록 sync 핸들러(스레드풀)로 실행
 @router.post("/")
-async def upload_csv(file: UploadFile = File(...), target_dir: str = Form(...)):
+def upload_csv(file: UploadFile = File(...), target_dir: str = Form(...)):
     try:
         target_path = Path(target_dir)
         target_path.mkdir(parents=True, exist_ok=True)  # 경로 없으면 생성
 
+        # 업로드 본문을 메모리에 올리지 않고 chunk 단위로 디스크에 복사
         file_path = target_path / file.filename
         with open(file_path, "wb") as f:
-            f.write(await file.read())
+            shutil.copyfileobj(file.file, f, COPY_CHUNK)
+
+        # 업로드 시점에 pvalue 정렬 인덱스와 sample matrix 캐시 생성 (둘 다 chunk 단위로 읽음)
+        if file_path.suffix.lower() == ".csv":
+            try:
+                row_index.build_index(file_path)
+            except Exception as e:
+                print(f"⚠️ row index build failed for {file_path}: {e}")
+            try:
+                sample_matrix.build_cache(file_path)
+            except Exception as e:
+                print(f"⚠️ sample matrix cache build failed for {file_path}: {e}")
 
         return {"message": f"{file.filename} saved successfully at {file_path}"}
 
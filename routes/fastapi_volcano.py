@@ -1,31 +1,47 @@
 import os
-import subprocess
 import tempfile
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from pathlib import Path
+from typing import Optional
+
+from app import http_cache, tasks
 
 router = APIRouter(prefix="/volcano", tags=["R Analysis"])
 
+STREAM_R = (Path(__file__).resolve().parent.parent / "rcode" / "stream_csv.R").as_posix()
+# R 메모리 예산(MB): 테이블을 통째로 읽으면 예산을 넘을 때 필요한 열만 chunk 단위로 읽음 (0 이면 항상 전체 읽기)
+VOLCANO_MEMORY_BUDGET_MB = float(os.environ.get("VOLCANO_MEMORY_BUDGET_MB", os.environ.get("DEG_MEMORY_BUDGET_MB", 0)))
+
 class VolcanoRequest(BaseModel):
     csv_path: str
     fc_cutoff: float
     pval_cutoff: float
-
-@router.post("/")
-def run_volcano(req: VolcanoRequest):
-    """기본 Volcano Plot"""
-    csv_path = Path(req.csv_path).resolve()
-    if not csv_path.exists():
-        raise HTTPException(status_code=400, detail=f"{csv_path} does not exist.")
-
-    output_svg = csv_path.with_name(csv_path.stem + "_volcano.svg")
-
-    r_code = f"""
+    memory_budget_mb: Optional[float] = None
+
+
+def _read_table_r(req: VolcanoRequest, columns, budget):
+    """R code that loads ``data`` either whole or as a stream of chunks holding only ``columns``.
+
+    Both ways keep every row with a positive fold change, so the plot is the
+    same; streaming only drops the columns the plot does not use.
+    """
+    classes = ", ".join(f'{name} = "{cls}"' for name, cls in columns.items())
+    return f"""
+source('{STREAM_R}')
+if (csv_needs_stream('{req.csv_path}', {budget})) {{
+    data <- csv_collect('{req.csv_path}', csv_chunk_rows('{req.csv_path}', {budget}),
+                        csv_select_classes('{req.csv_path}', c({classes})),
+                        function(chunk) chunk[!is.na(chunk$foldchange) & chunk$foldchange > 0, ])
+}} else {{
+    data <- read_csv('{req.csv_path}')
+}}"""
+
+def _volcano_r(req: VolcanoRequest, output_svg, budget):
+    return f"""
 library(readr)
 library(ggplot2)
-data <- read_csv('{req.csv_path}')
+{_read_table_r(req, {"foldchange": "numeric", "pvalue": "numeric"}, budget)}
 data <- data[!is.na(data$foldchange) & data$foldchange > 0, ]
 data$log2FC <- log2(data$foldchange)
 fc_cutoff <- {req.fc_cutoff}
@@ -45,47 +61,12 @@ volcano_plot <- ggplot(data, aes(x=log2FC, y=-log10(pvalue), color=group)) +
 ggsave(filename='{output_svg}', plot=volcano_plot, width=8, height=6, dpi=300, device='svg')
 """
 
-    try:
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".R", delete=False, encoding="utf-8") as tmp_r:
-            tmp_r.write(r_code)
-            tmp_r_path = tmp_r.name
-
-        result = subprocess.run(["Rscript", tmp_r_path], text=True, capture_output=True)
-        os.remove(tmp_r_path)
-
-        if result.returncode != 0:
-            print("❌ Rscript stderr:")
-            print(result.stderr)
-            raise HTTPException(status_code=500, detail=f"Rscript failed:\n{result.stderr}")
-
-        if not output_svg.exists():
-            raise HTTPException(status_code=500, detail="SVG file was not created.")
-
-        return FileResponse(
-            path=output_svg,
-            media_type="image/svg+xml",
-            filename=output_svg.name
-        )
-
-    except subprocess.SubprocessError as e:
-        raise HTTPException(status_code=500, detail=f"Subprocess error: {e}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@router.post("/enhanced")
-def run_enhanced_volcano(req: VolcanoRequest):
-    """Enhanced Volcano Plot"""
-    csv_path = Path(req.csv_path).resolve()
-    if not csv_path.exists():
-        raise HTTPException(status_code=400, detail=f"{csv_path} does not exist.")
-
-    output_svg = csv_path.with_name(csv_path.stem + "_enhanced_volcano.svg")
 
-    r_code = f"""
+def _enhanced_volcano_r(req: VolcanoRequest, output_svg, budget):
+    return f"""
 library(readr)
 library(EnhancedVolcano)
-data <- read_csv('{req.csv_path}')
+{_read_table_r(req, {"foldchange": "numeric", "pvalue": "numeric", "Gene_Symbol": "character"}, budget)}
 data <- data[!is.na(data$foldchange) & data$foldchange > 0, ]
 data$log2FC <- log2(data$foldchange)
 res <- data.frame(log2FoldChange=data$log2FC, pvalue=data$pvalue)
@@ -105,29 +86,68 @@ EnhancedVolcano(res,
 dev.off()
 """
 
-    try:
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".R", delete=False, encoding="utf-8") as tmp_r:
-            tmp_r.write(r_code)
-            tmp_r_path = tmp_r.name
 
-        result = subprocess.run(["Rscript", tmp_r_path], text=True, capture_output=True)
+PLOTS = {"volcano": _volcano_r, "enhanced_volcano": _enhanced_volcano_r}
+
+
+@tasks.task("volcano")
+def volcano_task(spec, ctx):
+    """Worker side of both volcano routes: R run + ETag sidecar."""
+    req = VolcanoRequest(**spec["request"])
+    output_svg = Path(spec["output_svg"])
+    r_code = PLOTS[spec["plot"]](req, output_svg, spec["memory_budget_mb"])
+
+    with tempfile.NamedTemporaryFile(mode="w", suffix=".R", delete=False, encoding="utf-8") as tmp_r:
+        tmp_r.write(r_code)
+        tmp_r_path = tmp_r.name
+
+    try:
+        result = ctx.run(["Rscript", tmp_r_path])
+    finally:
         os.remove(tmp_r_path)
 
-        if result.returncode != 0:
-            print("❌ Rscript stderr:")
-            print(result.stderr)
-            raise HTTPException(status_code=500, detail=f"Rscript failed:\n{result.stderr}")
+    if result.returncode != 0:
+        print("❌ Rscript stderr:")
+        print(result.stderr)
+        raise tasks.TaskError(f"Rscript failed:\n{result.stderr}")
+
+    if not output_svg.exists():
+        raise tasks.TaskError("SVG file was not created.")
 
-        if not output_svg.exists():
-            raise HTTPException(status_code=500, detail="SVG file was not created.")
+    http_cache.store_etag(output_svg, spec["etag"])
+    return tasks.artifact(output_svg, "image/svg+xml", output_svg.name, spec["etag"])
 
-        return FileResponse(
-            path=output_svg,
-            media_type="image/svg+xml",
-            filename=output_svg.name
-        )
 
-    except subprocess.SubprocessError as e:
-        raise HTTPException(status_code=500, detail=f"Subprocess error: {e}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+def _run_plot(plot, suffix, req: VolcanoRequest, request: Request):
+    csv_path = Path(req.csv_path).resolve()
+    if not csv_path.exists():
+        raise HTTPException(status_code=400, detail=f"{csv_path} does not exist.")
+
+    output_svg = csv_path.with_name(csv_path.stem + suffix)
+
+    etag = http_cache.input_etag([csv_path], {"route": plot, **req.dict(exclude={"memory_budget_mb"})})
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag)
+    if http_cache.stored_etag(output_svg) == etag:
+        return http_cache.artifact_response(request, output_svg, "image/svg+xml", output_svg.name, etag)
+
+    # 예산은 API 쪽 환경변수로 정해 spec 에 담음 (worker 컨테이너의 환경과 무관하게)
+    spec = {
+        "plot": plot, "request": req.dict(), "csv_path": str(csv_path), "output_svg": str(output_svg), "etag": etag,
+        "memory_budget_mb": req.memory_budget_mb if req.memory_budget_mb is not None else VOLCANO_MEMORY_BUDGET_MB,
+    }
+    return tasks.dispatch(request, "volcano", spec, lambda result: http_cache.artifact_response(
+        request, output_svg, "image/svg+xml", output_svg.name, etag
+    ), lock=output_svg, inputs=[csv_path])
+
+
+@router.post("/")
+def run_volcano(req: VolcanoRequest, request: Request):
+    """기본 Volcano Plot"""
+    return _run_plot("volcano", "_volcano.svg", req, request)
+
+
+@router.post("/enhanced")
+def run_enhanced_volcano(req: VolcanoRequest, request: Request):
+    """Enhanced Volcano Plot"""
+    return _run_plot("enhanced_volcano", "_enhanced_volcano.svg", req, request)
@@ -0,0 +1,66 @@
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from app import string_engine
+
+FIXTURES = Path(__file__).parent / "fixtures" / "string"
+LINKS = "9606.protein.links.v12.0.txt"
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    shutil.copytree(FIXTURES, tmp_path / "string")
+    string_engine._index_cache.clear()
+    yield tmp_path / "string"
+    string_engine._index_cache.clear()
+
+
+def edge_names(idx, genes, cutoff=0.4, limit=0):
+    nodes, _, edges = idx.query(genes, cutoff=cutoff, limit=limit)
+    names = [idx.names[n] for n in nodes]
+    return {(*sorted((names[a], names[b])), s) for a, b, s in edges}
+
+
+def test_query(data_dir):
+    idx = string_engine.load_index(9606, str(data_dir))
+    assert edge_names(idx, ["TP53", "MDM2", "ATM"]) == {("MDM2", "TP53", 0.999), ("ATM", "TP53", 0.7)}
+    assert edge_names(idx, ["tp53", "ATM"], cutoff=0.8) == set()
+
+    nodes, query_mask, _ = idx.query(["TP53"], cutoff=0.8, limit=5)
+    assert [idx.names[n] for n in nodes] == ["TP53", "MDM2", "CDKN1A"]
+    assert query_mask.tolist() == [True, False, False]
+
+    meta = json.loads((data_dir / "9606.index" / "meta.json").read_text())
+    assert meta["n_proteins"] == 5 and meta["n_links"] == 8
+    assert meta["source"]["links"]["size"] == (data_dir / LINKS).stat().st_size
+
+
+def test_rebuild_on_source_change(data_dir):
+    idx = string_engine.load_index(9606, str(data_dir))
+    assert string_engine.load_index(9606, str(data_dir)) is idx
+
+    links = data_dir / LINKS
+    st = links.stat()
+    with open(links, "a") as f:
+        f.write("9606.ENSP0005 9606.ENSP0001 800\n9606.ENSP0001 9606.ENSP0005 800\n")
+    os.utime(links, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    new = string_engine.load_index(9606, str(data_dir))
+    assert new is not idx
+    assert ("EGFR", "TP53", 0.8) in edge_names(new, ["TP53", "EGFR"])
+    assert json.loads((data_dir / "9606.index" / "meta.json").read_text())["n_links"] == 10
+    # 빌드용 임시 디렉토리는 남지 않음
+    assert sorted(p.name for p in data_dir.iterdir() if ".index." in p.name) == [".9606.index.lock"]
+
+
+def test_concurrent_builds(data_dir):
+    links, info = data_dir / LINKS, data_dir / "9606.protein.info.v12.0.txt"
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda _: string_engine.build_index(links, info, data_dir / "9606.index"), range(8)))
+    idx = string_engine.load_index(9606, str(data_dir))
+    assert edge_names(idx, ["TP53", "MDM2"]) == {("MDM2", "TP53", 0.999)}
@@ -0,0 +1,120 @@
+"""Standalone worker: pulls analysis jobs from the SQLite queue and runs them.
+
+Run one or more of these next to the API (same shared volume):
+
+    python worker.py --db data/jobs.db --concurrency 4
+
+Each job is executed by the task function its route registered in
+:mod:`app.tasks` (R run plus the route's post-processing).
+"""
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+from app import job_queue, progress, scheduler, tasks
+import fastapi_app  # noqa: F401  (route 모듈을 import 해야 작업 함수가 등록됨)
+
+_stop = threading.Event()
+
+
+def run_job(job, worker_id, lease, db_path):
+    print(f"[worker {worker_id}] job {job['id']} ({job['route']}) attempt {job['attempts']}")
+
+    # 작업이 도는 동안 주기적으로 리스 연장, 리스를 잃으면 R 프로세스 종료
+    ctx = tasks.Context((job["spec"].get("progress") or {}).get("execution_id"), slots=job.get("slots") or 1)
+    lost = threading.Event()
+    done = threading.Event()
+
+    def beat():
+        while not done.wait(lease / 3):
+            if not job_queue.heartbeat(job["id"], worker_id, lease, db_path):
+                lost.set()
+                ctx.cancel()
+                return
+
+    hb = threading.Thread(target=beat, daemon=True)
+    hb.start()
+    t0 = time.monotonic()
+    try:
+        result = tasks.run(job["route"], job["spec"], ctx)
+    except tasks.TaskError as e:
+        result, error = None, e
+    except Exception as e:
+        traceback.print_exc()
+        result, error = None, e
+    else:
+        error = None
+    finally:
+        done.set()
+        hb.join()
+
+    if lost.is_set():
+        print(f"[worker {worker_id}] lost lease on job {job['id']}")
+        return
+
+    # R 실행 전에 끝난 작업도 진행 상황 스트림이 끝나도록 채널을 닫음 (재시도할 작업은 그대로 둠)
+    # (실행 중에 합류한 요청이 채널을 붙였을 수 있으므로 spec 을 다시 읽음)
+    current = job_queue.get(job["id"], db_path) or job
+    execution_id = (current["spec"].get("progress") or {}).get("execution_id")
+    final = error is None or isinstance(error, tasks.TaskError) or job["attempts"] >= job["max_attempts"]
+    if execution_id and final:
+        if error is None:
+            progress.finish(execution_id, "done")
+        else:
+            progress.finish(execution_id, "error", detail=str(getattr(error, "detail", error))[-2000:])
+    if isinstance(error, tasks.TaskError):
+        print(f"❌ [worker {worker_id}] job {job['id']} failed")
+        job_queue.fail(job["id"], worker_id, str(error.detail)[-10000:], db_path,
+                       retry=False, status_code=error.status_code)
+    elif error is not None:
+        # 예상하지 못한 예외 (디스크, DB 등): 재시도 대상
+        job_queue.fail(job["id"], worker_id, str(error), db_path)
+    else:
+        # 성공한 실행 시간은 lane 분류용 비용 추정 기록으로 남김 (모든 worker 가 공유)
+        scheduler.observe(job["route"], job.get("input_bytes") or 0, time.monotonic() - t0, db_path)
+        job_queue.complete(job["id"], worker_id, result, db_path)
+
+
+def work_loop(worker_id, args):
+    while not _stop.is_set():
+        job = scheduler.claim(worker_id, args.lease, args.db)
+        if job is None:
+            _stop.wait(args.poll)
+            continue
+        try:
+            run_job(job, worker_id, args.lease, args.db)
+        except Exception as e:
+            job_queue.fail(job["id"], worker_id, str(e), args.db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analysis job worker")
+    parser.add_argument("--db", default=job_queue.JOB_QUEUE_DB)
+    parser.add_argument("--lease", type=float, default=job_queue.DEFAULT_LEASE)
+    parser.add_argument("--poll", type=float, default=1.0)
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get("WORKER_CONCURRENCY", 2)))
+    args = parser.parse_args()
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    signal.signal(signal.SIGTERM, lambda *_: _stop.set())
+    signal.signal(signal.SIGINT, lambda *_: _stop.set())
+    print(f"[worker {worker_id}] polling {args.db} with {args.concurrency} slots")
+
+    # 슬롯마다 claim → 실행 루프 (같은 worker_id 로 리스를 잡음)
+    threads = [
+        threading.Thread(target=work_loop, args=(f"{worker_id}-{i}", args), daemon=True)
+        for i in range(max(1, args.concurrency))
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+if __name__ == "__main__":
+    main()